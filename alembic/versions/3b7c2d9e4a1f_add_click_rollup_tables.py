@@ -0,0 +1,43 @@
+"""add click rollup tables and site total_clicks
+
+Revision ID: 3b7c2d9e4a1f
+Revises: 1f540990e7eb
+Create Date: 2026-10-18 10:12:41.503112
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3b7c2d9e4a1f'
+down_revision: Union[str, None] = '1f540990e7eb'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # rollups start empty, fill them from the raw clicks with `python -m app.cli rebuild-rollups`
+    for table_name in ('click_hourly', 'click_daily'):
+        op.create_table(table_name,
+        sa.Column('url_id', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+        sa.Column('bucket', sa.DateTime(), nullable=False),
+        sa.Column('browser', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+        sa.Column('os', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+        sa.Column('device', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+        sa.Column('clicks', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['url_id'], ['site.url_key'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('url_id', 'bucket', 'browser', 'os', 'device')
+        )
+    op.add_column('site', sa.Column('total_clicks', sa.Integer(), server_default='0', nullable=False))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('site', 'total_clicks')
+    op.drop_table('click_daily')
+    op.drop_table('click_hourly')
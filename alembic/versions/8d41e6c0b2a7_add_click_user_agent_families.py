@@ -0,0 +1,35 @@
+"""add click browser, os and device columns
+
+Revision ID: 8d41e6c0b2a7
+Revises: 3b7c2d9e4a1f
+Create Date: 2026-10-18 11:02:17.284530
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8d41e6c0b2a7'
+down_revision: Union[str, None] = '3b7c2d9e4a1f'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # existing rows stay NULL here, the next revision (c5f09a7e13d4) parses every click's user agent and
+    # replaces these columns with a reference to the user_agent table
+    op.add_column('click', sa.Column('browser', sqlmodel.sql.sqltypes.AutoString(), nullable=True))
+    op.add_column('click', sa.Column('os', sqlmodel.sql.sqltypes.AutoString(), nullable=True))
+    op.add_column('click', sa.Column('device', sqlmodel.sql.sqltypes.AutoString(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('click', 'device')
+    op.drop_column('click', 'os')
+    op.drop_column('click', 'browser')
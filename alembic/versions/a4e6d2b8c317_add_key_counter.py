@@ -0,0 +1,32 @@
+"""add key_counter for block allocated short keys
+
+Revision ID: a4e6d2b8c317
+Revises: f7c3d1a95e28
+Create Date: 2026-10-18 16:02:11.507384
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a4e6d2b8c317'
+down_revision: Union[str, None] = 'f7c3d1a95e28'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('key_counter',
+    sa.Column('length', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('next_value', sa.BigInteger(), nullable=False),
+    sa.PrimaryKeyConstraint('length')
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('key_counter')
@@ -0,0 +1,31 @@
+"""add (user_id, created_at, url_key) index on site
+
+Revision ID: b9d3f5a27e64
+Revises: a4e6d2b8c317
+Create Date: 2026-10-18 16:41:27.830519
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b9d3f5a27e64'
+down_revision: Union[str, None] = 'a4e6d2b8c317'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # built without blocking link creation on postgres
+    with op.get_context().autocommit_block():
+        op.create_index('ix_site_user_id_created_at_url_key', 'site', ['user_id', 'created_at', 'url_key'], unique=False, postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_site_user_id_created_at_url_key', table_name='site', postgresql_concurrently=True)
@@ -0,0 +1,114 @@
+"""intern click user agents into a user_agent dimension table
+
+Revision ID: c5f09a7e13d4
+Revises: 8d41e6c0b2a7
+Create Date: 2026-10-18 12:26:05.917342
+
+"""
+from hashlib import blake2b
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+from user_agents import parse
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c5f09a7e13d4'
+down_revision: Union[str, None] = '8d41e6c0b2a7'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# clicks converted per statement batch
+BATCH_SIZE = 10000
+
+user_agent_table = sa.table('user_agent',
+    sa.column('id', sa.Integer()),
+    sa.column('ua_hash', sa.BigInteger()),
+    sa.column('user_agent', sa.String()),
+    sa.column('browser', sa.String()),
+    sa.column('os', sa.String()),
+    sa.column('device', sa.String()),
+)
+
+
+def ua_hash(user_agent: str) -> int:
+    return int.from_bytes(blake2b(user_agent.encode("utf-8"), digest_size=8).digest(), "big", signed=True)
+
+
+def click_id_batches(bind):
+    low, high = bind.execute(sa.text("SELECT min(id), max(id) FROM click")).one()
+    if low is None:
+        return
+    for start in range(low - 1, high, BATCH_SIZE):
+        yield start, start + BATCH_SIZE
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    bind = op.get_bind()
+    op.create_table('user_agent',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('ua_hash', sa.BigInteger(), nullable=False),
+    sa.Column('user_agent', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+    sa.Column('browser', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+    sa.Column('os', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+    sa.Column('device', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('ua_hash')
+    )
+    op.add_column('click', sa.Column('user_agent_id', sa.Integer(), nullable=True))
+
+    # intern the distinct user agents of each id range, then point that range's clicks at them
+    ids = {}
+    for low, high in click_id_batches(bind):
+        user_agents = bind.execute(
+            sa.text("SELECT DISTINCT user_agent FROM click WHERE id > :low AND id <= :high"),
+            {"low": low, "high": high},
+        ).scalars().all()
+        new = [user_agent for user_agent in user_agents if user_agent not in ids]
+        for user_agent in new:
+            ua = parse(user_agent)
+            result = bind.execute(
+                user_agent_table.insert().returning(user_agent_table.c.id),
+                {"ua_hash": ua_hash(user_agent), "user_agent": user_agent,
+                 "browser": ua.browser.family, "os": ua.os.family, "device": ua.device.family},
+            )
+            ids[user_agent] = result.scalar_one()
+        bind.execute(
+            sa.text("UPDATE click SET user_agent_id = :user_agent_id WHERE user_agent = :user_agent AND id > :low AND id <= :high"),
+            [{"user_agent_id": ids[user_agent], "user_agent": user_agent, "low": low, "high": high} for user_agent in user_agents],
+        )
+
+    with op.batch_alter_table('click') as batch_op:
+        batch_op.alter_column('user_agent_id', existing_type=sa.Integer(), nullable=False)
+        batch_op.create_foreign_key('click_user_agent_id_fkey', 'user_agent', ['user_agent_id'], ['id'])
+        batch_op.drop_column('device')
+        batch_op.drop_column('os')
+        batch_op.drop_column('browser')
+        batch_op.drop_column('user_agent')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    bind = op.get_bind()
+    op.add_column('click', sa.Column('user_agent', sqlmodel.sql.sqltypes.AutoString(), nullable=True))
+    op.add_column('click', sa.Column('browser', sqlmodel.sql.sqltypes.AutoString(), nullable=True))
+    op.add_column('click', sa.Column('os', sqlmodel.sql.sqltypes.AutoString(), nullable=True))
+    op.add_column('click', sa.Column('device', sqlmodel.sql.sqltypes.AutoString(), nullable=True))
+
+    for low, high in click_id_batches(bind):
+        bind.execute(
+            sa.text(
+                "UPDATE click SET user_agent = ua.user_agent, browser = ua.browser, os = ua.os, device = ua.device "
+                "FROM user_agent AS ua WHERE ua.id = click.user_agent_id AND click.id > :low AND click.id <= :high"
+            ),
+            {"low": low, "high": high},
+        )
+
+    with op.batch_alter_table('click') as batch_op:
+        batch_op.alter_column('user_agent', existing_type=sqlmodel.sql.sqltypes.AutoString(), nullable=False)
+        batch_op.drop_constraint('click_user_agent_id_fkey', type_='foreignkey')
+        batch_op.drop_column('user_agent_id')
+    op.drop_table('user_agent')
@@ -0,0 +1,66 @@
+"""add hot path indexes and unique (user_id, target_url_hash)
+
+Revision ID: e2a8b4f61c90
+Revises: c5f09a7e13d4
+Create Date: 2026-10-18 13:40:52.118406
+
+"""
+from hashlib import blake2b
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e2a8b4f61c90'
+down_revision: Union[str, None] = 'c5f09a7e13d4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# sites hashed per statement batch
+BATCH_SIZE = 10000
+
+
+def hash64(value: str) -> int:
+    return int.from_bytes(blake2b(value.encode("utf-8"), digest_size=8).digest(), "big", signed=True)
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    bind = op.get_bind()
+    op.add_column('site', sa.Column('target_url_hash', sa.BigInteger(), nullable=True))
+
+    last = ''
+    while True:
+        sites = bind.execute(
+            sa.text("SELECT url_key, target_url FROM site WHERE url_key > :last ORDER BY url_key LIMIT :limit"),
+            {"last": last, "limit": BATCH_SIZE},
+        ).all()
+        if not sites:
+            break
+        bind.execute(
+            sa.text("UPDATE site SET target_url_hash = :target_url_hash WHERE url_key = :url_key"),
+            [{"target_url_hash": hash64(target_url), "url_key": url_key} for url_key, target_url in sites],
+        )
+        last = sites[-1][0]
+
+    # fails if a user already has the same target url twice, remove those duplicates first
+    with op.batch_alter_table('site') as batch_op:
+        batch_op.alter_column('target_url_hash', existing_type=sa.BigInteger(), nullable=False)
+        batch_op.create_unique_constraint('uq_site_user_id_target_url_hash', ['user_id', 'target_url_hash'])
+
+    # build the click indexes without locking out the click flusher on postgres
+    with op.get_context().autocommit_block():
+        op.create_index('ix_click_url_id_id', 'click', ['url_id', 'id'], unique=False, postgresql_concurrently=True)
+        op.create_index(op.f('ix_click_timestamp'), 'click', ['timestamp'], unique=False, postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.drop_index(op.f('ix_click_timestamp'), table_name='click', postgresql_concurrently=True)
+        op.drop_index('ix_click_url_id_id', table_name='click', postgresql_concurrently=True)
+    with op.batch_alter_table('site') as batch_op:
+        batch_op.drop_constraint('uq_site_user_id_target_url_hash', type_='unique')
+        batch_op.drop_column('target_url_hash')
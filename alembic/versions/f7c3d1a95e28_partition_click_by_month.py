@@ -0,0 +1,109 @@
+"""partition click by month on timestamp
+
+Revision ID: f7c3d1a95e28
+Revises: e2a8b4f61c90
+Create Date: 2026-10-18 15:08:33.640917
+
+"""
+from datetime import datetime, timezone
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f7c3d1a95e28'
+down_revision: Union[str, None] = 'e2a8b4f61c90'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# clicks copied per statement batch
+BATCH_SIZE = 50000
+# partitions created past the current month, later ones come from `python -m app.cli maintain-partitions`
+MONTHS_AHEAD = 3
+
+
+def add_months(month: datetime, months: int) -> datetime:
+    index = month.year * 12 + month.month - 1 + months
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def copy_clicks(bind, source: str, target: str):
+    low, high = bind.execute(sa.text(f"SELECT min(id), max(id) FROM {source}")).one()
+    if low is None:
+        return
+    for start in range(low - 1, high, BATCH_SIZE):
+        bind.execute(
+            sa.text(
+                f"INSERT INTO {target} (id, url_id, timestamp, user_agent_id) "
+                f"SELECT id, url_id, timestamp, user_agent_id FROM {source} WHERE id > :low AND id <= :high"
+            ),
+            {"low": start, "high": start + BATCH_SIZE},
+        )
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    bind = op.get_bind()
+    # sqlite has no declarative partitioning, the model keeps a plain click table there
+    if bind.dialect.name != 'postgresql':
+        return
+
+    op.execute("ALTER TABLE click RENAME TO click_unpartitioned")
+    op.execute("ALTER INDEX ix_click_url_id_id RENAME TO ix_click_unpartitioned_url_id_id")
+    op.execute("ALTER INDEX ix_click_timestamp RENAME TO ix_click_unpartitioned_timestamp")
+    op.execute("""
+        CREATE TABLE click (
+            id INTEGER NOT NULL DEFAULT nextval('click_id_seq'),
+            url_id VARCHAR NOT NULL REFERENCES site (url_key) ON DELETE CASCADE,
+            timestamp TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+            user_agent_id INTEGER NOT NULL REFERENCES user_agent (id),
+            CONSTRAINT click_id_timestamp_key UNIQUE (id, timestamp)
+        ) PARTITION BY RANGE (timestamp)
+    """)
+    # keep the id sequence alive when the old table is dropped
+    op.execute("ALTER SEQUENCE click_id_seq OWNED BY click.id")
+    op.create_index('ix_click_url_id_id', 'click', ['url_id', 'id'], unique=False)
+    op.create_index(op.f('ix_click_timestamp'), 'click', ['timestamp'], unique=False)
+
+    oldest = bind.execute(sa.text("SELECT min(timestamp) FROM click_unpartitioned")).scalar()
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    month = datetime((oldest or now).year, (oldest or now).month, 1)
+    last = add_months(datetime(now.year, now.month, 1), MONTHS_AHEAD)
+    while month <= last:
+        op.execute(
+            f"CREATE TABLE click_{month:%Y_%m} PARTITION OF click "
+            f"FOR VALUES FROM ('{month:%Y-%m-%d}') TO ('{add_months(month, 1):%Y-%m-%d}')"
+        )
+        month = add_months(month, 1)
+
+    copy_clicks(bind, 'click_unpartitioned', 'click')
+    op.drop_table('click_unpartitioned')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    bind = op.get_bind()
+    if bind.dialect.name != 'postgresql':
+        return
+
+    op.execute("ALTER TABLE click RENAME TO click_partitioned")
+    op.execute("ALTER INDEX ix_click_url_id_id RENAME TO ix_click_partitioned_url_id_id")
+    op.execute("ALTER INDEX ix_click_timestamp RENAME TO ix_click_partitioned_timestamp")
+    op.execute("""
+        CREATE TABLE click (
+            id INTEGER NOT NULL DEFAULT nextval('click_id_seq'),
+            url_id VARCHAR NOT NULL REFERENCES site (url_key) ON DELETE CASCADE,
+            timestamp TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+            user_agent_id INTEGER NOT NULL REFERENCES user_agent (id),
+            PRIMARY KEY (id)
+        )
+    """)
+    op.execute("ALTER SEQUENCE click_id_seq OWNED BY click.id")
+    op.create_index('ix_click_url_id_id', 'click', ['url_id', 'id'], unique=False)
+    op.create_index(op.f('ix_click_timestamp'), 'click', ['timestamp'], unique=False)
+
+    copy_clicks(bind, 'click_partitioned', 'click')
+    # dropping the parent drops every partition with it
+    op.drop_table('click_partitioned')
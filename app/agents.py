@@ -0,0 +1,39 @@
+from sqlmodel import select
+
+from .cache import LRUCache
+from .config import settings
+from .database import dialect_insert
+from .models import UserAgent, hash64
+from .utils import get_browser_info
+
+
+# user agent string -> user_agent.id, rows are never deleted so entries do not expire
+user_agent_ids = LRUCache(maxsize=settings.user_agent_cache_size, ttl=float("inf"))
+
+# Ids of the given user agent strings, interning the ones that are not in the table yet.
+# Runs in its own transaction so that only committed ids are ever cached.
+async def get_user_agent_ids(engine, user_agents) -> dict[str, int]:
+    ids, missing = {}, {}
+    for user_agent in set(user_agents):
+        user_agent_id = user_agent_ids.get(user_agent)
+        if user_agent_id is None:
+            missing[hash64(user_agent)] = user_agent
+        else:
+            ids[user_agent] = user_agent_id
+    if not missing:
+        return ids
+
+    async with engine.begin() as conn:
+        rows = []
+        for ua_hash, user_agent in sorted(missing.items()):
+            info = get_browser_info(user_agent)
+            rows.append({"ua_hash": ua_hash, "user_agent": user_agent, **info._asdict()})
+        statement = dialect_insert(conn, UserAgent.__table__).on_conflict_do_nothing(index_elements=["ua_hash"])
+        await conn.execute(statement, rows)
+        found = await conn.execute(select(UserAgent.ua_hash, UserAgent.id).where(UserAgent.ua_hash.in_(list(missing))))
+        found = found.all()
+
+    for ua_hash, user_agent_id in found:
+        user_agent_ids.set(missing[ua_hash], user_agent_id)
+        ids[missing[ua_hash]] = user_agent_id
+    return ids
@@ -0,0 +1,46 @@
+from sqlmodel import select, func
+
+from .models import Click, ClickDaily, Site, UserAgent
+
+
+# Click totals and per day / browser / os / device breakdowns read from the daily rollup
+async def get_click_stats(site: Site, session) -> dict:
+    async def breakdown(column):
+        statement = (
+            select(column, func.sum(ClickDaily.clicks))
+            .where(ClickDaily.url_id == site.url_key)
+            .group_by(column)
+            .order_by(column)
+        )
+        return {key: int(count) for key, count in await session.exec(statement)}
+
+    per_day = await breakdown(ClickDaily.bucket)
+    return {
+        "total_clicks": site.total_clicks,
+        "clicks_per_day": {day.date().isoformat(): count for day, count in per_day.items()},
+        "browsers": await breakdown(ClickDaily.browser),
+        "operating_systems": await breakdown(ClickDaily.os),
+        "devices": await breakdown(ClickDaily.device),
+    }
+
+# The site with the first and last id of its clicks, which move when clicks arrive or expire. Both are
+# read from the ends of ix_click_url_id_id, cheap version markers for the analytics of a site.
+async def get_site_version(url_key: str, session) -> tuple[Site, int | None, int | None] | None:
+    first_click = select(func.min(Click.id)).where(Click.url_id == Site.url_key).scalar_subquery()
+    last_click = select(func.max(Click.id)).where(Click.url_id == Site.url_key).scalar_subquery()
+    return (await session.exec(select(Site, first_click, last_click).where(Site.url_key == url_key))).first()
+
+# One page of clicks ordered by id, after is the last click id of the previous page
+async def get_clicks_page(url_key: str, session, after: int | None = None, limit: int = 100) -> tuple[list[dict], int | None]:
+    statement = (
+        select(Click.id, Click.timestamp, UserAgent.browser, UserAgent.os, UserAgent.device)
+        .join(UserAgent, Click.user_agent_id == UserAgent.id)
+        .where(Click.url_id == url_key)
+    )
+    if after is not None:
+        statement = statement.where(Click.id > after)
+    clicks = (await session.exec(statement.order_by(Click.id).limit(limit + 1))).all()
+
+    next_cursor = clicks[limit - 1].id if len(clicks) > limit else None
+    clicks_detail = [click._asdict() for click in clicks[:limit]]
+    return clicks_detail, next_cursor
@@ -1,58 +1,83 @@
 from typing import Annotated
-from datetime import datetime, timedelta, timezone
+from dataclasses import dataclass
+from datetime import datetime, timedelta
 from fastapi import HTTPException, Depends
 from fastapi.security import OAuth2PasswordBearer
-import jwt
 from jwt.exceptions import InvalidTokenError
 
+from .cache import LRUCache, redirect_lookup
 from .config import settings
 from .database import SessionDep
-from .schemas import UserRead, TokenData
+from .schemas import TokenData
 from .models import User
+from .tokens import token_service
 from .utils import get_user_from_db
 
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login/")
+
+# Immutable snapshot of the authenticated user, what the routes need without holding an ORM row
+@dataclass(frozen=True, slots=True)
+class Principal:
+    id: int
+    username: str
+    email: str
+    active: bool
+    updated_at: datetime
+
+    @classmethod
+    def from_user(cls, user: User) -> "Principal":
+        return cls(id=user.id, username=user.username, email=user.email, active=user.active, updated_at=user.updated_at)
+
+# token sub -> Principal. Entries are dropped in every worker when the user changes, over the cache
+# invalidation channel. Without CACHE_REDIS_URL only this worker's entry is dropped and the short ttl
+# bounds how long the other workers keep a stale snapshot.
+principal_cache = LRUCache(maxsize=settings.principal_cache_size, ttl=settings.principal_cache_ttl)
+redirect_lookup.link("principal", principal_cache)
+
+async def invalidate_principal(username: str):
+    await redirect_lookup.invalidate_linked("principal", username)
  
-# create access token for user
+# create access token for user, signed with the token service's active key
 def create_access_token(data: dict, expires_delta: timedelta | None = None):
-    to_encode = data.copy()
-    if expires_delta:
-        expire = datetime.now(timezone.utc) + expires_delta
-    else:
-        expire = datetime.now(timezone.utc) + timedelta(minutes=15)
-
-    to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, settings.secret_key, algorithm=settings.algorithm)
-    return encoded_jwt
-
-# get current user from token, decode token, check if user exists in db     
-async def get_current_user(token: Annotated[str, Depends(oauth2_scheme)], session: SessionDep) -> UserRead:
+    return token_service.encode(data, expires_delta or timedelta(minutes=15))
+
+# get current user from token, decode token, check if user exists in db. The user is read from the
+# principal cache first, the uid claim (tokens issued since it was added) must match the cached user.
+async def get_current_user(token: Annotated[str, Depends(oauth2_scheme)], session: SessionDep) -> Principal:
     credantials_exception = HTTPException(
         status_code=401,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
     try:
-        payload = jwt.decode(token, settings.secret_key, algorithms=[settings.algorithm])
+        payload = token_service.decode(token)
         username = payload.get("sub")
         if username is None:
             raise credantials_exception
         token_data = TokenData(username=username)
+        user_id = payload.get("uid")
     except InvalidTokenError:
         raise credantials_exception
-    user = get_user_from_db(token_data.username, session)
-    
-    if not user:
+
+    principal = principal_cache.get(token_data.username)
+    if principal is None or (user_id is not None and principal.id != user_id):
+        user = await get_user_from_db(token_data.username, session)
+        if not user:
+            raise credantials_exception
+        principal = Principal.from_user(user)
+        principal_cache.set(token_data.username, principal)
+
+    if user_id is not None and principal.id != user_id:
         raise credantials_exception
-    return user
+    return principal
 
 # get current active user
-async def get_current_active_user(current_user: Annotated[User, Depends(get_current_user)]):
+async def get_current_active_user(current_user: Annotated[Principal, Depends(get_current_user)]):
     if not current_user.active:
         raise HTTPException(status_code=400, detail="Inactive user")
     return current_user
 
 # This is a dependency that provides the current active user to the route handlers.
-CurrentUserDep = Annotated[User, Depends(get_current_active_user)]
+CurrentUserDep = Annotated[Principal, Depends(get_current_active_user)]
 
@@ -0,0 +1,182 @@
+import asyncio
+import logging
+import math
+from time import monotonic
+
+from sqlmodel import func, select
+
+from .config import settings
+from .models import Site
+
+
+logger = logging.getLogger(__name__)
+
+SCAN_BATCH_SIZE = 10000
+HASH_SALT = 0x5BD1E995
+
+
+# Bloom filter over strings: no false negatives, false positives at about error_rate while it holds
+# at most capacity items. Bit positions come from two hashes by double hashing. They are Python's own
+# string hashes, randomized per process, which is fine for a filter that never leaves its process.
+class BloomFilter:
+    def __init__(self, num_bits: int, num_hashes: int):
+        self.num_bits = num_bits
+        self.num_hashes = num_hashes
+        self.count = 0
+        self.bits = bytearray((num_bits + 7) // 8)
+
+    @classmethod
+    def for_capacity(cls, capacity: int, error_rate: float) -> "BloomFilter":
+        capacity = max(capacity, 1)
+        num_bits = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        num_hashes = max(1, round(num_bits / capacity * math.log(2)))
+        return cls(num_bits, num_hashes)
+
+    def add(self, item: str):
+        bits, num_bits = self.bits, self.num_bits
+        first, second = hash(item), hash((item, HASH_SALT)) | 1
+        for i in range(self.num_hashes):
+            position = (first + i * second) % num_bits
+            bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def update(self, items):
+        for item in items:
+            self.add(item)
+
+    def __contains__(self, item: str) -> bool:
+        bits, num_bits = self.bits, self.num_bits
+        first, second = hash(item), hash((item, HASH_SALT)) | 1
+        for i in range(self.num_hashes):
+            position = (first + i * second) % num_bits
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    @property
+    def size_bytes(self) -> int:
+        return len(self.bits)
+
+    # Expected false positive rate for the items added so far
+    def error_rate(self) -> float:
+        return (1 - math.exp(-self.num_hashes * self.count / self.num_bits)) ** self.num_hashes
+
+
+# Per-process filter over every Site.url_key, so redirects of keys that were never created are answered
+# without a database lookup. Built in the background at startup, it lets every key through until then.
+# New keys are added as they are created here or announced by other workers; deleted keys stay in the
+# filter (as false positives) until the next periodic rebuild. When announcements may have been missed
+# the filter is reset, it lets every key through again until the rebuild that the reset asks for.
+class KeyFilter:
+    def __init__(self, error_rate: float, min_capacity: int):
+        self.error_rate = error_rate
+        self.min_capacity = min_capacity
+        self.bloom: BloomFilter | None = None
+        self.rejected = 0
+        self.passed = 0
+        self.deleted = 0
+        self.builds = 0
+        self.last_build_seconds = 0.0
+        self.resets = 0
+        self._pending: list[str] | None = None
+        self._rebuild = asyncio.Event()
+
+    @property
+    def ready(self) -> bool:
+        return self.bloom is not None
+
+    def might_exist(self, key: str) -> bool:
+        if self.bloom is None:
+            return True
+        if key in self.bloom:
+            self.passed += 1
+            return True
+        self.rejected += 1
+        return False
+
+    def add(self, keys):
+        if self._pending is not None:
+            self._pending.extend(keys)
+        if self.bloom is not None:
+            self.bloom.update(keys)
+
+    def record_deleted(self, count: int = 1):
+        self.deleted += count
+
+    def reset(self):
+        self.bloom = None
+        self.resets += 1
+        self._rebuild.set()
+
+    # Returns when a rebuild is due, after interval seconds or as soon as a reset asks for one
+    async def wait_for_rebuild(self, interval: float):
+        try:
+            await asyncio.wait_for(self._rebuild.wait(), interval)
+        except asyncio.TimeoutError:
+            pass
+        self._rebuild.clear()
+
+    # Scans the keys into a new filter sized for twice the current count, then swaps it in. Keys added
+    # while the scan runs are replayed into the new filter, the scan may not see them. A build that a
+    # reset overlapped is dropped, the rebuild the reset asked for follows it.
+    async def build(self, engine):
+        started = monotonic()
+        resets = self.resets
+        self._pending = []
+        try:
+            async with engine.connect() as conn:
+                count = (await conn.execute(select(func.count()).select_from(Site))).scalar_one()
+                bloom = BloomFilter.for_capacity(max(2 * count, self.min_capacity), self.error_rate)
+                result = await conn.stream(select(Site.url_key).execution_options(yield_per=SCAN_BATCH_SIZE))
+                async for keys in result.scalars().partitions():
+                    bloom.update(keys)
+            bloom.update(self._pending)
+        finally:
+            self._pending = None
+        if self.resets != resets:
+            logger.info("Key filter reset while it was built, building it again")
+            return
+        self.bloom = bloom
+        self.deleted = 0
+        self.builds += 1
+        self.last_build_seconds = monotonic() - started
+        logger.info("Key filter built with %d keys, %d bytes in %.1fs", bloom.count, bloom.size_bytes, self.last_build_seconds)
+
+    def stats(self) -> dict:
+        bloom = self.bloom
+        return {
+            "ready": bloom is not None,
+            "keys": bloom.count if bloom else 0,
+            "size_bytes": bloom.size_bytes if bloom else 0,
+            "hashes": bloom.num_hashes if bloom else 0,
+            "error_rate": bloom.error_rate() if bloom else 0.0,
+            "rejected": self.rejected,
+            "passed": self.passed,
+            "deleted": self.deleted,
+            "builds": self.builds,
+            "resets": self.resets,
+            "last_build_seconds": self.last_build_seconds,
+        }
+
+# Background task started from the lifespan hook, builds the filter right away and then every interval
+async def run_key_filter_rebuild(key_filter: KeyFilter, engine, interval: float):
+    while True:
+        try:
+            await key_filter.build(engine)
+        except Exception:
+            logger.exception("Building the key filter failed")
+        await key_filter.wait_for_rebuild(interval)
+
+
+# Without the invalidation channel a process never hears of the keys created by other workers, replicas
+# or scripts writing the site table, and would answer them 404 until its next rebuild. Whether any of
+# those exist cannot be told from here, so the filter is refused rather than enabled.
+def make_key_filter() -> KeyFilter | None:
+    if not settings.bloom_enabled:
+        return None
+    if not settings.cache_redis_url:
+        logger.error("BLOOM_ENABLED needs CACHE_REDIS_URL, the key filter is disabled")
+        return None
+    return KeyFilter(settings.bloom_error_rate, settings.bloom_min_capacity)
+
+key_filter = make_key_filter()
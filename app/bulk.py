@@ -0,0 +1,218 @@
+import json
+from dataclasses import dataclass, field
+from pydantic import ValidationError
+from sqlmodel import select
+
+from .cache import redirect_lookup
+from .config import settings
+from .database import dialect_insert
+from .keys import KeyspaceExhausted, key_allocator
+from .models import Site, get_utc_now, hash64
+from .schemas import BulkSiteResult, SiteCreate
+
+
+NDJSON_TYPES = ("application/x-ndjson", "application/ndjson", "application/jsonl")
+EXISTS_DETAIL = "URL already exists in your database."
+
+# request body of POST /urls/bulk/, which is read by hand to accept NDJSON as well
+BULK_REQUEST_BODY = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "application/json": {"schema": {"type": "array", "items": SiteCreate.model_json_schema()}},
+            "application/x-ndjson": {"schema": SiteCreate.model_json_schema()},
+        },
+    },
+}
+
+
+class BulkRequestError(Exception):
+    def __init__(self, detail: str, status_code: int = 422):
+        super().__init__(detail)
+        self.detail = detail
+        self.status_code = status_code
+
+# One item of a bulk request, result is filled in as the item goes through create_sites
+@dataclass
+class BulkItem:
+    index: int
+    site: SiteCreate | None = None
+    error: str | None = None
+    target_url_hash: int | None = None
+    result: BulkSiteResult | None = field(default=None, repr=False)
+
+
+def is_ndjson(content_type: str | None) -> bool:
+    return (content_type or "").split(";")[0].strip().lower() in NDJSON_TYPES
+
+def _validate_item(index: int, value) -> BulkItem:
+    try:
+        site = SiteCreate.model_validate(value)
+    except ValidationError as exc:
+        return BulkItem(index, error=f"{exc.error_count()} validation error(s): {exc.errors()[0]['msg']}")
+    return BulkItem(index, site=site, target_url_hash=hash64(site.target_url))
+
+def _too_many_items(max_items: int) -> BulkRequestError:
+    return BulkRequestError(f"At most {max_items} URLs per request", status_code=413)
+
+# Chunks of a request body, refused with 413 once more than max_bytes arrived (or are announced)
+async def _limited_body(chunks, content_length: str | None, max_bytes: int):
+    too_large = BulkRequestError(f"Body larger than {max_bytes} bytes", status_code=413)
+    if content_length is not None and content_length.isdigit() and int(content_length) > max_bytes:
+        raise too_large
+    size = 0
+    async for chunk in chunks:
+        size += len(chunk)
+        if size > max_bytes:
+            raise too_large
+        yield chunk
+
+# Items of a JSON array body, invalid items are kept so they get their own result
+def parse_bulk_items(body: bytes, max_items: int) -> list[BulkItem]:
+    try:
+        values = json.loads(body)
+    except ValueError:
+        raise BulkRequestError("Body is not valid JSON")
+    if not isinstance(values, list):
+        raise BulkRequestError("Body must be a JSON array of URLs")
+    if len(values) > max_items:
+        raise _too_many_items(max_items)
+    return [_validate_item(index, value) for index, value in enumerate(values)]
+
+# Items of an NDJSON body, parsed line by line as the body arrives so that a request with too many
+# items is refused at the first item over max_items rather than after all of it has been read
+async def read_ndjson_items(chunks, max_items: int) -> list[BulkItem]:
+    items = []
+
+    def add(line: bytes):
+        if not line.strip():
+            return
+        if len(items) == max_items:
+            raise _too_many_items(max_items)
+        try:
+            value = json.loads(line)
+        except ValueError:
+            value = None
+        items.append(_validate_item(len(items), value))
+
+    buffer = b""
+    async for chunk in chunks:
+        *lines, buffer = (buffer + chunk).split(b"\n")
+        for line in lines:
+            add(line)
+    add(buffer)
+    return items
+
+# Items of a bulk request body, read from the request stream within max_bytes
+async def read_bulk_items(chunks, content_type: str | None, content_length: str | None, max_items: int, max_bytes: int) -> list[BulkItem]:
+    chunks = _limited_body(chunks, content_length, max_bytes)
+    if is_ndjson(content_type):
+        return await read_ndjson_items(chunks, max_items)
+    return parse_bulk_items(b"".join([chunk async for chunk in chunks]), max_items)
+
+
+def _result(item: BulkItem, status: str, url_key: str | None = None, created_at=None, detail: str | None = None):
+    target_url = item.site.target_url if item.site else None
+    return BulkSiteResult(index=item.index, status=status, target_url=target_url, url_key=url_key, created_at=created_at, detail=detail)
+
+# url_key of every link the user already has for the given target url hashes, one query on the unique index
+async def _existing_keys(conn, user_id: int, hashes) -> dict[int, str]:
+    statement = select(Site.target_url_hash, Site.url_key).where(Site.user_id == user_id, Site.target_url_hash.in_(list(hashes)))
+    return dict((await conn.execute(statement)).all())
+
+# Insert one chunk of new links with multi-row INSERT .. ON CONFLICT DO NOTHING. Rows left out of RETURNING
+# either lost their key to another link or their target url was created concurrently, the latter are looked
+# up again and the rest retried with fresh keys.
+async def _insert_chunk(engine, user_id: int, pending: list[BulkItem], created: dict[int, str]):
+    for _ in range(settings.key_max_attempts):
+        if not pending:
+            return
+        keys = {}
+        for length in {item.site.length for item in pending}:
+            items = [item for item in pending if item.site.length == length]
+            try:
+                new_keys = await key_allocator.next_keys(length, len(items), engine)
+            except KeyspaceExhausted:
+                for item in items:
+                    item.result = _result(item, "error", detail="No short keys left for this length")
+                continue
+            keys.update(zip((item.index for item in items), new_keys))
+        pending = [item for item in pending if item.index in keys]
+        if not pending:
+            return
+
+        now = get_utc_now()
+        rows = [
+            {
+                "url_key": keys[item.index], "target_url": item.site.target_url, "target_url_hash": item.target_url_hash,
+                "user_id": user_id, "created_at": now,
+            }
+            for item in pending
+        ]
+        async with engine.begin() as conn:
+            statement = dialect_insert(conn, Site.__table__).values(rows).on_conflict_do_nothing()
+            inserted = await conn.execute(statement.returning(Site.url_key, Site.created_at))
+            inserted = dict(inserted.all())
+            missed = [item for item in pending if keys[item.index] not in inserted]
+            existing = await _existing_keys(conn, user_id, {item.target_url_hash for item in missed}) if missed else {}
+
+        retry = []
+        for item in pending:
+            url_key = keys[item.index]
+            if url_key in inserted:
+                item.result = _result(item, "created", url_key, inserted[url_key])
+                created[item.target_url_hash] = url_key
+            elif item.target_url_hash in existing:
+                item.result = _result(item, "exists", existing[item.target_url_hash], detail=EXISTS_DETAIL)
+            else:
+                retry.append(item)
+        key_allocator.record_collision(len(retry))
+        pending = retry
+
+    for item in pending:
+        item.result = _result(item, "error", detail="Could not allocate a short key, try a longer length.")
+
+# Create the links of a bulk request chunk by chunk, yielding the results of each chunk in request order
+# once it is committed so large batches can be streamed back
+async def create_sites(engine, user_id: int, items: list[BulkItem], chunk_size: int):
+    created: dict[int, str] = {}
+    for offset in range(0, len(items), chunk_size):
+        chunk = items[offset:offset + chunk_size]
+        pending, first = [], {}
+        for item in chunk:
+            if item.site is None:
+                item.result = _result(item, "invalid", detail=item.error or "Item is not valid JSON")
+            elif item.target_url_hash in created:
+                item.result = _result(item, "exists", created[item.target_url_hash], detail=EXISTS_DETAIL)
+            elif item.target_url_hash in first:
+                continue # repeats an earlier item of this chunk, resolved once that one is inserted
+            else:
+                first[item.target_url_hash] = item
+                pending.append(item)
+
+        if first:
+            async with engine.connect() as conn:
+                existing = await _existing_keys(conn, user_id, first.keys())
+            for target_url_hash, url_key in existing.items():
+                item = first[target_url_hash]
+                item.result = _result(item, "exists", url_key, detail=EXISTS_DETAIL)
+            pending = [item for item in pending if item.result is None]
+            await _insert_chunk(engine, user_id, pending, created)
+            await redirect_lookup.invalidate([item.result.url_key for item in pending if item.result.status == "created"])
+
+        for item in chunk:
+            if item.result is None:
+                original = first[item.target_url_hash].result
+                if original.url_key:
+                    item.result = _result(item, "exists", original.url_key, detail=EXISTS_DETAIL)
+                else:
+                    item.result = _result(item, original.status, detail=original.detail)
+            yield item.result
+
+# Body of a streamed JSON array, written one result at a time
+async def stream_json_array(results):
+    separator = "["
+    async for result in results:
+        yield separator + result.model_dump_json()
+        separator = ","
+    yield "[]" if separator == "[" else "]"
@@ -0,0 +1,442 @@
+import asyncio
+import logging
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+
+from .bloom import KeyFilter, key_filter
+from .config import settings
+
+
+logger = logging.getLogger(__name__)
+
+
+# Bounded LRU cache with a per-entry time to live, safe to share between worker threads
+class LRUCache:
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data: OrderedDict = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+
+            value, expires_at = entry
+            if expires_at <= monotonic():
+                del self._data[key]
+                self.misses += 1
+                return default
+
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = (value, monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+    def __len__(self):
+        return len(self._data)
+
+
+# Shared cache tier behind the per-process LRU caches. Values are strings, invalidation messages are
+# broadcast to every process subscribed to the backend.
+class CacheBackend:
+    async def get(self, key: str) -> str | None:
+        raise NotImplementedError
+
+    async def set(self, key: str, value: str, ttl: float):
+        raise NotImplementedError
+
+    async def delete(self, *keys: str):
+        raise NotImplementedError
+
+    async def publish(self, message: str):
+        raise NotImplementedError
+
+    # Messages published from now on, until the iterator is closed
+    def subscribe(self):
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+
+# In-process backend, a stand-in for Redis in tests and single process setups. Several TieredCaches
+# sharing one instance behave like workers sharing a Redis server.
+class MemoryBackend(CacheBackend):
+    def __init__(self):
+        self.data: dict[str, tuple[str, float]] = {}
+        self.subscribers: set[asyncio.Queue] = set()
+
+    async def get(self, key: str) -> str | None:
+        entry = self.data.get(key)
+        if entry is None or entry[1] <= monotonic():
+            self.data.pop(key, None)
+            return None
+        return entry[0]
+
+    async def set(self, key: str, value: str, ttl: float):
+        self.data[key] = (value, monotonic() + ttl)
+
+    async def delete(self, *keys: str):
+        for key in keys:
+            self.data.pop(key, None)
+
+    async def publish(self, message: str):
+        for queue in self.subscribers:
+            queue.put_nowait(message)
+
+    async def subscribe(self):
+        queue = asyncio.Queue()
+        self.subscribers.add(queue)
+        try:
+            while True:
+                yield await queue.get()
+        finally:
+            self.subscribers.discard(queue)
+
+
+# Redis (or any server speaking its protocol, e.g. Valkey or KeyDB) through redis-py's asyncio client
+class RedisBackend(CacheBackend):
+    def __init__(self, client, channel: str):
+        self.client = client
+        self.channel = channel
+
+    @classmethod
+    def from_url(cls, url: str, channel: str) -> "RedisBackend":
+        try:
+            from redis.asyncio import Redis
+        except ImportError as exc:
+            raise RuntimeError("CACHE_REDIS_URL is set but the redis package is not installed") from exc
+        return cls(Redis.from_url(url, decode_responses=True), channel)
+
+    async def get(self, key: str) -> str | None:
+        return await self.client.get(key)
+
+    async def set(self, key: str, value: str, ttl: float):
+        await self.client.set(key, value, px=max(1, int(ttl * 1000)))
+
+    async def delete(self, *keys: str):
+        if keys:
+            await self.client.delete(*keys)
+
+    async def publish(self, message: str):
+        await self.client.publish(self.channel, message)
+
+    async def subscribe(self):
+        pubsub = self.client.pubsub()
+        await pubsub.subscribe(self.channel)
+        try:
+            async for message in pubsub.listen():
+                if message["type"] == "message":
+                    yield message["data"]
+        finally:
+            await pubsub.aclose()
+
+    async def close(self):
+        await self.client.aclose()
+
+
+def get_cache_backend() -> CacheBackend | None:
+    if settings.cache_redis_url:
+        return RedisBackend.from_url(settings.cache_redis_url, settings.cache_channel)
+    return None
+
+
+# Marks a key known not to exist in the shared tier, target urls are never empty
+MISSING_VALUE = ""
+
+# Starts invalidation messages of linked caches, "@principal alice". Url keys are base62 and never do.
+LINKED_PREFIX = "@"
+
+# Two level lookup of url_key -> target_url: the process' LRU cache, then the shared backend, then the
+# loader (the database). Concurrent misses for one key share a single load, and keys that do not exist
+# are remembered for a short negative_ttl so scans of random keys do not each reach the database.
+# Invalidations are published on the backend and applied to the local caches of every process.
+# With a key_filter, keys it has never seen are answered as missing without any lookup.
+#
+# A load that read the database just before a link changed must not cache what it read. Loads of this
+# process that an invalidation overlaps keep their value to themselves, and since a load on another
+# process can still write the shared tier after the invalidation, it is repeated invalidation_delay
+# seconds later, once any such load has finished.
+#
+# Other per-process caches can be linked by name to have their invalidations sent over the same channel.
+class TieredCache:
+    def __init__(self, local: LRUCache, missing: LRUCache, backend: CacheBackend | None,
+                 shared_ttl: float, negative_ttl: float, prefix: str, key_filter: KeyFilter | None = None,
+                 invalidation_delay: float = 5.0):
+        self.local = local
+        self.missing = missing
+        self.backend = backend
+        self.key_filter = key_filter
+        self.shared_ttl = shared_ttl
+        self.negative_ttl = negative_ttl
+        self.prefix = prefix
+        self.invalidation_delay = invalidation_delay
+        self.shared_hits = 0
+        self.shared_misses = 0
+        self.shared_errors = 0
+        self.coalesced = 0
+        self._loading: dict[str, asyncio.Future] = {}
+        self._stale: set[asyncio.Future] = set()
+        self._delayed: set[asyncio.Task] = set()
+        self._linked: dict[str, LRUCache] = {}
+        self._listener: asyncio.Task | None = None
+
+    # Value of key, or None when the loader found nothing. loader is an async callable returning the same.
+    async def get_or_load(self, key: str, loader) -> str | None:
+        value = self.local.get(key)
+        if value is not None:
+            return value
+        if self.missing.get(key) is not None:
+            return None
+        if self.key_filter is not None and not self.key_filter.might_exist(key):
+            return None
+
+        loading = self._loading.get(key)
+        if loading is not None and not loading.cancelled():
+            self.coalesced += 1
+            try:
+                return await asyncio.shield(loading)
+            except asyncio.CancelledError:
+                if not loading.cancelled():
+                    raise
+            # the request loading the key went away, look again: another waiter may be loading it by now
+            return await self.get_or_load(key, loader)
+
+        loading = asyncio.get_running_loop().create_future()
+        self._loading[key] = loading
+        try:
+            value = await self._load(key, loader, loading)
+        except asyncio.CancelledError:
+            loading.cancel()
+            raise
+        except Exception as exc:
+            loading.set_exception(exc)
+            loading.exception() # waiters get the error, nobody has to retrieve it
+            raise
+        else:
+            loading.set_result(value)
+        finally:
+            if self._loading.get(key) is loading:
+                del self._loading[key]
+            self._stale.discard(loading)
+        return value
+
+    async def _load(self, key: str, loader, loading: asyncio.Future) -> str | None:
+        shared = await self._shared_get(key)
+        if shared is not None:
+            if loading not in self._stale:
+                self._remember(key, shared or None)
+            return shared or None
+
+        value = await loader()
+        if loading not in self._stale:
+            self._remember(key, value)
+            await self._shared_set(key, value)
+        return value
+
+    def _remember(self, key: str, value: str | None):
+        if value is None:
+            self.missing.set(key, True)
+        else:
+            self.local.set(key, value)
+
+    # The shared tier is an optimization, requests fall back to the database while it is unreachable
+    async def _shared_get(self, key: str) -> str | None:
+        if self.backend is None:
+            return None
+        try:
+            value = await self.backend.get(self.prefix + key)
+        except Exception:
+            self.shared_errors += 1
+            logger.warning("Shared cache lookup failed", exc_info=True)
+            return None
+        if value is None:
+            self.shared_misses += 1
+        else:
+            self.shared_hits += 1
+        return value
+
+    async def _shared_set(self, key: str, value: str | None):
+        if self.backend is None:
+            return
+        try:
+            if value is None:
+                await self.backend.set(self.prefix + key, MISSING_VALUE, self.negative_ttl)
+            else:
+                await self.backend.set(self.prefix + key, value, self.shared_ttl)
+        except Exception:
+            self.shared_errors += 1
+            logger.warning("Shared cache update failed", exc_info=True)
+
+    # Invalidated keys are new or deleted ones, adding deleted keys to the filter only costs a lookup
+    def forget(self, keys):
+        for key in keys:
+            self.local.invalidate(key)
+            self.missing.invalidate(key)
+            loading = self._loading.get(key)
+            if loading is not None:
+                self._stale.add(loading)
+        if self.key_filter is not None:
+            self.key_filter.add(keys)
+
+    # Drop keys from every tier of every process, for deleted links and for new keys that may have
+    # been looked up (and remembered as missing) before they were created
+    async def invalidate(self, keys: list[str]):
+        if not keys:
+            return
+        self.forget(keys)
+        if self.backend is None:
+            return
+        await self._invalidate_shared(keys)
+        self._delay(self._invalidate_later(keys))
+
+    async def _invalidate_shared(self, keys: list[str]):
+        try:
+            await self.backend.delete(*(self.prefix + key for key in keys))
+            await self.backend.publish(" ".join(keys))
+        except Exception:
+            self.shared_errors += 1
+            logger.warning("Shared cache invalidation failed", exc_info=True)
+
+    async def _invalidate_later(self, keys: list[str]):
+        await asyncio.sleep(self.invalidation_delay)
+        self.forget(keys)
+        await self._invalidate_shared(keys)
+
+    def _delay(self, coroutine):
+        task = asyncio.create_task(coroutine)
+        self._delayed.add(task)
+        task.add_done_callback(self._delayed.discard)
+
+    def link(self, name: str, cache: LRUCache):
+        self._linked[name] = cache
+
+    # Drop key from the linked cache name in every process. Like invalidate, the message is repeated
+    # after invalidation_delay for lookups that read the old value just before it changed.
+    async def invalidate_linked(self, name: str, key: str):
+        self._linked[name].invalidate(key)
+        if self.backend is None:
+            return
+        await self._publish_linked(name, key)
+        self._delay(self._invalidate_linked_later(name, key))
+
+    async def _publish_linked(self, name: str, key: str):
+        try:
+            await self.backend.publish(f"{LINKED_PREFIX}{name} {key}")
+        except Exception:
+            self.shared_errors += 1
+            logger.warning("Shared cache invalidation failed", exc_info=True)
+
+    async def _invalidate_linked_later(self, name: str, key: str):
+        await asyncio.sleep(self.invalidation_delay)
+        self._linked[name].invalidate(key)
+        await self._publish_linked(name, key)
+
+    def _apply(self, message: str):
+        if message.startswith(LINKED_PREFIX):
+            name, _, key = message[len(LINKED_PREFIX):].partition(" ")
+            cache = self._linked.get(name)
+            if cache is not None:
+                cache.invalidate(key)
+        else:
+            self.forget(message.split())
+
+    # Applies invalidations published by other processes. Messages sent while the subscription was down
+    # are lost, so the local and linked caches are cleared and the key filter reset whenever it has to be
+    # re-established: keys created meanwhile on other workers must not be answered as missing.
+    async def listen(self, retry_interval: float = 1.0):
+        while True:
+            try:
+                async for message in self.backend.subscribe():
+                    self._apply(message)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.warning("Cache invalidation subscription lost, retrying", exc_info=True)
+            self.local.clear()
+            self.missing.clear()
+            for cache in self._linked.values():
+                cache.clear()
+            if self.key_filter is not None:
+                self.key_filter.reset()
+            await asyncio.sleep(retry_interval)
+
+    def start(self):
+        if self.backend is not None and self._listener is None:
+            self._listener = asyncio.create_task(self.listen())
+
+    async def stop(self):
+        for task in list(self._delayed):
+            task.cancel()
+        if self._listener is not None:
+            self._listener.cancel()
+            self._listener = None
+        if self.backend is not None:
+            await self.backend.close()
+
+    def clear(self):
+        self.local.clear()
+        self.missing.clear()
+        self.shared_hits = self.shared_misses = self.shared_errors = self.coalesced = 0
+
+    def stats(self) -> dict:
+        return {
+            "negative_size": len(self.missing),
+            "negative_hits": self.missing.hits,
+            "shared_hits": self.shared_hits,
+            "shared_misses": self.shared_misses,
+            "shared_errors": self.shared_errors,
+            "coalesced": self.coalesced,
+        }
+
+
+# url_key -> target_url cache used by the redirect route
+redirect_cache = LRUCache(maxsize=settings.redirect_cache_size, ttl=settings.redirect_cache_ttl)
+
+# url_keys known not to exist
+missing_keys = LRUCache(maxsize=settings.redirect_negative_cache_size, ttl=settings.redirect_negative_cache_ttl)
+
+redirect_lookup = TieredCache(
+    redirect_cache, missing_keys, get_cache_backend(),
+    shared_ttl=settings.redirect_shared_cache_ttl,
+    negative_ttl=settings.redirect_negative_cache_ttl,
+    prefix=settings.cache_key_prefix,
+    key_filter=key_filter,
+    invalidation_delay=settings.cache_invalidation_delay,
+)
@@ -0,0 +1,73 @@
+import argparse
+import asyncio
+from datetime import datetime
+
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from .config import settings
+from .database import engine
+from .keys import key_allocator
+from .models import get_utc_now
+from .partitions import maintain_click_partitions, retention_cutoff
+from .rollups import rebuild_rollups
+
+
+# With a raw click retention a full rebuild would lose the aggregates of the expired clicks, so it
+# starts at the retention cutoff unless it is forced
+def rebuild_since(since: datetime | None, force: bool, retention_months: int | None, now: datetime) -> datetime | None:
+    if since is not None or force or retention_months is None:
+        return since
+    return retention_cutoff(retention_months, now)
+
+async def run_rebuild_rollups(args):
+    since = rebuild_since(args.since, args.force, settings.click_retention_months, get_utc_now())
+    if since is not None and args.since is None:
+        print(f"CLICK_RETENTION_MONTHS is set, rebuilding from {since:%Y-%m-%d} on (--force rebuilds everything)")
+    processed = await rebuild_rollups(engine, chunk_size=args.chunk_size, since=since)
+    print(f"Rebuilt click rollups from {processed} clicks")
+
+async def run_maintain_partitions(args):
+    result = await maintain_click_partitions(engine)
+    print(f"Created partitions: {result['created'] or 'none'}, dropped partitions: {result['dropped'] or 'none'}")
+
+async def run_keyspace(args):
+    async with AsyncSession(engine) as session:
+        stats = await key_allocator.keyspace_stats(session)
+    print(f"Key strategy: {key_allocator.strategy.name}")
+    for length, fill in stats.items():
+        print(f"length {length}: {fill['used']} of {fill['capacity']} keys used ({fill['fill']:.6%})")
+
+
+# Maintenance commands, run with: python -m app.cli <command>
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m app.cli", description="URL shortener maintenance commands")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    rebuild = commands.add_parser("rebuild-rollups", help="recompute the click rollup tables from raw clicks")
+    rebuild.add_argument("--chunk-size", type=int, default=10000)
+    rebuild.add_argument("--since", type=datetime.fromisoformat, default=None,
+                         help="only rebuild days from this date on, keeps the aggregates of expired clicks "
+                              "(defaults to the retention cutoff when CLICK_RETENTION_MONTHS is set)")
+    rebuild.add_argument("--force", action="store_true",
+                         help="rebuild every day even with CLICK_RETENTION_MONTHS set, dropping the aggregates of expired clicks")
+    rebuild.set_defaults(handler=run_rebuild_rollups)
+
+    partitions = commands.add_parser("maintain-partitions", help="create upcoming click partitions and drop expired ones")
+    partitions.set_defaults(handler=run_maintain_partitions)
+
+    keyspace = commands.add_parser("keyspace", help="show how full the short key space is per key length")
+    keyspace.set_defaults(handler=run_keyspace)
+
+    args = parser.parse_args(argv)
+
+    async def run():
+        try:
+            await args.handler(args)
+        finally:
+            await engine.dispose()
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
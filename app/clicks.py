@@ -0,0 +1,168 @@
+import asyncio
+import logging
+from time import monotonic
+from sqlalchemy import insert, select
+
+from .agents import get_user_agent_ids
+from .config import settings
+from .models import Click, Site, get_utc_now
+from .rollups import apply_click_rollups
+from .utils import get_browser_info
+
+
+logger = logging.getLogger(__name__)
+
+# queued by stop() to wake up the flusher while it waits for a batch
+_WAKEUP = object()
+MAX_RETRY_DELAY = 30.0
+
+
+# Bounded in-memory click buffer written to the database in batches by a background task. Clicks are
+# dropped by the overflow policy when the buffer is full; a batch that cannot be written is retried
+# with backoff, while new clicks wait in the buffer, and only given up on after write_attempts.
+class ClickQueue:
+    def __init__(self, maxsize: int, batch_size: int, flush_interval: float, overflow: str = "drop", block_timeout: float = 1.0,
+                 write_attempts: int = 8, retry_delay: float = 0.5):
+        if overflow not in ("drop", "block"):
+            raise ValueError(f"Unknown click queue overflow policy: {overflow}")
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.overflow = overflow
+        self.block_timeout = block_timeout
+        self.write_attempts = write_attempts
+        self.retry_delay = retry_delay
+        self.dropped = 0
+        self.written = 0
+        self.discarded = 0 # clicks of links deleted before the clicks were written
+        self.failed = 0
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self._stopping = False
+        self._task: asyncio.Task | None = None
+
+    # record a click without touching the database, returns False when the click was dropped
+    async def put(self, url_id: str, user_agent: str | None) -> bool:
+        row = {"url_id": url_id, "user_agent": user_agent or "", "timestamp": get_utc_now()}
+        try:
+            if self.overflow == "block":
+                await asyncio.wait_for(self._queue.put(row), timeout=self.block_timeout)
+            else:
+                self._queue.put_nowait(row)
+        except (asyncio.QueueFull, asyncio.TimeoutError):
+            self.dropped += 1
+            return False
+        return True
+
+    def depth(self) -> int:
+        return self._queue.qsize()
+
+    # wait until a full batch is buffered or the flush interval has passed
+    async def _collect(self) -> list[dict]:
+        batch = []
+        deadline = monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - monotonic()
+            if remaining <= 0:
+                break
+            try:
+                row = await asyncio.wait_for(self._queue.get(), timeout=remaining)
+            except asyncio.TimeoutError:
+                break
+            if row is _WAKEUP:
+                break
+            batch.append(row)
+        return batch
+
+    def _take(self) -> list[dict]:
+        batch = []
+        while len(batch) < self.batch_size:
+            try:
+                row = self._queue.get_nowait()
+            except asyncio.QueueEmpty:
+                break
+            if row is not _WAKEUP:
+                batch.append(row)
+        return batch
+
+    # Inserts the clicks and their rollups in one transaction. Retries first leave out the clicks of
+    # links deleted since they were recorded, whose foreign key would fail the batch again.
+    async def _insert(self, engine, batch: list[dict], existing_only: bool):
+        user_agent_ids = await get_user_agent_ids(engine, (row["user_agent"] for row in batch))
+        async with engine.begin() as conn:
+            if existing_only:
+                statement = select(Site.url_key).where(Site.url_key.in_({row["url_id"] for row in batch}))
+                existing = set((await conn.execute(statement)).scalars())
+                kept = [row for row in batch if row["url_id"] in existing]
+                discarded, batch = len(batch) - len(kept), kept
+            else:
+                discarded = 0
+            if batch:
+                clicks = [
+                    {"url_id": row["url_id"], "timestamp": row["timestamp"], "user_agent_id": user_agent_ids[row["user_agent"]]}
+                    for row in batch
+                ]
+                rollup_rows = [{**row, **get_browser_info(row["user_agent"])._asdict()} for row in batch]
+                await conn.execute(insert(Click), clicks)
+                await apply_click_rollups(conn, rollup_rows)
+        self.written += len(batch)
+        self.discarded += discarded
+
+    async def _write(self, engine, batch: list[dict]):
+        delay = self.retry_delay
+        for attempt in range(1, self.write_attempts + 1):
+            try:
+                await self._insert(engine, batch, existing_only=attempt > 1)
+                return
+            except Exception:
+                if attempt == self.write_attempts:
+                    break
+                logger.warning("Failed to write %d clicks, retrying in %.1fs", len(batch), delay, exc_info=True)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, MAX_RETRY_DELAY)
+        self.failed += len(batch)
+        logger.error("Gave up writing %d clicks after %d attempts", len(batch), self.write_attempts, exc_info=True)
+
+    # write everything currently buffered
+    async def flush(self, engine):
+        while batch := self._take():
+            await self._write(engine, batch)
+
+    async def _run(self, engine):
+        while not self._stopping:
+            batch = await self._collect()
+            if batch:
+                await self._write(engine, batch)
+        await self.flush(engine)
+
+    def start(self, engine):
+        if self._task is not None:
+            return
+        self._stopping = False
+        self._task = asyncio.create_task(self._run(engine), name="click-flusher")
+
+    # stop the flusher and drain the remaining clicks
+    async def stop(self):
+        if self._task is None:
+            return
+        self._stopping = True
+        try:
+            self._queue.put_nowait(_WAKEUP)
+        except asyncio.QueueFull:
+            pass
+        await self._task
+        self._task = None
+
+    def clear(self):
+        while self._take():
+            pass
+        self.dropped = self.written = self.discarded = self.failed = 0
+
+
+click_queue = ClickQueue(
+    maxsize=settings.click_queue_size,
+    batch_size=settings.click_batch_size,
+    flush_interval=settings.click_flush_interval,
+    overflow=settings.click_queue_overflow,
+    block_timeout=settings.click_queue_block_timeout,
+    write_attempts=settings.click_write_attempts,
+    retry_delay=settings.click_write_retry_delay,
+)
@@ -1,5 +1,6 @@
 import os
 from functools import lru_cache
+from typing import Literal
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 # Settings class to load and validate environment variables from .env file
@@ -12,7 +13,66 @@ class Settings(BaseSettings):
     secret_key: str
     algorithm: str
     access_token_expire_minutes: int = 30
-    
+    jwt_key_id: str | None = None
+    jwt_private_key: str | None = None # PEM text or file path, for RS*, PS*, ES* and EdDSA
+    jwt_public_key: str | None = None # verify-only nodes, derived from the private key otherwise
+    jwt_jwks: str | None = None # JWK Set (JSON text or file path) of older keys still accepted
+    token_cache_size: int = 10000
+    token_cache_ttl: float = 60
+    metrics_enabled: bool = True
+    metrics_sample_interval: float = 5
+    metrics_keyspace_interval: float = 300
+    fast_json_responses: bool = False # default response class of every route, see app/responses.py
+    sql_profile: bool = False # profile every request
+    sql_profile_header: bool = False # profile requests sending X-SQL-Profile: 1
+    sql_profile_repeat_threshold: int = 3
+    db_pool_size: int = 5
+    db_max_overflow: int = 10
+    db_pool_timeout: float = 30
+    db_pool_pre_ping: bool = True
+    db_pool_recycle: int = 1800
+    db_statement_timeout: int | None = None
+    redirect_cache_size: int = 10000
+    redirect_cache_ttl: float = 300
+    redirect_status_code: Literal[301, 302, 307, 308] = 307
+    redirect_cache_control: str | None = None # e.g. "public, max-age=60", cached by browsers and the nginx proxy
+    redirect_negative_cache_size: int = 10000
+    redirect_negative_cache_ttl: float = 30
+    redirect_shared_cache_ttl: float = 3600
+    cache_redis_url: str | None = None # shared cache tier and cross-worker invalidation
+    cache_key_prefix: str = "redirect:"
+    cache_channel: str = "redirect-invalidations"
+    cache_invalidation_delay: float = 5 # invalidations are repeated after this, past any load that raced them
+    bloom_enabled: bool = False # refused without CACHE_REDIS_URL
+    bloom_error_rate: float = 0.001
+    bloom_min_capacity: int = 100000
+    bloom_rebuild_interval: float = 60 * 60
+    click_queue_size: int = 10000
+    click_batch_size: int = 500
+    click_flush_interval: float = 1.0
+    click_queue_overflow: Literal["drop", "block"] = "drop"
+    click_queue_block_timeout: float = 1.0
+    click_write_attempts: int = 8 # with backoff from click_write_retry_delay up to 30s, about a minute
+    click_write_retry_delay: float = 0.5
+    user_agent_cache_size: int = 4096
+    click_partition_months_ahead: int = 3
+    click_partition_maintenance_interval: float = 6 * 60 * 60
+    click_retention_months: int | None = None
+    key_strategy: Literal["random", "counter"] = "random"
+    key_block_size: int = 100
+    key_scramble: bool = True
+    key_max_attempts: int = 10
+    bulk_max_items: int = 10000
+    bulk_max_body_bytes: int = 16 * 1024 * 1024
+    bulk_chunk_size: int = 1000
+    bulk_stream_threshold: int = 1000
+    export_batch_size: int = 1000
+    principal_cache_size: int = 10000
+    principal_cache_ttl: float = 30
+    bcrypt_rounds: int = 12
+    password_hash_workers: int = 2
+    password_hash_queue_limit: int = 64
+
     model_config = SettingsConfigDict(env_file=".env")
 
 # This lru cache singleton pattern to ensure that the settings are loaded only once
@@ -37,4 +97,16 @@ def get_database_url():
         return f"postgresql://{settings.db_username}:{settings.db_password}@{settings.db_host}:{settings.db_port or '5432'}/{settings.db_name}"
     
     # If we get here, we don't have database configuration
-    raise ValueError("No database configuration found. Set DATABASE_URL or individual DB_ environment variables.")
\ No newline at end of file
+    raise ValueError("No database configuration found. Set DATABASE_URL or individual DB_ environment variables.")
+
+# Same database url with the async driver, asyncpg for postgres and aiosqlite for sqlite
+def get_async_database_url():
+    database_url = get_database_url()
+    for sync_prefix, async_prefix in (
+        ("postgresql+psycopg2://", "postgresql+asyncpg://"),
+        ("postgresql://", "postgresql+asyncpg://"),
+        ("sqlite://", "sqlite+aiosqlite://"),
+    ):
+        if database_url.startswith(sync_prefix):
+            return database_url.replace(sync_prefix, async_prefix, 1)
+    return database_url
@@ -1,20 +1,108 @@
+from threading import Lock
+from time import perf_counter
 from typing import Annotated
 from fastapi import Depends
-from sqlmodel import SQLModel, Session, create_engine
-from .config import get_database_url
+from prometheus_client import Histogram
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from sqlmodel import SQLModel
+from sqlmodel.ext.asyncio.session import AsyncSession
+from .config import settings, get_async_database_url
 
-DATABASE_URL = get_database_url()
+DATABASE_URL = get_async_database_url()
 
-engine = create_engine(DATABASE_URL)
+CHECKOUT_WAIT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+POOL_CHECKOUT_WAIT = Histogram(
+    "db_pool_checkout_wait_seconds", "Time a connection checkout waited for a free connection", buckets=CHECKOUT_WAIT_BUCKETS,
+)
 
-def create_db_and_tables():
-    SQLModel.metadata.create_all(engine)
 
-def get_session():
-    with Session(engine) as session:
-        yield session
+# Connection checkout wait times collected by InstrumentedQueuePool
+class PoolMetrics:
+    def __init__(self):
+        self._lock = Lock()
+        self.reset()
 
-# This is a dependency that provides a session to the route handlers.
-SessionDep = Annotated[Session, Depends(get_session)]
+    def observe_checkout(self, seconds: float):
+        with self._lock:
+            self.checkouts += 1
+            self.wait_seconds_total += seconds
+            self.wait_seconds_max = max(self.wait_seconds_max, seconds)
+
+    def reset(self):
+        self.checkouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+pool_metrics = PoolMetrics()
+
+
+# Queue pool that records how long each checkout waited for a free connection
+class InstrumentedQueuePool(AsyncAdaptedQueuePool):
+    def _do_get(self):
+        start = perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            waited = perf_counter() - start
+            pool_metrics.observe_checkout(waited)
+            POOL_CHECKOUT_WAIT.observe(waited)
+
+
+# Pool settings from Settings, sqlite keeps the driver defaults since it does not use a queue pool
+def get_engine_options(database_url: str) -> dict:
+    if database_url.startswith("sqlite"):
+        return {}
 
+    options = {
+        "poolclass": InstrumentedQueuePool,
+        "pool_size": settings.db_pool_size,
+        "max_overflow": settings.db_max_overflow,
+        "pool_timeout": settings.db_pool_timeout,
+        "pool_pre_ping": settings.db_pool_pre_ping,
+        "pool_recycle": settings.db_pool_recycle,
+    }
+    if settings.db_statement_timeout:
+        options["connect_args"] = {"server_settings": {"statement_timeout": str(settings.db_statement_timeout)}}
+    return options
 
+engine = create_async_engine(DATABASE_URL, **get_engine_options(DATABASE_URL))
+
+# expire_on_commit is off so that committed objects can be returned without another round-trip
+async_session = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+
+# Current pool utilization and checkout wait times for this worker
+def pool_stats(pool=None) -> dict:
+    pool = pool or engine.pool
+    stats = {
+        "checkouts": pool_metrics.checkouts,
+        "checkout_wait_seconds_total": pool_metrics.wait_seconds_total,
+        "checkout_wait_seconds_max": pool_metrics.wait_seconds_max,
+    }
+    if isinstance(pool, AsyncAdaptedQueuePool):
+        capacity = pool.size() + max(pool._max_overflow, 0)
+        stats.update({
+            "size": pool.size(),
+            "checked_out": pool.checkedout(),
+            "overflow": pool.overflow(),
+            "utilization": pool.checkedout() / capacity if capacity else 0.0,
+        })
+    return stats
+
+# INSERT that supports ON CONFLICT clauses for the connection's dialect
+def dialect_insert(conn, table):
+    if conn.dialect.name == "postgresql":
+        return postgresql.insert(table)
+    return sqlite.insert(table)
+
+async def create_db_and_tables():
+    async with engine.begin() as conn:
+        await conn.run_sync(SQLModel.metadata.create_all)
+
+async def get_session():
+    async with async_session() as session:
+        yield session
+
+# This is a dependency that provides a session to the route handlers.
+SessionDep = Annotated[AsyncSession, Depends(get_session)]
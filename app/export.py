@@ -0,0 +1,102 @@
+import csv
+import io
+import json
+import zlib
+from datetime import datetime
+from sqlmodel import select
+
+from .models import Click, Site, UserAgent
+from .pagination import decode_cursor, encode_cursor, keyset_after, time_range
+
+
+SITE_FIELDS = ["url_key", "target_url", "created_at", "total_clicks", "cursor"]
+CLICK_FIELDS = ["id", "url_key", "timestamp", "user_agent", "browser", "os", "device", "cursor"]
+
+MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+
+# User's links in (created_at, url_key) order, the cursor is the position of the last exported link
+def site_export_statement(user_id: int, since=None, until=None, cursor: str | None = None):
+    statement = select(Site.url_key, Site.target_url, Site.created_at, Site.total_clicks).where(Site.user_id == user_id)
+    statement = time_range(statement, Site.created_at, since, until)
+    if cursor is not None:
+        statement = statement.where(keyset_after((Site.created_at, Site.url_key), decode_cursor(cursor, datetime, str)))
+    return statement.order_by(Site.created_at, Site.url_key)
+
+def site_export_row(row) -> dict:
+    return {
+        "url_key": row.url_key,
+        "target_url": row.target_url,
+        "created_at": row.created_at.isoformat(),
+        "total_clicks": row.total_clicks,
+        "cursor": encode_cursor(row.created_at, row.url_key),
+    }
+
+# Raw clicks of the user's links in (url_key, id) order, read link by link through ix_click_url_id_id
+def click_export_statement(user_id: int, since=None, until=None, cursor: str | None = None, url_key: str | None = None):
+    statement = (
+        select(Click.id, Click.url_id, Click.timestamp, UserAgent.user_agent, UserAgent.browser, UserAgent.os, UserAgent.device)
+        .join(Site, Site.url_key == Click.url_id)
+        .join(UserAgent, Click.user_agent_id == UserAgent.id)
+        .where(Site.user_id == user_id)
+    )
+    if url_key is not None:
+        statement = statement.where(Click.url_id == url_key)
+    statement = time_range(statement, Click.timestamp, since, until)
+    if cursor is not None:
+        statement = statement.where(keyset_after((Click.url_id, Click.id), decode_cursor(cursor, str, int)))
+    return statement.order_by(Click.url_id, Click.id)
+
+def click_export_row(row) -> dict:
+    return {
+        "id": row.id,
+        "url_key": row.url_id,
+        "timestamp": row.timestamp.isoformat(),
+        "user_agent": row.user_agent,
+        "browser": row.browser,
+        "os": row.os,
+        "device": row.device,
+        "cursor": encode_cursor(row.url_id, row.id),
+    }
+
+
+# Batches of export rows read through a server side cursor, at most batch_size rows are held at a time
+async def stream_rows(engine, statement, to_row, batch_size: int):
+    async with engine.connect() as conn:
+        result = await conn.stream(statement.execution_options(yield_per=batch_size))
+        async for rows in result.partitions():
+            yield [to_row(row) for row in rows]
+
+async def format_ndjson(batches):
+    async for rows in batches:
+        yield "".join(json.dumps(row, separators=(",", ":")) + "\n" for row in rows)
+
+async def format_csv(batches, fields: list[str]):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=fields)
+    writer.writeheader()
+    yield buffer.getvalue()
+    async for rows in batches:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(rows)
+        yield buffer.getvalue()
+
+def format_rows(batches, export_format: str, fields: list[str]):
+    if export_format == "csv":
+        return format_csv(batches, fields)
+    return format_ndjson(batches)
+
+# Gzip a stream of text chunks, flushing after every chunk so the client keeps receiving data
+async def gzip_stream(chunks):
+    compressor = zlib.compressobj(wbits=zlib.MAX_WBITS | 16)
+    async for chunk in chunks:
+        yield compressor.compress(chunk.encode("utf-8")) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    yield compressor.flush()
+
+def accepts_gzip(accept_encoding: str | None) -> bool:
+    for coding in (accept_encoding or "").lower().split(","):
+        name, _, params = coding.partition(";")
+        if name.strip() in ("gzip", "*") and params.replace(" ", "") not in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            return True
+    return False
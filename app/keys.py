@@ -0,0 +1,156 @@
+import asyncio
+import secrets
+import string
+from sqlmodel import select, func
+
+from .config import settings
+from .database import dialect_insert
+from .models import KeyCounter, Site, hash64
+
+
+ALPHABET = string.digits + string.ascii_letters
+BASE = len(ALPHABET)
+
+# odd and not a multiple of 31, so multiplying by it is a bijection modulo 62 ** length
+SCRAMBLE_MULTIPLIER = 2654435761
+
+
+class KeyspaceExhausted(Exception):
+    pass
+
+
+def keyspace_size(length: int) -> int:
+    return BASE ** length
+
+# Fixed width base62, the most significant digit first
+def base62_encode(number: int, length: int) -> str:
+    digits = []
+    for _ in range(length):
+        number, digit = divmod(number, BASE)
+        digits.append(ALPHABET[digit])
+    return "".join(reversed(digits))
+
+# Bijection on [0, 62 ** length) so consecutive counter values do not give consecutive keys
+def scramble(number: int, length: int, offset: int = 0) -> int:
+    size = keyspace_size(length)
+    return (number * SCRAMBLE_MULTIPLIER + offset) % size
+
+
+# Short keys from the CSPRNG, uniqueness is left to the insert's ON CONFLICT (url_key)
+class RandomKeyStrategy:
+    name = "random"
+
+    async def next_key(self, length: int, engine) -> str:
+        return "".join(secrets.choice(ALPHABET) for _ in range(length))
+
+    async def next_keys(self, length: int, count: int, engine) -> list[str]:
+        return [await self.next_key(length, engine) for _ in range(count)]
+
+    async def keyspace_used(self, session) -> dict[int, int]:
+        length = func.length(Site.url_key)
+        rows = await session.exec(select(length, func.count()).group_by(length))
+        return dict(rows.all())
+
+
+# Base62 encoded values of a per length database counter. Each process reserves a block of values
+# with a single upsert, so most keys are handed out without a database round-trip.
+class CounterKeyStrategy:
+    name = "counter"
+
+    def __init__(self, block_size: int, scramble_keys: bool = True):
+        self.block_size = block_size
+        self.scramble_keys = scramble_keys
+        self.blocks_reserved = 0
+        self._blocks: dict[int, tuple[int, int]] = {}
+        self._lock = asyncio.Lock()
+        # the secret picks where each keyspace starts, keys of another deployment do not line up
+        self._offset = hash64(settings.secret_key) & (2 ** 63 - 1)
+
+    async def _reserve_block(self, length: int, engine, size: int) -> tuple[int, int]:
+        table = KeyCounter.__table__
+        statement = dialect_insert(engine, table).values(length=length, next_value=size)
+        statement = statement.on_conflict_do_update(
+            index_elements=["length"],
+            set_={"next_value": table.c.next_value + size},
+        ).returning(table.c.next_value)
+        # committed on its own so a block is never handed out twice, even if the site insert fails
+        async with engine.begin() as conn:
+            end = (await conn.execute(statement)).scalar_one()
+        self.blocks_reserved += 1
+        return end - size, end
+
+    def _encode(self, number: int, length: int) -> str:
+        if number >= keyspace_size(length):
+            raise KeyspaceExhausted(f"No {length} character keys left")
+        if self.scramble_keys:
+            number = scramble(number, length, self._offset)
+        return base62_encode(number, length)
+
+    async def next_key(self, length: int, engine) -> str:
+        return (await self.next_keys(length, 1, engine))[0]
+
+    # Takes what is left of the current block first, the rest comes from one block rounded up to block_size
+    async def next_keys(self, length: int, count: int, engine) -> list[str]:
+        async with self._lock:
+            start, end = self._blocks.get(length, (0, 0))
+            numbers = list(range(start, min(end, start + count)))
+            start += len(numbers)
+            if len(numbers) < count:
+                missing = count - len(numbers)
+                size = -(-missing // self.block_size) * self.block_size
+                start, end = await self._reserve_block(length, engine, size)
+                numbers.extend(range(start, start + missing))
+                start += missing
+            self._blocks[length] = (start, end)
+
+        return [self._encode(number, length) for number in numbers]
+
+    async def keyspace_used(self, session) -> dict[int, int]:
+        rows = await session.exec(select(KeyCounter.length, KeyCounter.next_value))
+        return {length: min(used, keyspace_size(length)) for length, used in rows.all()}
+
+    def reset(self):
+        self._blocks.clear()
+        self.blocks_reserved = 0
+
+
+# Hands out short keys with the configured strategy and keeps allocation metrics
+class KeyAllocator:
+    def __init__(self, strategy):
+        self.strategy = strategy
+        self.allocated = 0
+        self.collisions = 0
+
+    async def next_key(self, length: int, engine) -> str:
+        self.allocated += 1
+        return await self.strategy.next_key(length, engine)
+
+    async def next_keys(self, length: int, count: int, engine) -> list[str]:
+        self.allocated += count
+        return await self.strategy.next_keys(length, count, engine)
+
+    # called when the insert hit existing url_keys
+    def record_collision(self, count: int = 1):
+        self.collisions += count
+
+    # Used and total keys for every key length in use
+    async def keyspace_stats(self, session) -> dict[int, dict]:
+        used = await self.strategy.keyspace_used(session)
+        return {
+            length: {"used": count, "capacity": keyspace_size(length), "fill": count / keyspace_size(length)}
+            for length, count in sorted(used.items())
+        }
+
+    def stats(self) -> dict:
+        stats = {"strategy": self.strategy.name, "allocated": self.allocated, "collisions": self.collisions}
+        if isinstance(self.strategy, CounterKeyStrategy):
+            stats["blocks_reserved"] = self.strategy.blocks_reserved
+        return stats
+
+
+def get_key_strategy():
+    if settings.key_strategy == "counter":
+        return CounterKeyStrategy(settings.key_block_size, settings.key_scramble)
+    return RandomKeyStrategy()
+
+key_allocator = KeyAllocator(get_key_strategy())
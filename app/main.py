@@ -1,17 +1,51 @@
+import asyncio
 from contextlib import asynccontextmanager
-from fastapi import FastAPI
+from fastapi import FastAPI, Response
+from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 
-from .database import create_db_and_tables
+from .bloom import key_filter, run_key_filter_rebuild
+from .cache import redirect_lookup
+from .clicks import click_queue
+from .config import settings
+from .database import create_db_and_tables, engine
+from .metrics import MetricsMiddleware, render_metrics, run_metrics_sampler
+from .passwords import password_hasher
+from .profiling import SQLProfileMiddleware
+from .responses import FastJSONResponse
+from .partitions import maintain_click_partitions, run_partition_maintenance
 from .routing import users, sites
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    create_db_and_tables()
+    # engine of the routes that skip the session, the tests point it at their own database
+    app.state.engine = engine
+    await create_db_and_tables()
+    await maintain_click_partitions(engine)
+    partition_maintenance = asyncio.create_task(
+        run_partition_maintenance(engine, settings.click_partition_maintenance_interval)
+    )
+    metrics_sampler = asyncio.create_task(
+        run_metrics_sampler(settings.metrics_sample_interval, engine, settings.metrics_keyspace_interval)
+    )
+    click_queue.start(engine)
+    redirect_lookup.start()
+    key_filter_rebuild = None
+    if key_filter is not None:
+        key_filter_rebuild = asyncio.create_task(
+            run_key_filter_rebuild(key_filter, engine, settings.bloom_rebuild_interval)
+        )
     yield
+    await click_queue.stop()
+    await redirect_lookup.stop()
+    if key_filter_rebuild is not None:
+        key_filter_rebuild.cancel()
+    partition_maintenance.cancel()
+    metrics_sampler.cancel()
+    password_hasher.shutdown()
     
-app = FastAPI(lifespan=lifespan)
+app = FastAPI(lifespan=lifespan, default_response_class=FastJSONResponse if settings.fast_json_responses else JSONResponse)
 
 origins = ["*"]
 
@@ -23,11 +57,30 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+if settings.sql_profile or settings.sql_profile_header:
+    app.add_middleware(
+        SQLProfileMiddleware,
+        always=settings.sql_profile,
+        allow_header=settings.sql_profile_header,
+        repeat_threshold=settings.sql_profile_repeat_threshold,
+    )
+
+# outermost, so the latency covers the whole middleware stack
+if settings.metrics_enabled:
+    app.add_middleware(MetricsMiddleware)
+
 # include routers
 
 app.include_router(users.router)
 app.include_router(sites.router)
 
+# Prometheus metrics of every worker
+if settings.metrics_enabled:
+    @app.get("/metrics", include_in_schema=False)
+    def metrics():
+        content, media_type = render_metrics()
+        return Response(content, media_type=media_type)
+
 # api main root route
 @app.get("/")
 def root():
@@ -0,0 +1,260 @@
+import asyncio
+import fcntl
+import logging
+import os
+from contextvars import ContextVar
+from time import perf_counter
+
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from .agents import user_agent_ids
+from .auth import principal_cache
+from .cache import missing_keys, redirect_cache, redirect_lookup
+from .clicks import click_queue
+from .database import pool_stats
+from .keys import key_allocator
+from .passwords import password_hasher
+from .tokens import token_service
+
+
+logger = logging.getLogger(__name__)
+
+# Under gunicorn every worker writes its samples to files in this directory and /metrics merges them
+MULTIPROCESS = bool(os.environ.get("PROMETHEUS_MULTIPROC_DIR"))
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 50, 100)
+
+REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds", "Request latency by route template",
+    ["method", "route", "status"], buckets=LATENCY_BUCKETS,
+)
+REQUESTS_IN_PROGRESS = Gauge(
+    "http_requests_in_progress", "Requests being served", multiprocess_mode="livesum",
+)
+REQUEST_DB_QUERIES = Histogram(
+    "http_request_db_queries", "SQL statements executed per request", ["route"], buckets=QUERY_COUNT_BUCKETS,
+)
+REQUEST_DB_SECONDS = Histogram(
+    "http_request_db_seconds", "Time spent in SQL statements per request", ["route"], buckets=LATENCY_BUCKETS,
+)
+
+# Sampled from the worker's own state, see sample_gauges. Connection checkout waits are observed by the
+# pool itself, see database.POOL_CHECKOUT_WAIT.
+DB_POOL = Gauge("db_pool_connections", "Connection pool state", ["state"], multiprocess_mode="livesum")
+DB_POOL_UTILIZATION = Gauge("db_pool_utilization", "Share of the pool's connections checked out, busiest worker", multiprocess_mode="livemax")
+CLICK_QUEUE_DEPTH = Gauge("click_queue_depth", "Clicks waiting to be written", multiprocess_mode="livesum")
+CACHE_ENTRIES = Gauge("cache_entries", "Entries held by an in-process cache", ["cache"], multiprocess_mode="livesum")
+# Wait and run times of the jobs are observed by the hasher itself, see passwords.HASH_WAIT
+PASSWORD_HASH_QUEUE = Gauge("password_hash_jobs", "bcrypt jobs on the password hasher pool", ["state"], multiprocess_mode="livesum")
+KEY_FILTER_BYTES = Gauge("key_filter_bytes", "Memory held by the url key bloom filter", multiprocess_mode="livesum")
+KEY_FILTER_KEYS = Gauge("key_filter_keys", "Keys added to the url key bloom filter", multiprocess_mode="livemax")
+KEY_FILTER_ERROR_RATE = Gauge("key_filter_false_positive_rate", "Expected false positive rate of the url key bloom filter", multiprocess_mode="livemax")
+KEYSPACE_FILL = Gauge("short_keyspace_fill", "Share of the keys of a length already taken", ["length"], multiprocess_mode="livemax")
+
+# Cumulative counts, sampled as the increase since the previous sample so that rate() works across
+# worker restarts, see count()
+CACHE_LOOKUPS = Counter("cache_lookups", "Cache lookups", ["cache", "result"])
+KEY_FILTER_LOOKUPS = Counter("key_filter_lookups", "Redirect lookups checked against the url key bloom filter", ["result"])
+KEYS_ALLOCATED = Counter("short_keys_allocated", "Short keys handed out and collisions", ["result"])
+CLICKS = Counter("clicks", "Clicks by outcome: written, dropped on overflow, discarded for deleted links or failed", ["result"])
+
+
+# SQL statements of the current request, None outside requests so background work is not counted
+class QueryStats:
+    __slots__ = ("count", "seconds")
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+current_query_stats: ContextVar[QueryStats | None] = ContextVar("current_query_stats", default=None)
+
+# Listening on the Engine class covers every engine, the async engines run their statements through one
+@event.listens_for(Engine, "before_cursor_execute")
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if current_query_stats.get() is not None:
+        context._query_started = perf_counter()
+
+@event.listens_for(Engine, "after_cursor_execute")
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = current_query_stats.get()
+    started = getattr(context, "_query_started", None)
+    if stats is not None and started is not None:
+        stats.count += 1
+        stats.seconds += perf_counter() - started
+
+
+# Pure ASGI middleware, BaseHTTPMiddleware would add a task and a stream per request. Latency is labelled
+# with the matched route template so that url keys do not become label values.
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+        self._children = {}
+        self._endpoint_paths = {}
+
+    # labelled histograms of a (method, route, status), looked up once since labels() is not free
+    def _histograms(self, method: str, route: str, status: int):
+        key = (method, route, status)
+        children = self._children.get(key)
+        if children is None:
+            children = (
+                REQUEST_DURATION.labels(method, route, str(status)),
+                REQUEST_DB_QUERIES.labels(route),
+                REQUEST_DB_SECONDS.labels(route),
+            )
+            self._children[key] = children
+        return children
+
+    # FastAPI routes put themselves in the scope, plain Starlette routes only their endpoint
+    def _route_path(self, scope) -> str:
+        route = scope.get("route")
+        if route is not None:
+            return route.path
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return "<unmatched>"
+        path = self._endpoint_paths.get(endpoint)
+        if path is None:
+            routes = [route for route in scope["app"].routes if getattr(route, "endpoint", None) is endpoint]
+            path = self._endpoint_paths[endpoint] = routes[0].path if len(routes) == 1 else "<unmatched>"
+        return path
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        stats = QueryStats()
+        token = current_query_stats.set(stats)
+        REQUESTS_IN_PROGRESS.inc()
+        started = perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = perf_counter() - started
+            REQUESTS_IN_PROGRESS.dec()
+            current_query_stats.reset(token)
+            path = self._route_path(scope)
+            duration, queries, query_seconds = self._histograms(scope["method"], path, status)
+            duration.observe(elapsed)
+            queries.observe(stats.count)
+            query_seconds.observe(stats.seconds)
+
+
+# Last sampled value of every counter child. The counts are kept by the caches and allocators as plain
+# numbers; a count that went back (cleared) is counted from zero again.
+_counted: dict = {}
+
+def count(counter, value: float):
+    last = _counted.get(counter, 0)
+    increase = value - last if value >= last else value
+    if increase:
+        counter.inc(increase)
+    _counted[counter] = value
+
+# Copy pool, queue and cache state into gauges and counters. Each worker does this periodically, a
+# custom collector would only ever see the worker that happens to answer the scrape.
+def sample_gauges():
+    pool = pool_stats()
+    for state in ("size", "checked_out", "overflow"):
+        if state in pool:
+            DB_POOL.labels(state).set(pool[state])
+    if "utilization" in pool:
+        DB_POOL_UTILIZATION.set(pool["utilization"])
+    CLICK_QUEUE_DEPTH.set(click_queue.depth())
+    for result in ("written", "dropped", "discarded", "failed"):
+        count(CLICKS.labels(result), getattr(click_queue, result))
+
+    caches = {"redirect": redirect_cache, "redirect_missing": missing_keys, "principal": principal_cache, "user_agent": user_agent_ids}
+    if token_service.cache is not None:
+        caches["token"] = token_service.cache
+    for name, cache in caches.items():
+        stats = cache.stats()
+        CACHE_ENTRIES.labels(name).set(stats["size"])
+        count(CACHE_LOOKUPS.labels(name, "hit"), stats["hits"])
+        count(CACHE_LOOKUPS.labels(name, "miss"), stats["misses"])
+    shared = redirect_lookup.stats()
+    count(CACHE_LOOKUPS.labels("redirect_shared", "hit"), shared["shared_hits"])
+    count(CACHE_LOOKUPS.labels("redirect_shared", "miss"), shared["shared_misses"])
+    count(CACHE_LOOKUPS.labels("redirect_shared", "error"), shared["shared_errors"])
+    count(CACHE_LOOKUPS.labels("redirect", "coalesced"), shared["coalesced"])
+
+    if redirect_lookup.key_filter is not None:
+        key_filter = redirect_lookup.key_filter.stats()
+        KEY_FILTER_BYTES.set(key_filter["size_bytes"])
+        KEY_FILTER_KEYS.set(key_filter["keys"])
+        KEY_FILTER_ERROR_RATE.set(key_filter["error_rate"])
+        count(KEY_FILTER_LOOKUPS.labels("rejected"), key_filter["rejected"])
+        count(KEY_FILTER_LOOKUPS.labels("passed"), key_filter["passed"])
+
+    hasher = password_hasher.stats()
+    PASSWORD_HASH_QUEUE.labels("queued").set(hasher["queue_depth"])
+    PASSWORD_HASH_QUEUE.labels("running").set(hasher["running"])
+
+    keys = key_allocator.stats()
+    count(KEYS_ALLOCATED.labels("allocated"), keys["allocated"])
+    count(KEYS_ALLOCATED.labels("collision"), keys["collisions"])
+
+# Open lock file while this worker is the one sampling the keyspace
+_keyspace_lock = None
+
+# With the random strategy the keyspace query scans the site table, so under gunicorn only the worker
+# holding a lock file in the multiprocess directory runs it. The lock goes away with its worker, the
+# next one to ask takes over.
+def holds_keyspace_lock() -> bool:
+    global _keyspace_lock
+    if not MULTIPROCESS:
+        return True
+    if _keyspace_lock is None:
+        handle = open(os.path.join(os.environ["PROMETHEUS_MULTIPROC_DIR"], "keyspace.lock"), "a")
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            handle.close()
+            return False
+        _keyspace_lock = handle
+    return True
+
+# Keyspace fill per key length. It takes a query, so it is sampled far less often than the gauges above.
+async def sample_keyspace(engine):
+    async with AsyncSession(engine) as session:
+        keyspace = await key_allocator.keyspace_stats(session)
+    for length, stats in keyspace.items():
+        KEYSPACE_FILL.labels(str(length)).set(stats["fill"])
+
+# Background task started from the lifespan hook
+async def run_metrics_sampler(interval: float, engine, keyspace_interval: float):
+    keyspace_sampled = None
+    while True:
+        try:
+            sample_gauges()
+        except Exception:
+            logger.exception("Sampling metrics failed")
+        due = keyspace_sampled is None or perf_counter() - keyspace_sampled >= keyspace_interval
+        if due and holds_keyspace_lock():
+            keyspace_sampled = perf_counter()
+            try:
+                await sample_keyspace(engine)
+            except Exception:
+                logger.exception("Sampling keyspace fill failed")
+        await asyncio.sleep(interval)
+
+# Exposition text of every worker's metrics in multiprocess mode, this process' otherwise
+def render_metrics() -> tuple[bytes, str]:
+    sample_gauges()
+    if MULTIPROCESS:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
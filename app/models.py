@@ -1,29 +1,95 @@
 from typing import Optional, List
 from datetime import datetime, timezone
+from hashlib import blake2b
+from sqlalchemy import BigInteger, Index, PrimaryKeyConstraint, UniqueConstraint
 from sqlmodel import Field, SQLModel, Relationship
 from .schemas import SiteBase, UserCreate
 
+# naive UTC, the columns are timestamp without time zone and asyncpg rejects aware datetimes for them
 def get_utc_now():
-    return datetime.now(timezone.utc)
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+# signed 64 bit hash used to index long strings with a narrow bigint column
+def hash64(value: str) -> int:
+    return int.from_bytes(blake2b(value.encode("utf-8"), digest_size=8).digest(), "big", signed=True)
+
+# column default computing Site.target_url_hash from the target_url being inserted
+def get_target_url_hash(context):
+    return hash64(context.get_current_parameters()["target_url"])
+
+
+# ============================== User Agent Database Table  =============================
+
+# Each distinct user agent string is stored once, with its families parsed when it is first seen
+class UserAgent(SQLModel, table=True):
+    __tablename__ = "user_agent"
+    id: int | None = Field(default=None, primary_key=True)
+    ua_hash: int = Field(sa_type=BigInteger, unique=True, nullable=False) # 64 bit hash of user_agent
+    user_agent: str = Field(nullable=False)
+    browser: str = Field(nullable=False)
+    os: str = Field(nullable=False)
+    device: str = Field(nullable=False)
 
 
 # ============================== Click Database Table  =============================
 
+# On postgres click is range partitioned by month on timestamp (see app/partitions.py). A partitioned
+# table's unique keys must contain the partition key, so there (id, timestamp) replaces the primary key.
 class Click(SQLModel, table=True):
+    __table_args__ = (
+        PrimaryKeyConstraint("id").ddl_if(dialect="sqlite"),
+        UniqueConstraint("id", "timestamp", name="click_id_timestamp_key").ddl_if(dialect="postgresql"),
+        Index("ix_click_url_id_id", "url_id", "id"), # clicks of a url in id order, also serves the cascade delete
+        {"postgresql_partition_by": "RANGE (timestamp)"},
+    )
     id: int | None = Field(default=None, primary_key=True)
     url_id: str = Field(foreign_key="site.url_key", ondelete="CASCADE") # foreign key
-    timestamp: datetime = Field(default_factory=get_utc_now)
-    user_agent: str = Field(nullable=False)
+    timestamp: datetime = Field(default_factory=get_utc_now, index=True)
+    user_agent_id: int = Field(foreign_key="user_agent.id", nullable=False) # foreign key
     url: Optional["Site"] = Relationship(back_populates="clicks") # one-to-one
+    agent: Optional[UserAgent] = Relationship() # many-to-one
     
     
+# ============================== Click Rollup Tables  =============================
+
+# Click counts per url, time bucket and user agent family, maintained as clicks are ingested
+class ClickRollup(SQLModel):
+    url_id: str = Field(foreign_key="site.url_key", ondelete="CASCADE", primary_key=True)
+    bucket: datetime = Field(primary_key=True)
+    browser: str = Field(primary_key=True)
+    os: str = Field(primary_key=True)
+    device: str = Field(primary_key=True)
+    clicks: int = Field(default=0)
+
+class ClickHourly(ClickRollup, table=True):
+    __tablename__ = "click_hourly"
+
+class ClickDaily(ClickRollup, table=True):
+    __tablename__ = "click_daily"
+    
+    
+# ============================== Key Counter Table  =============================
+
+# Next unreserved counter value per key length, used by the counter key strategy (see app/keys.py)
+class KeyCounter(SQLModel, table=True):
+    __tablename__ = "key_counter"
+    length: int = Field(primary_key=True, sa_column_kwargs={"autoincrement": False})
+    next_value: int = Field(sa_type=BigInteger, nullable=False)
+
+
 # ============================== Site Database Table  =============================
 
 class Site(SiteBase, table=True):
+    __table_args__ = (
+        UniqueConstraint("user_id", "target_url_hash", name="uq_site_user_id_target_url_hash"), # one link per target url and user, also indexes user_id
+        Index("ix_site_user_id_created_at_url_key", "user_id", "created_at", "url_key"), # a user's links in listing order
+    )
     url_key: str = Field(nullable=False, primary_key=True)
     user_id: int = Field(foreign_key="user.id", nullable=False, ondelete="CASCADE") # foreign key
+    target_url_hash: int | None = Field(default=None, sa_type=BigInteger, nullable=False, sa_column_kwargs={"default": get_target_url_hash})
     created_at: datetime = Field(default_factory=get_utc_now)
-    clicks: List[Click] = Relationship(back_populates="url", cascade_delete=True) # one-to-many
+    total_clicks: int = Field(default=0, sa_column_kwargs={"server_default": "0"})
+    clicks: List[Click] = Relationship(back_populates="url", cascade_delete=True, passive_deletes=True) # one-to-many, rows removed by ON DELETE CASCADE
     user: Optional["User"] = Relationship(back_populates="urls") # one-to-one
     
     
@@ -0,0 +1,81 @@
+import base64
+import json
+from datetime import datetime, timezone
+from sqlalchemy import tuple_
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import ClauseElement, Executable
+from sqlmodel import func, select
+
+
+class InvalidCursor(ValueError):
+    pass
+
+# Opaque continuation token holding the sort key of the last row a client has seen
+def encode_cursor(*values) -> str:
+    values = [value.isoformat() if isinstance(value, datetime) else value for value in values]
+    payload = json.dumps(values, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(payload).decode("ascii").rstrip("=")
+
+# Sort key of a cursor made by encode_cursor, converted to the given types
+def decode_cursor(token: str, *types) -> tuple:
+    try:
+        values = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+        if not isinstance(values, list) or len(values) != len(types):
+            raise ValueError(token)
+        return tuple(
+            datetime.fromisoformat(value) if kind is datetime else kind(value)
+            for value, kind in zip(values, types)
+        )
+    except (ValueError, TypeError) as exc:
+        raise InvalidCursor("Invalid cursor") from exc
+
+# Rows strictly after a keyset position, the columns must match the ORDER BY
+def keyset_after(columns, values):
+    return tuple_(*columns) > tuple_(*values)
+
+# Columns are naive UTC, convert aware filter values instead of comparing across time zones
+def as_naive_utc(value: datetime | None) -> datetime | None:
+    if value is None or value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+# since is inclusive and until exclusive, so consecutive ranges do not overlap
+def time_range(statement, column, since: datetime | None = None, until: datetime | None = None):
+    if since is not None:
+        statement = statement.where(column >= as_naive_utc(since))
+    if until is not None:
+        statement = statement.where(column < as_naive_utc(until))
+    return statement
+
+# One page of rows after cursor in the order of columns, and the cursor of its last row when more rows follow.
+# Fetches limit + 1 rows so the next page is known to exist without a count.
+async def keyset_page(session, statement, columns, types, cursor: str | None, limit: int) -> tuple[list, str | None]:
+    if cursor is not None:
+        statement = statement.where(keyset_after(columns, decode_cursor(cursor, *types)))
+    rows = (await session.exec(statement.order_by(*columns).limit(limit + 1))).all()
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(*(getattr(rows[-1], column.key) for column in columns))
+
+
+class Explain(Executable, ClauseElement):
+    inherit_cache = False
+
+    def __init__(self, statement):
+        self.statement = statement
+
+@compiles(Explain, "postgresql")
+def compile_explain(element, compiler, **kw):
+    return "EXPLAIN (FORMAT JSON) " + compiler.process(element.statement, **kw)
+
+# Number of rows the statement returns, the planner's estimate on postgres so deep listings stay cheap
+async def estimate_count(session, statement) -> int:
+    statement = statement.order_by(None).limit(None).offset(None)
+    conn = await session.connection()
+    if conn.dialect.name == "postgresql":
+        plan = (await conn.execute(Explain(statement))).scalar_one()
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]["Plan"]["Plan Rows"])
+    return (await conn.execute(select(func.count()).select_from(statement.subquery()))).scalar_one()
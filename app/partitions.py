@@ -0,0 +1,107 @@
+import asyncio
+import logging
+from datetime import datetime
+from sqlalchemy import text
+
+from .config import settings
+from .models import get_utc_now
+
+
+logger = logging.getLogger(__name__)
+
+# pg advisory lock key so only one worker maintains the partitions at a time
+PARTITION_LOCK_KEY = 7215398
+
+def month_start(value: datetime) -> datetime:
+    return datetime(value.year, value.month, 1)
+
+def add_months(month: datetime, months: int) -> datetime:
+    index = month.year * 12 + month.month - 1 + months
+    return datetime(index // 12, index % 12 + 1, 1)
+
+def partition_name(month: datetime) -> str:
+    return f"click_{month:%Y_%m}"
+
+# Month a click partition starts at, None for tables that are not monthly click partitions
+def partition_month(name: str) -> datetime | None:
+    try:
+        return datetime.strptime(name, "click_%Y_%m")
+    except ValueError:
+        return None
+
+# First month whose partition is kept, older ones are past the raw click retention
+def retention_cutoff(retention_months: int, now: datetime) -> datetime:
+    return add_months(month_start(now), -retention_months)
+
+
+async def _is_partitioned(conn) -> bool:
+    result = await conn.execute(text(
+        "SELECT 1 FROM pg_partitioned_table pt JOIN pg_class c ON c.oid = pt.partrelid "
+        "WHERE c.relname = 'click' AND c.relnamespace = current_schema()::regnamespace"
+    ))
+    return result.first() is not None
+
+async def _list_partitions(conn) -> list[str]:
+    result = await conn.execute(text(
+        "SELECT c.relname FROM pg_inherits i "
+        "JOIN pg_class c ON c.oid = i.inhrelid JOIN pg_class p ON p.oid = i.inhparent "
+        "WHERE p.relname = 'click' AND p.relnamespace = current_schema()::regnamespace"
+    ))
+    return [name for name, in result]
+
+# Create the monthly partitions from the current month up to months_ahead months later
+async def ensure_click_partitions(conn, months_ahead: int, now: datetime | None = None) -> list[str]:
+    current = month_start(now or get_utc_now())
+    existing = set(await _list_partitions(conn))
+    created = []
+    for offset in range(months_ahead + 1):
+        month = add_months(current, offset)
+        name = partition_name(month)
+        if name in existing:
+            continue
+        await conn.execute(text(
+            f"CREATE TABLE {name} PARTITION OF click "
+            f"FOR VALUES FROM ('{month:%Y-%m-%d}') TO ('{add_months(month, 1):%Y-%m-%d}')"
+        ))
+        created.append(name)
+    return created
+
+# Drop the partitions that only hold clicks older than the retention, rollups keep their aggregates
+async def drop_expired_click_partitions(conn, retention_months: int, now: datetime | None = None) -> list[str]:
+    cutoff = retention_cutoff(retention_months, now or get_utc_now())
+    dropped = []
+    for name in sorted(await _list_partitions(conn)):
+        month = partition_month(name)
+        if month is not None and add_months(month, 1) <= cutoff:
+            await conn.execute(text(f"DROP TABLE {name}"))
+            dropped.append(name)
+    return dropped
+
+# Run one maintenance pass, a no-op unless click is a partitioned postgres table
+async def maintain_click_partitions(engine, now: datetime | None = None) -> dict:
+    result = {"created": [], "dropped": []}
+    if engine.dialect.name != "postgresql":
+        return result
+
+    async with engine.begin() as conn:
+        if not await _is_partitioned(conn):
+            return result
+        locked = (await conn.execute(text("SELECT pg_try_advisory_xact_lock(:key)"), {"key": PARTITION_LOCK_KEY})).scalar()
+        if not locked:
+            return result
+        result["created"] = await ensure_click_partitions(conn, settings.click_partition_months_ahead, now)
+        if settings.click_retention_months is not None:
+            result["dropped"] = await drop_expired_click_partitions(conn, settings.click_retention_months, now)
+
+    if result["created"] or result["dropped"]:
+        logger.info("Click partitions created: %s, dropped: %s", result["created"], result["dropped"])
+    return result
+
+# Background task started from the lifespan hook
+async def run_partition_maintenance(engine, interval: float):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await maintain_click_partitions(engine)
+        except Exception:
+            logger.exception("Click partition maintenance failed")
@@ -0,0 +1,115 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from time import perf_counter
+
+from prometheus_client import Counter, Histogram
+
+from .config import settings
+from .utils import get_hash_password, verify_password
+
+
+HASH_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+HASH_WAIT = Histogram("password_hash_wait_seconds", "Time a bcrypt job waited for a free worker", buckets=HASH_BUCKETS)
+HASH_RUN = Histogram("password_hash_run_seconds", "Time a bcrypt job ran on a worker", buckets=HASH_BUCKETS)
+HASH_REJECTED = Counter("password_hash_rejected", "bcrypt jobs turned away because the queue was full")
+
+
+class PasswordHasherBusy(Exception):
+    pass
+
+# Work factor of a bcrypt hash, "$2b$12$..." -> 12
+def bcrypt_rounds(hashed_password: str) -> int:
+    try:
+        return int(hashed_password.split("$")[2])
+    except (IndexError, ValueError):
+        return 0
+
+
+# Runs bcrypt on a small dedicated thread pool so hashing never blocks the event loop. bcrypt releases
+# the GIL while it works, so the workers run in parallel with the loop and with each other.
+class PasswordHasher:
+    def __init__(self, rounds: int, max_workers: int, queue_limit: int):
+        self.rounds = rounds
+        self.max_workers = max_workers
+        self.queue_limit = queue_limit
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.rejected = 0
+        self.wait_seconds = 0.0
+        self.run_seconds = 0.0
+        self.max_run_seconds = 0.0
+        self._executor: ThreadPoolExecutor | None = None
+        self._lock = Lock()
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="bcrypt")
+        return self._executor
+
+    def _timed(self, func, args, submitted: float):
+        started = perf_counter()
+        with self._lock:
+            self.queued -= 1
+            self.running += 1
+            self.wait_seconds += started - submitted
+        HASH_WAIT.observe(started - submitted)
+        try:
+            return func(*args)
+        finally:
+            elapsed = perf_counter() - started
+            with self._lock:
+                self.running -= 1
+                self.completed += 1
+                self.run_seconds += elapsed
+                self.max_run_seconds = max(self.max_run_seconds, elapsed)
+            HASH_RUN.observe(elapsed)
+
+    # Past queue_limit waiting jobs new ones are turned away instead of piling up behind a login storm
+    async def _run(self, func, *args):
+        with self._lock:
+            if self.queued >= self.queue_limit:
+                self.rejected += 1
+                HASH_REJECTED.inc()
+                raise PasswordHasherBusy("Too many password checks in progress")
+            self.queued += 1
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self._timed, func, args, perf_counter())
+
+    async def hash(self, password: str) -> str:
+        return await self._run(get_hash_password, password, self.rounds)
+
+    async def verify(self, password: str, hashed_password: str) -> bool:
+        return await self._run(verify_password, password, hashed_password)
+
+    # Hashes made with a lower work factor than configured are upgraded on the next successful login
+    def needs_rehash(self, hashed_password: str) -> bool:
+        return bcrypt_rounds(hashed_password) < self.rounds
+
+    def stats(self) -> dict:
+        with self._lock:
+            completed = self.completed or 1
+            return {
+                "workers": self.max_workers,
+                "queue_depth": self.queued,
+                "running": self.running,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "avg_wait_ms": self.wait_seconds / completed * 1000,
+                "avg_run_ms": self.run_seconds / completed * 1000,
+                "max_run_ms": self.max_run_seconds * 1000,
+            }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+
+password_hasher = PasswordHasher(
+    rounds=settings.bcrypt_rounds,
+    max_workers=settings.password_hash_workers,
+    queue_limit=settings.password_hash_queue_limit,
+)
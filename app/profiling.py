@@ -0,0 +1,187 @@
+import logging
+import os
+import sys
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from time import perf_counter
+
+from greenlet import getcurrent
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = "x-sql-profile"
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(APP_DIR)
+# Middleware frames sit under every request and say nothing about where a statement came from
+SKIPPED_FILES = {os.path.join(APP_DIR, "profiling.py"), os.path.join(APP_DIR, "metrics.py")}
+CALL_SITE_DEPTH = 3
+
+
+# A statement sent to the database while profiling
+class ProfiledStatement:
+    __slots__ = ("statement", "seconds", "call_site")
+
+    def __init__(self, statement: str, seconds: float, call_site: str):
+        self.statement = statement
+        self.seconds = seconds
+        self.call_site = call_site
+
+
+# Every statement of one request (or one with-block in tests) with its duration and the app code that sent it
+class SQLProfile:
+    def __init__(self):
+        self.statements: list[ProfiledStatement] = []
+
+    def record(self, statement: str, seconds: float, call_site: str):
+        self.statements.append(ProfiledStatement(statement, seconds, call_site))
+
+    @property
+    def count(self) -> int:
+        return len(self.statements)
+
+    @property
+    def seconds(self) -> float:
+        return sum(statement.seconds for statement in self.statements)
+
+    # Statements sent threshold times or more with the same SQL text, the usual shape of an N+1 pattern
+    # such as a lazy relationship loaded once per row. Returns (statement, count, call sites).
+    def repeated(self, threshold: int) -> list[tuple[str, int, list[str]]]:
+        groups = defaultdict(list)
+        for statement in self.statements:
+            groups[statement.statement].append(statement.call_site)
+        return [
+            (statement, len(call_sites), sorted(set(call_sites)))
+            for statement, call_sites in groups.items()
+            if len(call_sites) >= threshold
+        ]
+
+    # Short form for the response header
+    def summary(self, threshold: int) -> str:
+        return f"queries={self.count}; time_ms={self.seconds * 1000:.2f}; repeated={len(self.repeated(threshold))}"
+
+    # Every statement in order, then the repeated ones, for logs and failed query budgets
+    def report(self, threshold: int) -> str:
+        lines = [self.summary(threshold)]
+        for number, statement in enumerate(self.statements, 1):
+            lines.append(f"  {number}. {statement.seconds * 1000:.2f}ms {statement.call_site}: {one_line(statement.statement)}")
+        for statement, count, call_sites in self.repeated(threshold):
+            lines.append(f"  possible N+1, {count} times from {', '.join(call_sites)}: {one_line(statement)}")
+        return "\n".join(lines)
+
+
+def one_line(statement: str, limit: int = 200) -> str:
+    statement = " ".join(statement.split())
+    return statement if len(statement) <= limit else statement[:limit] + "..."
+
+
+# Innermost frames of app code that led to the current statement. Statements of the async engines run in a
+# greenlet whose stack stops at SQLAlchemy, the awaiting app code is on the parent greenlet's stack.
+def call_site() -> str:
+    sites = []
+    frame = sys._getframe(1)
+    current = getcurrent()
+    while len(sites) < CALL_SITE_DEPTH:
+        if frame is None:
+            current = current.parent
+            if current is None:
+                break
+            frame = current.gr_frame
+            continue
+        filename = frame.f_code.co_filename
+        if filename.startswith(APP_DIR) and filename not in SKIPPED_FILES:
+            sites.append(f"{os.path.relpath(filename, ROOT_DIR)}:{frame.f_lineno} {frame.f_code.co_name}")
+        frame = frame.f_back
+    return " < ".join(sites) or "<unknown>"
+
+
+current_sql_profile: ContextVar[SQLProfile | None] = ContextVar("current_sql_profile", default=None)
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if current_sql_profile.get() is not None:
+        context._profile_call_site = call_site()
+        context._profile_started = perf_counter()
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    profile = current_sql_profile.get()
+    started = getattr(context, "_profile_started", None)
+    if profile is not None and started is not None:
+        profile.record(statement, perf_counter() - started, context._profile_call_site)
+
+event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+
+
+# Profile of the statements sent inside the block, in this context only
+@contextmanager
+def profile_sql():
+    profile = SQLProfile()
+    token = current_sql_profile.set(profile)
+    try:
+        yield profile
+    finally:
+        current_sql_profile.reset(token)
+
+# Profile of every statement the engine sends inside the block from any thread or task, used by the
+# query budget tests where the app runs in the TestClient's own event loop
+@contextmanager
+def profile_engine(engine):
+    profile = SQLProfile()
+    started = {}
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        started[id(context)] = (perf_counter(), call_site())
+
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        start, site = started.pop(id(context), (None, None))
+        if start is not None:
+            profile.record(statement, perf_counter() - start, site)
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", after_cursor_execute)
+    try:
+        yield profile
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+        event.remove(engine, "after_cursor_execute", after_cursor_execute)
+
+
+# Profiles requests when always is set, or when allow_header is set and the request sends X-SQL-Profile: 1.
+# The summary goes out in the X-SQL-Profile response header and the full report to the log, at WARNING
+# when a statement repeats repeat_threshold times. Statements sent after the response started, by a
+# streamed body, are only in the log.
+class SQLProfileMiddleware:
+    def __init__(self, app, always: bool = False, allow_header: bool = False, repeat_threshold: int = 3):
+        self.app = app
+        self.always = always
+        self.allow_header = allow_header
+        self.repeat_threshold = repeat_threshold
+
+    def _enabled(self, scope) -> bool:
+        if self.always:
+            return True
+        if not self.allow_header:
+            return False
+        return any(name == PROFILE_HEADER.encode() and value.strip() in (b"1", b"true")
+                   for name, value in scope["headers"])
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self._enabled(scope):
+            await self.app(scope, receive, send)
+            return
+
+        with profile_sql() as profile:
+            async def send_with_summary(message):
+                if message["type"] == "http.response.start":
+                    summary = profile.summary(self.repeat_threshold).encode("latin-1")
+                    message = {**message, "headers": [*message.get("headers", []), (PROFILE_HEADER.encode(), summary)]}
+                await send(message)
+
+            try:
+                await self.app(scope, receive, send_with_summary)
+            finally:
+                level = logging.WARNING if profile.repeated(self.repeat_threshold) else logging.INFO
+                logger.log(level, "SQL profile of %s %s: %s", scope["method"], scope["path"], profile.report(self.repeat_threshold))
@@ -0,0 +1,99 @@
+from collections import Counter
+from datetime import datetime
+from sqlalchemy import bindparam, delete, text, update
+from sqlmodel import select, func
+
+from .database import dialect_insert
+from .models import Click, ClickDaily, ClickHourly, Site, UserAgent
+
+
+# Add counts to a rollup table, rows are sorted so concurrent flushers lock them in the same order
+async def _upsert_counts(conn, model, counts: Counter):
+    if not counts:
+        return
+    table = model.__table__
+    statement = dialect_insert(conn, table)
+    statement = statement.on_conflict_do_update(
+        index_elements=[column.name for column in table.primary_key],
+        set_={"clicks": table.c.clicks + statement.excluded.clicks},
+    )
+    rows = [
+        {"url_id": url_id, "bucket": bucket, "browser": browser, "os": os, "device": device, "clicks": clicks}
+        for (url_id, bucket, browser, os, device), clicks in sorted(counts.items())
+    ]
+    await conn.execute(statement, rows)
+
+# Fold a batch of clicks (dicts with url_id, timestamp, browser, os and device) into the rollups and Site.total_clicks
+async def apply_click_rollups(conn, clicks):
+    hourly, daily, totals = Counter(), Counter(), Counter()
+    for click in clicks:
+        hour = click["timestamp"].replace(minute=0, second=0, microsecond=0)
+        family = (click["browser"], click["os"], click["device"])
+        hourly[(click["url_id"], hour, *family)] += 1
+        daily[(click["url_id"], hour.replace(hour=0), *family)] += 1
+        totals[click["url_id"]] += 1
+
+    await _upsert_counts(conn, ClickHourly, hourly)
+    await _upsert_counts(conn, ClickDaily, daily)
+    if totals:
+        statement = (
+            update(Site)
+            .where(Site.url_key == bindparam("b_url_key"))
+            .values(total_clicks=Site.total_clicks + bindparam("b_clicks"))
+        )
+        await conn.execute(statement, [{"b_url_key": url_key, "b_clicks": count} for url_key, count in sorted(totals.items())])
+
+# Recompute the rollups from the raw clicks, chunk by chunk. With since, only the days from since on are
+# rebuilt, older aggregates are kept because their raw clicks may already be past the retention.
+# Clicks ingested while the rebuild runs are counted by the flusher, the scan stops at the highest
+# click id seen when it started. A flush still in flight when the counts are reset would be counted
+# twice, by its own upsert after the reset and by the scan, so the reset waits for running flushes and
+# holds new ones back until it commits (on Postgres by locking click, SQLite has a single writer anyway).
+async def rebuild_rollups(engine, chunk_size: int = 10000, since: datetime | None = None) -> int:
+    if since is not None:
+        since = since.replace(hour=0, minute=0, second=0, microsecond=0)
+
+    async with engine.begin() as conn:
+        if conn.dialect.name == "postgresql":
+            # conflicts with the flushers' inserts, not with reads of the clicks
+            await conn.execute(text("LOCK TABLE click IN EXCLUSIVE MODE"))
+        if since is None:
+            await conn.execute(delete(ClickHourly))
+            await conn.execute(delete(ClickDaily))
+            await conn.execute(update(Site).values(total_clicks=0))
+        else:
+            removed = (await conn.execute(
+                select(ClickDaily.url_id, func.sum(ClickDaily.clicks))
+                .where(ClickDaily.bucket >= since)
+                .group_by(ClickDaily.url_id)
+            )).all()
+            if removed:
+                await conn.execute(
+                    update(Site)
+                    .where(Site.url_key == bindparam("b_url_key"))
+                    .values(total_clicks=Site.total_clicks - bindparam("b_clicks")),
+                    [{"b_url_key": url_key, "b_clicks": count} for url_key, count in sorted(removed)],
+                )
+            await conn.execute(delete(ClickHourly).where(ClickHourly.bucket >= since))
+            await conn.execute(delete(ClickDaily).where(ClickDaily.bucket >= since))
+        high = (await conn.execute(select(func.max(Click.id)))).scalar()
+
+    processed, last = 0, 0
+    while high is not None and last < high:
+        async with engine.begin() as conn:
+            statement = (
+                select(Click.id, Click.url_id, Click.timestamp, UserAgent.browser, UserAgent.os, UserAgent.device)
+                .join(UserAgent, Click.user_agent_id == UserAgent.id)
+                .where(Click.id > last, Click.id <= high)
+                .order_by(Click.id)
+                .limit(chunk_size)
+            )
+            if since is not None:
+                statement = statement.where(Click.timestamp >= since)
+            clicks = (await conn.execute(statement)).mappings().all()
+            if not clicks:
+                break
+            await apply_click_rollups(conn, clicks)
+        processed += len(clicks)
+        last = clicks[-1]["id"]
+    return processed
@@ -1,98 +1,274 @@
-from typing import Annotated, List
-from fastapi import APIRouter, HTTPException, Request, Query
-from fastapi.responses import RedirectResponse
+from datetime import datetime
+from typing import Annotated, List, Literal
+from fastapi import APIRouter, HTTPException, Request, Response, Query
+from fastapi.responses import StreamingResponse
+from urllib.parse import quote
+from sqlalchemy import bindparam
+from sqlalchemy.exc import IntegrityError
 from sqlmodel import select
 
+from ..analytics import get_click_stats, get_clicks_page, get_site_version
 from ..auth import CurrentUserDep
-from ..database import SessionDep
-from ..models import Site, Click
-from ..schemas import SiteCreate, SiteRead
-from ..utils import generate_unique_key, get_browser_info
+from ..bulk import BULK_REQUEST_BODY, BulkRequestError, create_sites, is_ndjson, read_bulk_items, stream_json_array
+from ..cache import redirect_lookup
+from ..clicks import click_queue
+from ..conditional import is_not_modified, make_etag, not_modified, validator_headers
+from ..config import settings
+from ..export import (
+    CLICK_FIELDS, MEDIA_TYPES, SITE_FIELDS, accepts_gzip, click_export_row, click_export_statement, format_rows,
+    gzip_stream, site_export_row, site_export_statement, stream_rows,
+)
+from ..database import SessionDep, dialect_insert
+from ..keys import KeyspaceExhausted, key_allocator
+from ..models import Site
+from ..pagination import InvalidCursor, estimate_count, keyset_page, time_range
+from ..responses import ModelSerializer
+from ..schemas import BulkSiteResult, SiteCreate, SiteRead, SiteInfo, UserBase
+
+
+# listing order of a user's links, served by ix_site_user_id_created_at_url_key
+SITE_ORDER = (Site.created_at, Site.url_key)
 
+# the listing and analytics payloads are the largest, they go out through their TypeAdapters
+SITE_LIST = ModelSerializer(List[SiteRead])
+SITE_INFO = ModelSerializer(SiteInfo)
 
 router = APIRouter(
     prefix='/urls',
     tags=["sites"],
 )
 
-# Create shorten url key
+# Create shorten url key. Each attempt is a single INSERT .. ON CONFLICT (url_key) DO NOTHING, an
+# empty RETURNING means the key was taken and another one is tried
 @router.post("/", status_code=201, response_model=SiteRead)
-def create_url(url: SiteCreate, session: SessionDep, current_user: CurrentUserDep):
-    while True:
-        unique_key = generate_unique_key(url.length)
-        if session.get(Site, unique_key) is None:
+async def create_url(url: SiteCreate, session: SessionDep, current_user: CurrentUserDep):
+    engine = session.bind
+    for _ in range(settings.key_max_attempts):
+        try:
+            unique_key = await key_allocator.next_key(url.length, engine)
+        except KeyspaceExhausted:
             break
-    
-    statement = select(Site).where(Site.target_url == url.target_url, Site.user_id == current_user.id)         
-    existing_site = session.exec(statement).first()
-    if existing_site:
-        raise HTTPException(status_code=400, detail="URL already exists in your database.")
-    
-    data = Site(target_url=url.target_url, url_key=unique_key, user_id=current_user.id)
-    session.add(data)
-    session.commit()
-    session.refresh(data)
-    return data
-
-
-# Get all sites created by user
+        statement = dialect_insert(engine, Site.__table__).values(
+            target_url=url.target_url, url_key=unique_key, user_id=current_user.id,
+        ).on_conflict_do_nothing(index_elements=["url_key"]).returning(Site.url_key, Site.created_at)
+        # the (user_id, target_url_hash) unique constraint rejects duplicates, no check-then-insert race
+        try:
+            row = (await session.exec(statement)).first()
+            await session.commit()
+        except IntegrityError:
+            await session.rollback()
+            raise HTTPException(status_code=400, detail="URL already exists in your database.")
+        if row is not None:
+            await redirect_lookup.invalidate([row.url_key])
+            return SiteRead(target_url=url.target_url, url_key=row.url_key, created_at=row.created_at, user=current_user)
+        key_allocator.record_collision()
+
+    raise HTTPException(status_code=503, detail="Could not allocate a short key, try a longer length.")
+
+
+# Create many short urls from a JSON array or an NDJSON body of SiteCreate items. Results come back per
+# item in request order, streamed as a JSON array (or NDJSON when asked for) for large batches.
+@router.post("/bulk/", response_model=List[BulkSiteResult], openapi_extra=BULK_REQUEST_BODY)
+async def create_urls_bulk(request: Request, session: SessionDep, current_user: CurrentUserDep):
+    try:
+        items = await read_bulk_items(
+            request.stream(), request.headers.get("content-type"), request.headers.get("content-length"),
+            settings.bulk_max_items, settings.bulk_max_body_bytes,
+        )
+    except BulkRequestError as exc:
+        raise HTTPException(status_code=exc.status_code, detail=exc.detail)
+
+    # the bulk work takes its own connections chunk by chunk, the one the session may hold since the user
+    # lookup goes back to the pool rather than staying checked out while the results stream
+    engine = session.bind
+    await session.close()
+    results = create_sites(engine, current_user.id, items, settings.bulk_chunk_size)
+    if is_ndjson(request.headers.get("accept")):
+        return StreamingResponse(
+            (result.model_dump_json() + "\n" async for result in results), media_type="application/x-ndjson",
+        )
+    if len(items) > settings.bulk_stream_threshold:
+        return StreamingResponse(stream_json_array(results), media_type="application/json")
+    return [result async for result in results]
+
+
+# Get all sites created by user, a page at a time in (created_at, url_key) order. X-Next-Cursor is the
+# cursor of the next page, X-Total-Count the number of matching links (a planner estimate on postgres).
+# The ETag covers the links of the page and their click totals, a 304 skips the count and serialization.
 @router.get("/all/", response_model=List[SiteRead])
-def read_all_sites(
+async def read_all_sites(
+    request: Request,
     session: SessionDep,
     current_user: CurrentUserDep,
-    offset: int = 0,
-    limit: Annotated[int, Query(le=100)] = 100,
+    cursor: str | None = None,
+    limit: Annotated[int, Query(ge=1, le=100)] = 100,
+    target_prefix: str | None = None,
+    since: datetime | None = None,
+    until: datetime | None = None,
+    offset: Annotated[int, Query(ge=0, deprecated=True)] = 0,
     ):
-    statement = select(Site).where(Site.user_id == current_user.id).offset(offset).limit(limit)
-    data = session.exec(statement).all()
+    statement = select(Site).where(Site.user_id == current_user.id)
+    if target_prefix:
+        statement = statement.where(Site.target_url.startswith(target_prefix, autoescape=True))
+    statement = time_range(statement, Site.created_at, since, until)
+
+    try:
+        data, next_cursor = await keyset_page(
+            session, statement.offset(offset or None), SITE_ORDER, (datetime, str), cursor, limit,
+        )
+    except InvalidCursor as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
     if not data:
         raise HTTPException(status_code=404, detail="No URLs found")
-    
-    return data
 
-# Get sites data analytics by url_key
-@router.get("/info/{url_key}/", response_model=SiteRead)
-def get_url_info(url_key: str, session: SessionDep, current_user: CurrentUserDep):
-    data = session.get(Site, url_key)
-    if not data:
+    etag = make_etag([(site.url_key, site.total_clicks) for site in data], next_cursor, offset, current_user.updated_at)
+    headers = validator_headers(etag)
+    if is_not_modified(request, etag):
+        return not_modified(headers)
+
+    if next_cursor is None and cursor is None:
+        total = offset + len(data)
+    else:
+        # the estimate can lag behind on fresh tables, it is never less than what this page has shown
+        total = max(await estimate_count(session, statement), offset + len(data) + (next_cursor is not None))
+    headers["X-Total-Count"] = str(total)
+    if next_cursor is not None:
+        headers["X-Next-Cursor"] = next_cursor
+    # every link belongs to current_user, no need to load Site.user. The page is validated in one call,
+    # with the user validated once for all rows.
+    user = UserBase.model_validate(current_user)
+    sites = SITE_LIST.validate([
+        {"target_url": site.target_url, "url_key": site.url_key, "created_at": site.created_at, "total_clicks": site.total_clicks, "user": user}
+        for site in data
+    ])
+    return SITE_LIST.response(sites, headers=headers)
+
+
+def export_response(request: Request, batches, export_format: str, fields: list[str], filename: str):
+    chunks = format_rows(batches, export_format, fields)
+    headers = {"Content-Disposition": f'attachment; filename="{filename}.{export_format}"', "Vary": "Accept-Encoding"}
+    if accepts_gzip(request.headers.get("accept-encoding")):
+        chunks = gzip_stream(chunks)
+        headers["Content-Encoding"] = "gzip"
+    return StreamingResponse(chunks, media_type=MEDIA_TYPES[export_format], headers=headers)
+
+# Stream all the user's links as NDJSON or CSV. Every row has a cursor, pass the last one received to resume.
+@router.get("/export/")
+async def export_sites(
+    request: Request,
+    session: SessionDep,
+    current_user: CurrentUserDep,
+    export_format: Annotated[Literal["ndjson", "csv"], Query(alias="format")] = "ndjson",
+    since: datetime | None = None,
+    until: datetime | None = None,
+    cursor: str | None = None,
+    ):
+    try:
+        statement = site_export_statement(current_user.id, since, until, cursor)
+    except InvalidCursor as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+
+    batches = stream_rows(session.bind, statement, site_export_row, settings.export_batch_size)
+    return export_response(request, batches, export_format, SITE_FIELDS, "urls")
+
+# Stream the raw clicks of the user's links, or of one link with url_key, in the same formats
+@router.get("/export/clicks/")
+async def export_clicks(
+    request: Request,
+    session: SessionDep,
+    current_user: CurrentUserDep,
+    export_format: Annotated[Literal["ndjson", "csv"], Query(alias="format")] = "ndjson",
+    url_key: str | None = None,
+    since: datetime | None = None,
+    until: datetime | None = None,
+    cursor: str | None = None,
+    ):
+    try:
+        statement = click_export_statement(current_user.id, since, until, cursor, url_key)
+    except InvalidCursor as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+
+    batches = stream_rows(session.bind, statement, click_export_row, settings.export_batch_size)
+    return export_response(request, batches, export_format, CLICK_FIELDS, "clicks")
+
+
+# Get sites data analytics by url_key, clicks_detail is paginated with the click id cursor. The ETag
+# is derived from the site row and its first and last click id, a 304 skips the breakdown queries.
+@router.get("/info/{url_key}/", response_model=SiteInfo)
+async def get_url_info(
+    url_key: str,
+    request: Request,
+    session: SessionDep,
+    current_user: CurrentUserDep,
+    cursor: int | None = None,
+    limit: Annotated[int, Query(ge=1, le=1000)] = 100,
+    ):
+    version = await get_site_version(url_key, session)
+    if not version:
         raise HTTPException(status_code=404, detail="URL not found")
-    
-    return SiteRead(
+
+    data, first_click, last_click = version
+    etag = make_etag(data.url_key, data.target_url, data.total_clicks, first_click, last_click, cursor, limit, current_user.updated_at)
+    headers = validator_headers(etag)
+    if is_not_modified(request, etag):
+        return not_modified(headers)
+
+    stats = await get_click_stats(data, session)
+    clicks_detail, next_cursor = await get_clicks_page(url_key, session, after=cursor, limit=limit)
+    info = SiteInfo(
         target_url=data.target_url,
         url_key=data.url_key,
         created_at=data.created_at,
-        total_clicks=len(data.clicks),
-        clicks_detail=[
-            {
-                "id": click.id,
-                "timestamp": click.timestamp,
-                "browser": get_browser_info(click.user_agent)
-                }
-            for click in data.clicks],
-        user=current_user
+        clicks_detail=clicks_detail,
+        next_cursor=next_cursor,
+        user=current_user,
+        **stats,
         )
+    return SITE_INFO.response(info, headers=headers)
 
-# returns original website url with url shorten key
-@router.get("/{url_key}/")
-def get_target_url(url_key: str, request: Request, session: SessionDep):
-    data = session.get(Site, url_key) 
-    if not data:
-        raise HTTPException(status_code=404, detail="URL not found")
-    
-    click = Click(url_id=data.url_key, user_agent=request.headers.get("user-agent"))
-    session.add(click)
-    session.commit()
-    
-    return RedirectResponse(data.target_url)
+# Location header of a redirect, quoted like starlette's RedirectResponse does
+def redirect_location(target_url: str) -> str:
+    return quote(target_url, safe=":/%#?=@[]!$&'()*+,;~")
+
+# the one column a redirect needs, compiled once and reused from SQLAlchemy's statement cache
+TARGET_URL_QUERY = select(Site.target_url).where(Site.url_key == bindparam("url_key"))
+NOT_FOUND_BODY = b'{"detail":"URL not found"}'
+
+# returns original website url with url shorten key. This is the hot path, so it is a plain Starlette
+# route: no dependency injection, session or ORM object, just the cached Location header (the process
+# cache, then the shared cache tier) and a Core SELECT of target_url on a miss.
+async def get_target_url(request: Request) -> Response:
+    url_key = request.path_params["url_key"]
+
+    async def load_location():
+        async with request.app.state.engine.connect() as conn:
+            target_url = (await conn.execute(TARGET_URL_QUERY, {"url_key": url_key})).scalar()
+        return redirect_location(target_url) if target_url is not None else None
+
+    location = await redirect_lookup.get_or_load(url_key, load_location)
+    if location is None:
+        return Response(NOT_FOUND_BODY, status_code=404, media_type="application/json")
+
+    await click_queue.put(url_key, request.headers.get("user-agent"))
+    headers = {"location": location}
+    if settings.redirect_cache_control:
+        headers["cache-control"] = settings.redirect_cache_control
+    return Response(status_code=settings.redirect_status_code, headers=headers)
+
+# plain routes do not get the router prefix
+router.add_route(router.prefix + "/{url_key}/", get_target_url, methods=["GET"], include_in_schema=False)
 
 
 # Delete url link
 @router.delete("/{url_key}/", status_code=204)
-def delete_url(url_key: str, session: SessionDep, current_user: CurrentUserDep):
-    data = session.get(Site, url_key)
+async def delete_url(url_key: str, session: SessionDep, current_user: CurrentUserDep):
+    data = await session.get(Site, url_key)
     if not data:
         raise HTTPException(status_code=404, detail="URL not found")
         
-    session.delete(data)
-    session.commit()   
+    await session.delete(data)
+    await session.commit()
+    await redirect_lookup.invalidate([url_key])
+    if redirect_lookup.key_filter is not None:
+        redirect_lookup.key_filter.record_deleted()
     return
\ No newline at end of file
@@ -1,16 +1,36 @@
 from typing import Annotated
 from datetime import timedelta
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Request
 from fastapi.security import OAuth2PasswordRequestForm
 
-from ..auth import CurrentUserDep, create_access_token
+from ..auth import CurrentUserDep, create_access_token, invalidate_principal
+from ..conditional import is_not_modified, make_etag, not_modified, validator_headers
 from ..config import settings 
 from ..database import SessionDep
-from ..models import User
-from ..schemas import UserCreate, UserRead, Token
+from ..models import User, get_utc_now
+from ..passwords import PasswordHasherBusy, password_hasher
+from ..responses import ModelSerializer
+from ..schemas import UserCreate, UserRead, UserUpdate, Token
+from ..tokens import token_service
 from .. import utils
 
 
+USER_READ = ModelSerializer(UserRead)
+
+# bcrypt runs on the password hasher pool, a full queue answers 503 rather than stalling every request
+async def hash_password(password: str) -> str:
+    try:
+        return await password_hasher.hash(password)
+    except PasswordHasherBusy:
+        raise HTTPException(status_code=503, detail="Server busy, try again shortly", headers={"Retry-After": "1"})
+
+async def verify_password(password: str, hashed_password: str) -> bool:
+    try:
+        return await password_hasher.verify(password, hashed_password)
+    except PasswordHasherBusy:
+        raise HTTPException(status_code=503, detail="Server busy, try again shortly", headers={"Retry-After": "1"})
+
+
 router = APIRouter(
     tags=["users"],
 )
@@ -18,14 +38,14 @@ router = APIRouter(
 # signup route for user registration
 @router.post("/signup/", status_code=201, response_model=UserRead)
 async def signup(user: UserCreate, session: SessionDep):
-    if utils.get_user_from_db(user.username, session) is not None:
+    if await utils.get_user_from_db(user.username, session) is not None:
         raise HTTPException(status_code=400, detail="Username is already registered")
     
-    user.password = utils.get_hash_password(user.password)
+    user.password = await hash_password(user.password)
     user_db = User.model_validate(user)
     session.add(user_db)
-    session.commit()
-    session.refresh(user_db)
+    await session.commit()
+    await session.refresh(user_db)
     return user_db
 
 # login route for user authentication
@@ -37,20 +57,56 @@ async def login(form_data: Annotated[OAuth2PasswordRequestForm, Depends()], sess
             headers={"WWW-Authenticate": "Bearer"},
             )
     
-    user = utils.get_user_from_db(form_data.username, session)
+    user = await utils.get_user_from_db(form_data.username, session)
     if not user:
         raise badrequest_exception
-    if not utils.verify_password(form_data.password, user.password):
+    if not await verify_password(form_data.password, user.password):
         raise badrequest_exception
+    if password_hasher.needs_rehash(user.password):
+        user.password = await hash_password(form_data.password)
+        await session.commit()
     
     access_token_expires = timedelta(minutes=settings.access_token_expire_minutes)
     access_token = create_access_token(
-        data={"sub": user.username}, expires_delta=access_token_expires
+        data={"sub": user.username, "uid": user.id}, expires_delta=access_token_expires
     )
     return Token(access_token=access_token, token_type="bearer")
 
-# get self profile information
+# get self profile information, the full row rather than the cached principal. Every change bumps
+# updated_at; the validators come from the row, not the principal, which another worker may have
+# changed since it was cached. A revalidating client gets a 304 after that single primary key read.
 @router.get("/users/me/", response_model=UserRead)
-async def read_users_me(current_user: CurrentUserDep):
-    return current_user
-    
\ No newline at end of file
+async def read_users_me(request: Request, current_user: CurrentUserDep, session: SessionDep):
+    user = await session.get(User, current_user.id)
+    etag = make_etag(user.id, user.updated_at)
+    headers = validator_headers(etag, user.updated_at)
+    if is_not_modified(request, etag, user.updated_at):
+        return not_modified(headers)
+    return USER_READ.response(UserRead.model_validate(user), headers=headers)
+
+# update self profile information
+@router.patch("/users/me/", response_model=UserRead)
+async def update_users_me(update: UserUpdate, current_user: CurrentUserDep, session: SessionDep):
+    user = await session.get(User, current_user.id)
+    for field, value in update.model_dump(exclude_unset=True).items():
+        setattr(user, field, value)
+    user.updated_at = get_utc_now()
+    await session.commit()
+    await invalidate_principal(user.username)
+    return user
+
+# deactivate own account, its tokens stop working once the principal cache entries are gone, see
+# invalidate_principal
+@router.post("/users/me/deactivate/", status_code=204)
+async def deactivate_users_me(current_user: CurrentUserDep, session: SessionDep):
+    user = await session.get(User, current_user.id)
+    user.active = False
+    user.updated_at = get_utc_now()
+    await session.commit()
+    await invalidate_principal(user.username)
+    return
+    
+# public keys that verify access tokens, empty while tokens are signed with the shared secret
+@router.get("/.well-known/jwks.json")
+async def read_jwks():
+    return token_service.jwks()
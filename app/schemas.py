@@ -1,4 +1,4 @@
-from typing import List
+from typing import Dict, List, Literal
 from datetime import datetime
 from pydantic import BaseModel
 from sqlmodel import Field, SQLModel
@@ -10,7 +10,7 @@ class SiteBase(SQLModel):
     target_url: str = Field(nullable=False)
     
 class SiteCreate(SiteBase):
-    length: int = Field(default=6)
+    length: int = Field(default=6, ge=1, le=32)
     
 class SiteRead(SiteBase):
     url_key: str
@@ -19,6 +19,22 @@ class SiteRead(SiteBase):
     clicks_detail: List[dict] = Field(default_factory=list)
     user: "UserBase"
 
+class SiteInfo(SiteRead):
+    clicks_per_day: Dict[str, int] = Field(default_factory=dict)
+    browsers: Dict[str, int] = Field(default_factory=dict)
+    operating_systems: Dict[str, int] = Field(default_factory=dict)
+    devices: Dict[str, int] = Field(default_factory=dict)
+    next_cursor: int | None = None
+
+# Outcome of one item of a bulk create, index is the item's position in the request
+class BulkSiteResult(SQLModel):
+    index: int
+    status: Literal["created", "exists", "invalid", "error"]
+    target_url: str | None = None
+    url_key: str | None = None
+    created_at: datetime | None = None
+    detail: str | None = None
+
     
 #============================= User Model =============================
 
@@ -0,0 +1,132 @@
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from time import time
+
+import jwt
+from jwt import PyJWK, PyJWKSet
+from jwt.algorithms import get_default_algorithms
+from jwt.exceptions import InvalidTokenError
+from jwt.utils import base64url_encode
+
+from .cache import LRUCache
+from .config import settings
+
+
+SYMMETRIC_ALGORITHMS = ("HS256", "HS384", "HS512")
+
+
+# A signing key and its verifier, both parsed once when the service is built
+@dataclass(frozen=True)
+class TokenKey:
+    kid: str | None
+    algorithm: str
+    verifier: PyJWK
+    signer: object | None = None
+
+    @property
+    def symmetric(self) -> bool:
+        return self.algorithm in SYMMETRIC_ALGORITHMS
+
+
+# Key settings hold either the PEM / JSON text itself or a path to a file with it
+def load_key_material(value: str) -> str:
+    if value.lstrip().startswith(("-----BEGIN", "{")):
+        return value
+    return Path(value).read_text()
+
+def get_algorithm(name: str):
+    algorithms = get_default_algorithms()
+    if name not in algorithms:
+        raise ValueError(f"Unsupported JWT algorithm {name}, asymmetric algorithms need the cryptography package")
+    return algorithms[name]
+
+# Key for the configured algorithm: the shared secret for HS*, a private key (or only the public key on
+# nodes that just verify tokens) for RS*, PS*, ES* and EdDSA
+def build_token_key(algorithm: str, kid: str | None = None, secret: str | None = None,
+                    private_key: str | None = None, public_key: str | None = None) -> TokenKey:
+    alg = get_algorithm(algorithm)
+    if algorithm in SYMMETRIC_ALGORITHMS:
+        jwk = {"kty": "oct", "k": base64url_encode(secret.encode("utf-8")).decode("ascii")}
+        return TokenKey(kid, algorithm, PyJWK({**jwk, **({"kid": kid} if kid else {})}, algorithm), alg.prepare_key(secret))
+
+    if private_key is None and public_key is None:
+        raise ValueError(f"{algorithm} needs JWT_PRIVATE_KEY or JWT_PUBLIC_KEY")
+    signer = alg.prepare_key(load_key_material(private_key)) if private_key else None
+    public = alg.prepare_key(load_key_material(public_key)) if public_key else signer.public_key()
+    jwk = alg.to_jwk(public, as_dict=True)
+    if kid:
+        jwk["kid"] = kid
+    return TokenKey(kid, algorithm, PyJWK(jwk, algorithm), signer)
+
+
+# Issues and verifies access tokens with keys prepared up front. Tokens name their key with the kid
+# header so old keys can keep verifying while a new one signs, tokens without a kid use the active key.
+# Verified claims are cached by token for a short while, bearer tokens repeat on every request.
+class TokenService:
+    def __init__(self, active: TokenKey, extra_keys: list[TokenKey] = (), cache: LRUCache | None = None):
+        self.active = active
+        self.keys = {key.kid: key for key in extra_keys}
+        self.keys[active.kid] = active
+        self.cache = cache
+
+    @classmethod
+    def from_settings(cls, settings) -> "TokenService":
+        active = build_token_key(
+            settings.algorithm, settings.jwt_key_id, settings.secret_key,
+            settings.jwt_private_key, settings.jwt_public_key,
+        )
+        extra_keys = []
+        if settings.jwt_jwks:
+            for jwk in PyJWKSet.from_json(load_key_material(settings.jwt_jwks)).keys:
+                extra_keys.append(TokenKey(jwk.key_id, jwk.algorithm_name, jwk))
+        cache = LRUCache(maxsize=settings.token_cache_size, ttl=settings.token_cache_ttl) if settings.token_cache_size else None
+        return cls(active, extra_keys, cache)
+
+    def encode(self, claims: dict, expires_delta: timedelta) -> str:
+        if self.active.signer is None:
+            raise RuntimeError("No JWT_PRIVATE_KEY configured, this node can only verify tokens")
+        payload = {**claims, "exp": datetime.now(timezone.utc) + expires_delta}
+        headers = {"kid": self.active.kid} if self.active.kid else None
+        return jwt.encode(payload, self.active.signer, algorithm=self.active.algorithm, headers=headers)
+
+    def _verify(self, token: str) -> dict:
+        # the header is only parsed to pick a key while more than one is configured
+        if len(self.keys) == 1:
+            key = self.active
+        else:
+            kid = jwt.get_unverified_header(token).get("kid")
+            key = self.keys.get(kid) if kid else self.active
+            if key is None:
+                raise InvalidTokenError("Unknown key id")
+        # each key only accepts its own algorithm, so a token cannot pick a weaker one
+        return jwt.decode(token, key.verifier, algorithms=[key.algorithm])
+
+    # Claims of a valid token, raises InvalidTokenError otherwise
+    def decode(self, token: str) -> dict:
+        if self.cache is None:
+            return self._verify(token)
+        claims = self.cache.get(token)
+        if claims is not None:
+            if claims.get("exp", float("inf")) > time():
+                return claims
+            self.cache.invalidate(token)
+            raise jwt.ExpiredSignatureError("Signature has expired")
+        claims = self._verify(token)
+        self.cache.set(token, claims)
+        return claims
+
+    # Public keys as a JWK Set, so other services can verify tokens without the signing key.
+    # Shared secrets are never published.
+    def jwks(self) -> dict:
+        keys = []
+        for key in self.keys.values():
+            if key.symmetric:
+                continue
+            jwk = get_algorithm(key.algorithm).to_jwk(key.verifier.key, as_dict=True)
+            jwk.update({"alg": key.algorithm, "use": "sig", **({"kid": key.kid} if key.kid else {})})
+            keys.append(jwk)
+        return {"keys": keys}
+
+
+token_service = TokenService.from_settings(settings)
@@ -1,24 +1,33 @@
 import bcrypt
-from random import choices
-import string
+from functools import lru_cache
+from typing import NamedTuple
 from user_agents import parse
 from sqlmodel import select
+from .config import settings
 from .models import User
 
-# Return decode str hashed password with bcrypt algo from password in binary and rand salt
-def get_hash_password(password):
-    return bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt()).decode("utf-8")
+# Return decode str hashed password with bcrypt algo from password in binary and rand salt.
+# These block for the whole bcrypt run, request handlers go through app.passwords.password_hasher.
+def get_hash_password(password, rounds=None):
+    salt = bcrypt.gensalt(rounds=rounds or settings.bcrypt_rounds)
+    return bcrypt.hashpw(password.encode("utf-8"), salt).decode("utf-8")
 
 def verify_password(plain_password, hashed_password):
     return bcrypt.checkpw(plain_password.encode("utf-8"), hashed_password.encode("utf-8"))
 
-def generate_unique_key(length):
-    return ''.join(choices(string.ascii_letters + string.digits, k=length))
+class BrowserInfo(NamedTuple):
+    browser: str
+    os: str
+    device: str
 
-def get_browser_info(user_agent_str):
-    ua = parse(user_agent_str)
+# browser, operating system and device family of a user agent string, memoized because
+# parsing is regex heavy and real traffic only has a small set of distinct user agents
+@lru_cache(maxsize=settings.user_agent_cache_size)
+def get_browser_info(user_agent_str) -> BrowserInfo:
+    ua = parse(user_agent_str or "")
+    return BrowserInfo(ua.browser.family, ua.os.family, ua.device.family)
 
-def get_user_from_db(username: str, session):
+async def get_user_from_db(username: str, session):
     statement = select(User).where(User.username == username)
-    user = session.exec(statement).one_or_none()
+    user = (await session.exec(statement)).one_or_none()
     return user
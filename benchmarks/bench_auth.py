@@ -0,0 +1,74 @@
+"""Per-request token verification cost, before and after the token service.
+
+Run from the repository root:
+
+    python benchmarks/bench_auth.py [--number 20000]
+
+"before" is what get_current_user used to do on every request, jwt.decode with the raw key
+(the PEM is parsed again on every call for asymmetric algorithms). "prepared" verifies with the
+key objects the token service builds once, "cached" is a repeated bearer token answered from the
+verified-token cache.
+"""
+import argparse
+import os
+import sys
+import timeit
+from datetime import timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+os.environ.setdefault("SECRET_KEY", "benchmark-secret")
+os.environ.setdefault("ALGORITHM", "HS256")
+
+import jwt
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519, rsa
+
+from app.cache import LRUCache
+from app.tokens import TokenService, build_token_key
+
+
+def pem_pair(private_key) -> tuple[str, str]:
+    private = private_key.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption(),
+    ).decode("ascii")
+    public = private_key.public_key().public_bytes(
+        serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo,
+    ).decode("ascii")
+    return private, public
+
+def cases():
+    yield "HS256", "benchmark-secret", "benchmark-secret", {"secret": "benchmark-secret"}
+    for algorithm, private_key in (
+        ("RS256", rsa.generate_private_key(public_exponent=65537, key_size=2048)),
+        ("ES256", ec.generate_private_key(ec.SECP256R1())),
+        ("EdDSA", ed25519.Ed25519PrivateKey.generate()),
+    ):
+        private, public = pem_pair(private_key)
+        yield algorithm, private, public, {"private_key": private}
+
+def per_call_us(statement, number: int) -> float:
+    return min(timeit.repeat(statement, number=number, repeat=3)) / number * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--number", type=int, default=20000, help="verifications per measurement")
+    args = parser.parse_args()
+
+    print(f"{'algorithm':<10}{'before':>12}{'prepared':>12}{'cached':>12}   (microseconds per request)")
+    for algorithm, signing_key, verifying_key, key_args in cases():
+        service = TokenService(build_token_key(algorithm, **key_args), cache=LRUCache(maxsize=1000, ttl=60))
+        token = service.encode({"sub": "benchmark", "uid": 1}, timedelta(minutes=30))
+        service.decode(token)
+        number = args.number if algorithm in ("HS256", "EdDSA") else args.number // 10
+
+        before = per_call_us(lambda: jwt.decode(token, verifying_key, algorithms=[algorithm]), number)
+        prepared = per_call_us(lambda: service._verify(token), number)
+        cached = per_call_us(lambda: service.decode(token), number)
+        print(f"{algorithm:<10}{before:>12.1f}{prepared:>12.1f}{cached:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,280 @@
+"""Throughput and latency of the redirect, create, analytics and login paths.
+
+Run from the repository root:
+
+    python benchmarks/bench_load.py [--concurrency 32] [--requests 2000] [--output run.json]
+    python benchmarks/bench_load.py --output new.json --baseline run.json [--max-regression 10]
+
+Seeds --users users, --links links and --clicks clicks into a fresh sqlite database (or the empty
+scratch database given with --database-url), starts the app with its lifespan and drives each
+scenario through httpx's ASGI transport with --concurrency requests in flight. There is no network
+or server in the way, the numbers are the app's own cost on one event loop.
+
+Scenarios:
+
+    redirect  GET /urls/{key}/ on random seeded keys, the redirect cache warms up as the run goes
+    create    POST /urls/ with a new target url per request
+    info      GET /urls/info/{key}/ on random seeded keys
+    login     POST /login/, bound by bcrypt, set BCRYPT_ROUNDS to measure the rest
+
+Results are printed and, with --output, saved as JSON. With --baseline the run is compared against
+an earlier result file; --max-regression makes the script exit with status 1 when a scenario lost
+more than that many percent of throughput or gained as much p95 latency.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from time import perf_counter
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+SCENARIOS = ("redirect", "create", "info", "login")
+PASSWORD = "benchmark-password"
+USER_AGENTS = (
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0 Safari/537.36",
+    "Mozilla/5.0 (iPhone; CPU iPhone OS 17_4 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.4 Mobile/15E148 Safari/604.1",
+    "Mozilla/5.0 (X11; Linux x86_64; rv:125.0) Gecko/20100101 Firefox/125.0",
+    "curl/8.5.0",
+)
+SEED_BATCH = 1000
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--database-url", help="empty scratch database, a temporary sqlite file by default")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--links", type=int, default=2000)
+    parser.add_argument("--clicks", type=int, default=20000)
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="comma separated, from " + ", ".join(SCENARIOS))
+    parser.add_argument("--concurrency", type=int, default=32, help="requests in flight")
+    parser.add_argument("--requests", type=int, default=2000, help="measured requests per scenario")
+    parser.add_argument("--warmup", type=int, default=100, help="unmeasured requests per scenario")
+    parser.add_argument("--seed", type=int, default=0, help="random seed for the data and the request mix")
+    parser.add_argument("--output", type=Path, help="write the results as JSON")
+    parser.add_argument("--baseline", type=Path, help="results JSON of an earlier run to compare against")
+    parser.add_argument("--max-regression", type=float, help="exit 1 when RPS drops or p95 grows by more percent")
+    args = parser.parse_args(argv)
+    args.scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    return args
+
+
+# Users share one password hash, hashing thousands of passwords would make seeding bcrypt bound
+async def seed(engine, args, rng: random.Random) -> dict:
+    from sqlalchemy import insert, select
+
+    from app.auth import create_access_token
+    from app.config import settings
+    from app.keys import ALPHABET
+    from app.models import Click, Site, User, UserAgent, get_utc_now, hash64
+    from app.rollups import rebuild_rollups
+    from app.utils import get_browser_info, get_hash_password
+
+    password_hash = get_hash_password(PASSWORD, settings.bcrypt_rounds)
+    usernames = [f"bench{number}" for number in range(args.users)]
+    async with engine.begin() as conn:
+        await conn.execute(insert(User), [
+            {"username": username, "email": f"{username}@example.com", "password": password_hash}
+            for username in usernames
+        ])
+        users = (await conn.execute(select(User.id, User.username).where(User.username.in_(usernames)))).all()
+        await conn.execute(insert(UserAgent), [
+            {"ua_hash": hash64(user_agent), "user_agent": user_agent, **get_browser_info(user_agent)._asdict()}
+            for user_agent in USER_AGENTS
+        ])
+        agent_ids = (await conn.execute(select(UserAgent.id))).scalars().all()
+
+    keys = sorted({"".join(rng.choices(ALPHABET, k=7)) for _ in range(args.links)})
+    now = get_utc_now()
+    for start in range(0, len(keys), SEED_BATCH):
+        async with engine.begin() as conn:
+            await conn.execute(insert(Site), [
+                {
+                    "url_key": key,
+                    "target_url": f"https://example.com/{key}",
+                    "user_id": rng.choice(users).id,
+                    "created_at": now - timedelta(seconds=rng.randrange(90 * 24 * 3600)),
+                }
+                for key in keys[start:start + SEED_BATCH]
+            ])
+    for start in range(0, args.clicks, SEED_BATCH):
+        async with engine.begin() as conn:
+            await conn.execute(insert(Click), [
+                {
+                    "url_id": rng.choice(keys),
+                    "user_agent_id": rng.choice(agent_ids),
+                    "timestamp": now - timedelta(seconds=rng.randrange(30 * 24 * 3600)),
+                }
+                for _ in range(min(SEED_BATCH, args.clicks - start))
+            ])
+    await rebuild_rollups(engine)
+
+    tokens = [
+        create_access_token({"sub": user.username, "uid": user.id}, timedelta(hours=1))
+        for user in users
+    ]
+    return {"keys": keys, "usernames": usernames, "tokens": tokens}
+
+
+# Method, url, request options and the expected status of request number index
+def build_request(scenario: str, index: int, data: dict, rng: random.Random, run_id: str):
+    auth = {"Authorization": f"Bearer {rng.choice(data['tokens'])}"}
+    if scenario == "redirect":
+        return "GET", f"/urls/{rng.choice(data['keys'])}/", {"headers": {"User-Agent": rng.choice(USER_AGENTS)}}, 307
+    if scenario == "create":
+        body = {"target_url": f"https://example.org/{run_id}/{index}", "length": 7}
+        return "POST", "/urls/", {"json": body, "headers": auth}, 201
+    if scenario == "info":
+        return "GET", f"/urls/info/{rng.choice(data['keys'])}/", {"headers": auth}, 200
+    if scenario == "login":
+        form = {"username": rng.choice(data["usernames"]), "password": PASSWORD}
+        return "POST", "/login/", {"data": form}, 200
+    raise ValueError(scenario)
+
+# Nearest-rank percentile of sorted values
+def percentile(values: list[float], percent: float) -> float:
+    if not values:
+        return 0.0
+    rank = max(0, min(len(values) - 1, round(percent / 100 * len(values) + 0.5) - 1))
+    return values[rank]
+
+async def drive(client, scenario: str, requests: int, concurrency: int, data: dict, rng: random.Random, run_id: str) -> dict:
+    latencies = []
+    errors = 0
+    indexes = iter(range(requests))
+
+    async def worker():
+        nonlocal errors
+        for index in indexes:
+            method, url, options, expected = build_request(scenario, index, data, rng, run_id)
+            started = perf_counter()
+            try:
+                response = await client.request(method, url, **options)
+                failed = response.status_code != expected
+            except Exception:
+                failed = True
+            latencies.append(perf_counter() - started)
+            errors += failed
+
+    started = perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = perf_counter() - started
+
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "seconds": round(elapsed, 3),
+        "rps": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 3) if latencies else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+        "max_ms": round(latencies[-1] * 1000, 3) if latencies else 0.0,
+    }
+
+
+async def run(args) -> dict:
+    import httpx
+
+    from app.database import engine
+    from app.main import app
+
+    rng = random.Random(args.seed)
+    run_id = f"{datetime.now(timezone.utc):%Y%m%d%H%M%S}"
+    results = {}
+    async with app.router.lifespan_context(app):
+        seeded = perf_counter()
+        data = await seed(engine, args, rng)
+        print(f"seeded {args.users} users, {len(data['keys'])} links and {args.clicks} clicks in {perf_counter() - seeded:.1f}s")
+
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+            for scenario in args.scenarios:
+                await drive(client, scenario, args.warmup, args.concurrency, data, rng, f"{run_id}-warmup")
+                results[scenario] = await drive(client, scenario, args.requests, args.concurrency, data, rng, run_id)
+    await engine.dispose()
+    return results
+
+def metadata(args) -> dict:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "database": os.environ["DATABASE_URL"].split(":", 1)[0],
+        "users": args.users,
+        "links": args.links,
+        "clicks": args.clicks,
+        "concurrency": args.concurrency,
+        "requests": args.requests,
+        "seed": args.seed,
+    }
+
+
+def print_results(results: dict):
+    print(f"{'scenario':<10}{'requests':>10}{'errors':>8}{'rps':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for scenario, result in results.items():
+        print(f"{scenario:<10}{result['requests']:>10}{result['errors']:>8}{result['rps']:>10.1f}"
+              f"{result['p50_ms']:>10.2f}{result['p95_ms']:>10.2f}{result['p99_ms']:>10.2f}")
+
+def change(new: float, old: float) -> float:
+    return (new / old - 1) * 100 if old else 0.0
+
+# Scenarios whose throughput dropped or p95 grew by more than max_regression percent
+def compare(results: dict, baseline: dict, max_regression: float | None) -> list[str]:
+    regressions = []
+    print(f"\ncompared to {baseline['meta'].get('commit') or 'baseline'} from {baseline['meta'].get('timestamp')}")
+    print(f"{'scenario':<10}{'base rps':>10}{'change':>10}{'base p95':>10}{'change':>10}")
+    for scenario, result in results.items():
+        old = baseline["results"].get(scenario)
+        if old is None:
+            continue
+        rps_change = change(result["rps"], old["rps"])
+        p95_change = change(result["p95_ms"], old["p95_ms"])
+        print(f"{scenario:<10}{old['rps']:>10.1f}{rps_change:>+9.1f}%{old['p95_ms']:>10.2f}{p95_change:>+9.1f}%")
+        if max_regression is not None and (rps_change < -max_regression or p95_change > max_regression):
+            regressions.append(scenario)
+    return regressions
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    with tempfile.TemporaryDirectory() as directory:
+        os.environ["DATABASE_URL"] = args.database_url or f"sqlite:///{directory}/benchmark.db"
+        os.environ.setdefault("SECRET_KEY", "benchmark-secret")
+        os.environ.setdefault("ALGORITHM", "HS256")
+        results = asyncio.run(run(args))
+
+    print_results(results)
+    report = {"meta": metadata(args), "results": results}
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2) + "\n")
+        print(f"\nsaved to {args.output}")
+
+    if args.baseline:
+        regressions = compare(results, json.loads(args.baseline.read_text()), args.max_regression)
+        if regressions:
+            print(f"\nregressed by more than {args.max_regression}%: {', '.join(regressions)}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,121 @@
+"""Response serialization cost of the listing and analytics payloads, before and after the fast path.
+
+Run from the repository root:
+
+    python benchmarks/bench_serialize.py [--sites 100] [--clicks 1000] [--number 200]
+
+"before" is what FastAPI did with the models a route returned: validate them again against the
+response_model, dump them to plain data and encode that with json.dumps in JSONResponse. "after"
+dumps the models, validated once where the route built them, straight to JSON bytes with the
+route's TypeAdapter. For the listing the models are also built differently: one TypeAdapter
+validation of the page instead of a model_validate per row, with the user validated once.
+Payloads are a page of --sites links (100 is the largest page of /urls/all/) and a link with
+--clicks clicks_detail rows (1000 is the largest page of /urls/info/).
+"""
+import argparse
+import os
+import sys
+import timeit
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import List
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+os.environ.setdefault("SECRET_KEY", "benchmark-secret")
+os.environ.setdefault("ALGORITHM", "HS256")
+
+from fastapi.responses import JSONResponse
+from fastapi.utils import create_model_field
+
+from app.auth import Principal
+from app.models import Site
+from app.responses import ModelSerializer
+from app.schemas import SiteInfo, SiteRead, UserBase
+
+BROWSERS = ("Chrome", "Firefox", "Mobile Safari", "Edge")
+SYSTEMS = ("Windows", "Mac OS X", "iOS", "Android")
+DEVICES = ("Other", "iPhone", "Samsung SM-G991B")
+
+
+def principal() -> Principal:
+    return Principal(id=1, username="benchmark", email="benchmark@example.com", active=True, updated_at=datetime(2025, 4, 1))
+
+def listing(sites: int):
+    now = datetime(2025, 4, 20, 12)
+    rows = [
+        Site(url_key=f"k{number:06d}", target_url=f"https://example.com/articles/{number}?utm_source=benchmark",
+             user_id=1, created_at=now - timedelta(minutes=number), total_clicks=number * 7)
+        for number in range(sites)
+    ]
+    current_user = principal()
+
+    def before():
+        return [SiteRead.model_validate(site, update={"user": current_user}) for site in rows]
+
+    def after():
+        user = UserBase.model_validate(current_user)
+        return serializer.validate([
+            {"target_url": site.target_url, "url_key": site.url_key, "created_at": site.created_at, "total_clicks": site.total_clicks, "user": user}
+            for site in rows
+        ])
+
+    serializer = ModelSerializer(List[SiteRead])
+    return List[SiteRead], before, after
+
+def analytics(clicks: int):
+    started = datetime(2025, 4, 1)
+    clicks_detail = [
+        {"id": number, "timestamp": started + timedelta(seconds=number * 97), "browser": BROWSERS[number % 4],
+         "os": SYSTEMS[number % 4], "device": DEVICES[number % 3]}
+        for number in range(clicks)
+    ]
+    stats = {
+        "total_clicks": clicks,
+        "clicks_per_day": {f"2025-04-{day:02d}": clicks // 30 for day in range(1, 31)},
+        "browsers": {browser: clicks // 4 for browser in BROWSERS},
+        "operating_systems": {system: clicks // 4 for system in SYSTEMS},
+        "devices": {device: clicks // 3 for device in DEVICES},
+    }
+    current_user = principal()
+
+    def build():
+        return SiteInfo(target_url="https://example.com/articles/1", url_key="k000001", created_at=started,
+                        clicks_detail=clicks_detail, next_cursor=clicks, user=current_user, **stats)
+
+    return SiteInfo, build, build
+
+def per_call_us(statement, number: int) -> float:
+    return min(timeit.repeat(statement, number=number, repeat=3)) / number * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sites", type=int, default=100, help="links in the listing payload")
+    parser.add_argument("--clicks", type=int, default=1000, help="clicks_detail rows in the analytics payload")
+    parser.add_argument("--number", type=int, default=200, help="serializations per measurement")
+    args = parser.parse_args()
+
+    print(f"{'payload':<10}{'bytes':>10}{'before':>12}{'after':>12}{'speedup':>10}   (microseconds per response)")
+    for name, (model, build_before, build_after) in (
+        ("listing", listing(args.sites)),
+        ("analytics", analytics(args.clicks)),
+    ):
+        field = create_model_field(name="Response_" + name, type_=model, mode="serialization")
+        serializer = ModelSerializer(model)
+
+        def before():
+            value, _ = field.validate(build_before(), {}, loc=("response",))
+            return JSONResponse(field.serialize(value)).body
+
+        def after():
+            return serializer.response(build_after()).body
+
+        assert before() == after(), f"{name}: the fast path changed the response body"
+        old = per_call_us(before, args.number)
+        new = per_call_us(after, args.number)
+        print(f"{name:<10}{len(after()):>10}{old:>12.1f}{new:>12.1f}{old / new:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
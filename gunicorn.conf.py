@@ -0,0 +1,24 @@
+import os
+import shutil
+
+# Same serving setup as before: 4 uvicorn workers on port 8000
+bind = "0.0.0.0:8000"
+workers = int(os.environ.get("WEB_CONCURRENCY", 4))
+worker_class = "uvicorn.workers.UvicornWorker"
+
+# Workers write their Prometheus samples here so /metrics can merge them. Set before any worker
+# imports prometheus_client, the master does not import the app.
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", "/tmp/prometheus_multiproc")
+
+
+# Samples of a previous run would be merged into the new ones
+def on_starting(server):
+    directory = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+    shutil.rmtree(directory, ignore_errors=True)
+    os.makedirs(directory, exist_ok=True)
+
+# Drop the live gauges of a worker that exited, its counters and histograms are kept
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid)
@@ -1,39 +1,100 @@
 import pytest
+from contextlib import contextmanager
 from fastapi.testclient import TestClient
-from sqlmodel import Session, SQLModel, create_engine
-from sqlmodel.pool import StaticPool
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import NullPool
+from sqlmodel import Session, SQLModel, create_engine, select
+from sqlmodel.ext.asyncio.session import AsyncSession
 from datetime import timedelta
 
+from app.agents import user_agent_ids
 from app.config import settings
+from app.cache import redirect_lookup
+from app.clicks import click_queue
 from app.database import get_session
+from app.keys import RandomKeyStrategy
 from app.main import app
-from app.models import User, Site
-from app.auth import create_access_token
-from app.utils import get_hash_password
+from app.profiling import profile_engine
+from app.models import User, Site, Click, UserAgent, hash64
+from app.auth import create_access_token, principal_cache
+from app.utils import get_hash_password, get_browser_info
+
+# sqlite only enforces ON DELETE CASCADE with foreign keys switched on
+def enable_sqlite_foreign_keys(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA foreign_keys=ON")
+    cursor.close()
+
+# Backend of the async tests marked with pytest.mark.anyio
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+# Sepreate database file for testing, shared by the sync fixtures and the async app session
+@pytest.fixture(name="database_path")
+def database_path_fixture(tmp_path):
+    return tmp_path / "test.db"
+
+# Sync engine used by fixtures to seed and inspect the test database
+@pytest.fixture(name="engine")
+def engine_fixture(database_path):
+    engine = create_engine(f"sqlite:///{database_path}")
+    event.listen(engine, "connect", enable_sqlite_foreign_keys)
+    SQLModel.metadata.create_all(engine)
+    yield engine
+    engine.dispose()
+
+# Async engine used by the app under test, NullPool because every TestClient request runs in its own event loop
+@pytest.fixture(name="async_engine")
+def async_engine_fixture(engine, database_path):
+    async_engine = create_async_engine(f"sqlite+aiosqlite:///{database_path}", poolclass=NullPool)
+    event.listen(async_engine.sync_engine, "connect", enable_sqlite_foreign_keys)
+    return async_engine
 
 # Sepreate database session for testing api route
 @pytest.fixture(name="session")
-def session_fixture():
-    engine = create_engine(
-        "sqlite://",
-        connect_args={"check_same_thread": False},
-        poolclass=StaticPool,
-    )
-    SQLModel.metadata.create_all(engine)
+def session_fixture(engine):
     with Session(engine) as session:
         yield session
 
-# Override main session with our new test session and creating testclient instance
+# Override main session with a session on the test database and creating testclient instance
 @pytest.fixture(name="client")
-def get_client_fixture(session: Session):
-    def get_session_override():
-        return session
+def get_client_fixture(async_engine, session: Session):
+    async def get_session_override():
+        async with AsyncSession(async_engine, expire_on_commit=False) as async_session:
+            yield async_session
     
     app.dependency_overrides[get_session] = get_session_override
+    app.state.engine = async_engine
     
     client = TestClient(app)
     yield client
     app.dependency_overrides.clear()
+    del app.state.engine
+
+# Process wide caches and queues must not leak between tests, every test has its own database
+@pytest.fixture(autouse=True)
+def reset_app_state():
+    yield
+    redirect_lookup.clear()
+    click_queue.clear()
+    user_agent_ids.clear()
+    principal_cache.clear()
+
+# Fails the block when the app sends more than max_queries statements, or the same statement
+# repeat_threshold times (pass None where repeats are expected, e.g. chunked inserts)
+@pytest.fixture(name="query_budget")
+def query_budget_fixture(async_engine):
+    @contextmanager
+    def query_budget(max_queries: int, repeat_threshold: int | None = 2):
+        with profile_engine(async_engine.sync_engine) as profile:
+            yield profile
+        report = profile.report(repeat_threshold or max_queries + 1)
+        assert profile.count <= max_queries, f"{profile.count} statements over the budget of {max_queries}\n{report}"
+        if repeat_threshold is not None:
+            assert not profile.repeated(repeat_threshold), f"Repeated statements\n{report}"
+    return query_budget
 
 # Create Multiple Users
 def create_user_factory(session: Session, _username_: str, _email_: str, _password_: str):
@@ -90,3 +151,25 @@ def sample_urls_list_fixture(dummy_user1: User, session: Session):
         session.refresh(url)
 
     return urls
+
+# Create a raw click, interning its user agent like the click flusher does
+def create_click_factory(session: Session, url_key: str, user_agent: str, timestamp=None):
+    agent = session.exec(select(UserAgent).where(UserAgent.ua_hash == hash64(user_agent))).first()
+    if agent is None:
+        agent = UserAgent(ua_hash=hash64(user_agent), user_agent=user_agent, **get_browser_info(user_agent)._asdict())
+        session.add(agent)
+        session.commit()
+    click = Click(url_id=url_key, user_agent_id=agent.id)
+    if timestamp is not None:
+        click.timestamp = timestamp
+    session.add(click)
+    session.commit()
+    return click
+
+# Hands out the given keys in order, to force collisions
+class FixedKeyStrategy(RandomKeyStrategy):
+    def __init__(self, keys):
+        self.keys = iter(keys)
+
+    async def next_key(self, length, engine):
+        return next(self.keys)
@@ -0,0 +1,155 @@
+import asyncio
+import pytest
+from fastapi.testclient import TestClient
+from prometheus_client import REGISTRY
+from typing import List
+
+from app.bloom import BloomFilter, KeyFilter, make_key_filter
+from app.cache import LRUCache, MemoryBackend, TieredCache, redirect_lookup
+from app.config import settings
+from app.keys import key_allocator
+from app.metrics import sample_gauges
+from app.models import Site
+from tests.conftest import FixedKeyStrategy
+
+
+# Key filter built from the test database and used by the redirect route for the duration of a test
+@pytest.fixture(name="key_filter")
+def key_filter_fixture(async_engine, monkeypatch):
+    key_filter = KeyFilter(error_rate=0.001, min_capacity=1000)
+    monkeypatch.setattr(redirect_lookup, "key_filter", key_filter)
+    return key_filter
+
+
+def test_bloom_filter_has_no_false_negatives():
+    bloom = BloomFilter.for_capacity(10000, 0.01)
+    keys = [f"key{number}" for number in range(10000)]
+    bloom.update(keys)
+
+    assert all(key in bloom for key in keys)
+    false_positives = sum(f"other{number}" in bloom for number in range(10000))
+    assert false_positives < 200
+    assert bloom.error_rate() == pytest.approx(0.01, rel=0.2)
+
+def test_bloom_filter_size():
+    bloom = BloomFilter.for_capacity(100000, 0.001)
+
+    # about 1.8 bytes per key at 0.1%
+    assert 170000 < bloom.size_bytes < 190000
+    assert bloom.num_hashes == 10
+
+@pytest.mark.anyio
+async def test_key_filter_build(async_engine, sample_urls_list: List[Site]):
+    key_filter = KeyFilter(error_rate=0.001, min_capacity=1000)
+    assert key_filter.might_exist("anything")
+
+    await key_filter.build(async_engine)
+
+    assert key_filter.ready
+    assert all(key_filter.might_exist(site.url_key) for site in sample_urls_list)
+    assert not key_filter.might_exist("neverused")
+    assert key_filter.stats()["keys"] == 2
+    assert key_filter.stats()["rejected"] == 1
+
+@pytest.mark.anyio
+async def test_key_filter_keeps_keys_added_during_build(async_engine, sample_url: Site):
+    key_filter = KeyFilter(error_rate=0.001, min_capacity=1000)
+
+    build = asyncio.create_task(key_filter.build(async_engine))
+    await asyncio.sleep(0)
+    key_filter.add(["created"])
+    await build
+
+    assert key_filter.might_exist("created")
+    assert key_filter.might_exist(sample_url.url_key)
+
+@pytest.mark.anyio
+async def test_key_filter_reset_lets_keys_through_until_rebuilt(async_engine, sample_url: Site):
+    key_filter = KeyFilter(error_rate=0.001, min_capacity=1000)
+    await key_filter.build(async_engine)
+
+    key_filter.reset()
+
+    assert key_filter.might_exist("created")
+    await asyncio.wait_for(key_filter.wait_for_rebuild(3600), 1)
+
+@pytest.mark.anyio
+async def test_key_filter_drops_build_overlapped_by_reset(async_engine, sample_url: Site):
+    key_filter = KeyFilter(error_rate=0.001, min_capacity=1000)
+
+    build = asyncio.create_task(key_filter.build(async_engine))
+    await asyncio.sleep(0)
+    key_filter.reset()
+    await build
+
+    assert not key_filter.ready
+
+# Subscription that drops once, the announcements sent meanwhile are lost
+class FlakyBackend(MemoryBackend):
+    def __init__(self):
+        super().__init__()
+        self.subscriptions = 0
+
+    async def subscribe(self):
+        self.subscriptions += 1
+        if self.subscriptions == 1:
+            raise ConnectionError("down")
+        async for message in super().subscribe():
+            yield message
+
+@pytest.mark.anyio
+async def test_lost_subscription_resets_key_filter(async_engine, sample_url: Site):
+    key_filter = KeyFilter(error_rate=0.001, min_capacity=1000)
+    await key_filter.build(async_engine)
+    cache = TieredCache(
+        LRUCache(maxsize=10, ttl=60), LRUCache(maxsize=10, ttl=60), FlakyBackend(),
+        shared_ttl=60, negative_ttl=60, prefix="redirect:", key_filter=key_filter,
+    )
+
+    listener = asyncio.create_task(cache.listen(retry_interval=0))
+    await asyncio.sleep(0.01)
+    listener.cancel()
+
+    assert key_filter.stats()["resets"] == 1
+    assert key_filter.might_exist("created-elsewhere")
+
+def test_key_filter_refused_without_shared_cache(monkeypatch):
+    monkeypatch.setattr(settings, "bloom_enabled", True)
+    monkeypatch.setattr(settings, "cache_redis_url", None)
+
+    assert make_key_filter() is None
+
+    monkeypatch.setattr(settings, "cache_redis_url", "redis://localhost:6379/0")
+    assert isinstance(make_key_filter(), KeyFilter)
+
+
+def test_redirect_rejects_unknown_keys_without_query(client: TestClient, async_engine, sample_url: Site, key_filter, query_budget):
+    asyncio.run(key_filter.build(async_engine))
+    sample_gauges()
+    rejected = REGISTRY.get_sample_value("key_filter_lookups_total", {"result": "rejected"})
+
+    with query_budget(0):
+        response = client.get('/urls/nokey1/')
+    assert response.status_code == 404
+    assert client.get(f'/urls/{sample_url.url_key}/', follow_redirects=False).status_code == 307
+
+    sample_gauges()
+    assert REGISTRY.get_sample_value("key_filter_lookups_total", {"result": "rejected"}) == rejected + 1
+    assert REGISTRY.get_sample_value("key_filter_bytes") == key_filter.bloom.size_bytes
+
+def test_created_keys_pass_the_filter(authorized_client1: TestClient, async_engine, key_filter, monkeypatch):
+    asyncio.run(key_filter.build(async_engine))
+    monkeypatch.setattr(key_allocator, "strategy", FixedKeyStrategy(["fresh1"]))
+
+    authorized_client1.post('/urls/', json={"target_url": "https://www.google.com", "length": 6})
+    response = authorized_client1.get('/urls/fresh1/', follow_redirects=False)
+
+    assert response.status_code == 307
+
+def test_deleted_keys_are_counted(authorized_client1: TestClient, async_engine, sample_url: Site, key_filter):
+    asyncio.run(key_filter.build(async_engine))
+
+    authorized_client1.delete(f'/urls/{sample_url.url_key}/')
+
+    assert key_filter.stats()["deleted"] == 1
+    assert authorized_client1.get(f'/urls/{sample_url.url_key}/').status_code == 404
@@ -0,0 +1,135 @@
+import asyncio
+import json
+from fastapi.testclient import TestClient
+import pytest
+from sqlalchemy import event
+from sqlmodel import Session, func, select
+
+from app.bulk import BulkRequestError, read_bulk_items
+from app.config import settings
+from app.keys import key_allocator
+from app.models import Site
+from tests.conftest import FixedKeyStrategy
+
+
+def test_bulk_create(authorized_client1: TestClient, session: Session, sample_url: Site):
+    response = authorized_client1.post('/urls/bulk/', json=[
+        {"target_url": "https://example.com/a"},
+        {"target_url": sample_url.target_url},
+        {"target_url": "https://example.com/b", "length": 8},
+        {"target_url": "https://example.com/a"},
+        {"length": 6},
+    ])
+
+    results = response.json()
+
+    assert response.status_code == 200
+    assert [result["index"] for result in results] == [0, 1, 2, 3, 4]
+    assert [result["status"] for result in results] == ["created", "exists", "created", "exists", "invalid"]
+    assert results[1]["url_key"] == sample_url.url_key
+    assert results[3]["url_key"] == results[0]["url_key"]
+    assert len(results[2]["url_key"]) == 8
+    assert session.exec(select(func.count()).select_from(Site)).one() == 3
+
+def test_bulk_create_ndjson(authorized_client1: TestClient):
+    body = "\n".join([json.dumps({"target_url": "https://example.com/a"}), "not json", "", json.dumps({"target_url": "https://example.com/b"})])
+
+    response = authorized_client1.post(
+        '/urls/bulk/',
+        content=body,
+        headers={"Content-Type": "application/x-ndjson", "Accept": "application/x-ndjson"},
+    )
+
+    results = [json.loads(line) for line in response.text.splitlines()]
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    assert [result["status"] for result in results] == ["created", "invalid", "created"]
+
+def test_bulk_create_streams_large_batches(authorized_client1: TestClient, session: Session, monkeypatch):
+    monkeypatch.setattr(settings, "bulk_stream_threshold", 3)
+    monkeypatch.setattr(settings, "bulk_chunk_size", 2)
+
+    response = authorized_client1.post('/urls/bulk/', json=[{"target_url": f"https://example.com/{i}"} for i in range(5)])
+
+    results = response.json()
+
+    assert response.status_code == 200
+    assert [result["status"] for result in results] == ["created"] * 5
+    assert len({result["url_key"] for result in results}) == 5
+    assert session.exec(select(func.count()).select_from(Site)).one() == 5
+
+def test_bulk_create_releases_the_request_session(authorized_client1: TestClient, async_engine, monkeypatch):
+    monkeypatch.setattr(settings, "bulk_chunk_size", 2)
+    open_connections, most_open = 0, 0
+
+    def checkout(*args):
+        nonlocal open_connections, most_open
+        open_connections += 1
+        most_open = max(most_open, open_connections)
+
+    def checkin(*args):
+        nonlocal open_connections
+        open_connections -= 1
+
+    event.listen(async_engine.sync_engine, "checkout", checkout)
+    event.listen(async_engine.sync_engine, "checkin", checkin)
+    response = authorized_client1.post('/urls/bulk/', json=[{"target_url": f"https://example.com/{n}"} for n in range(5)])
+
+    assert response.status_code == 200
+    assert most_open == 1
+
+def test_bulk_create_retries_key_collisions(authorized_client1: TestClient, sample_url: Site, monkeypatch):
+    monkeypatch.setattr(key_allocator, "strategy", FixedKeyStrategy(["fresh1", sample_url.url_key, "fresh2"]))
+
+    response = authorized_client1.post('/urls/bulk/', json=[{"target_url": "https://example.com/a"}, {"target_url": "https://example.com/b"}])
+
+    assert [result["url_key"] for result in response.json()] == ["fresh1", "fresh2"]
+
+def test_bulk_create_too_many_items(authorized_client1: TestClient, monkeypatch):
+    monkeypatch.setattr(settings, "bulk_max_items", 2)
+
+    response = authorized_client1.post('/urls/bulk/', json=[{"target_url": f"https://example.com/{i}"} for i in range(3)])
+
+    assert response.status_code == 413
+
+def test_bulk_create_body_too_large(authorized_client1: TestClient, monkeypatch):
+    monkeypatch.setattr(settings, "bulk_max_body_bytes", 100)
+
+    response = authorized_client1.post('/urls/bulk/', json=[{"target_url": f"https://example.com/{i}"} for i in range(5)])
+
+    assert response.status_code == 413
+
+def test_bulk_create_ndjson_stops_reading_at_item_limit():
+    consumed = []
+
+    async def chunks():
+        for i in range(100):
+            consumed.append(i)
+            yield f'{{"target_url": "https://example.com/{i}"}}\n'.encode()
+
+    with pytest.raises(BulkRequestError) as exc:
+        asyncio.run(read_bulk_items(chunks(), "application/x-ndjson", None, 3, 10000))
+
+    assert exc.value.status_code == 413
+    assert len(consumed) == 4
+
+def test_bulk_create_ndjson_lines_split_across_chunks():
+    async def chunks():
+        yield b'{"target_url": "https://exa'
+        yield b'mple.com/a"}\n\n{"target_url": "https://example.com/b"}\r\nnot json'
+
+    items = asyncio.run(read_bulk_items(chunks(), "application/x-ndjson", None, 10, 10000))
+
+    assert [item.site.target_url if item.site else item.error for item in items][:2] == ["https://example.com/a", "https://example.com/b"]
+    assert items[2].site is None and items[2].index == 2
+
+def test_bulk_create_not_a_list(authorized_client1: TestClient):
+    response = authorized_client1.post('/urls/bulk/', json={"target_url": "https://example.com"})
+
+    assert response.status_code == 422
+
+def test_bulk_create_unauthorized(client: TestClient):
+    response = client.post('/urls/bulk/', json=[{"target_url": "https://example.com"}])
+
+    assert response.status_code == 401
@@ -0,0 +1,260 @@
+import asyncio
+import pytest
+
+from app.cache import CacheBackend, LRUCache, MemoryBackend, RedisBackend, TieredCache
+
+
+def test_cache_get_set():
+    cache = LRUCache(maxsize=2, ttl=60)
+    cache.set("abc", "https://www.google.com")
+
+    assert cache.get("abc") == "https://www.google.com"
+    assert cache.get("xyz") is None
+    assert cache.hits == 1
+    assert cache.misses == 1
+
+def test_cache_evicts_least_recently_used():
+    cache = LRUCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.evictions == 1
+
+def test_cache_expires_entries():
+    cache = LRUCache(maxsize=2, ttl=0)
+    cache.set("a", 1)
+
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+def test_cache_invalidate():
+    cache = LRUCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.invalidate("a")
+
+    assert cache.get("a") is None
+
+
+# ----------------------------------  Tiered redirect cache tests ---------------------------
+
+def tiered_cache(backend=None) -> TieredCache:
+    return TieredCache(
+        LRUCache(maxsize=10, ttl=60), LRUCache(maxsize=10, ttl=60), backend,
+        shared_ttl=60, negative_ttl=60, prefix="redirect:",
+    )
+
+# Loader counting its calls, pausing until released so concurrent lookups overlap
+class Loader:
+    def __init__(self, value):
+        self.value = value
+        self.calls = 0
+        self.release = asyncio.Event()
+
+    async def __call__(self):
+        self.calls += 1
+        await self.release.wait()
+        return self.value
+
+class BrokenBackend(CacheBackend):
+    async def get(self, key):
+        raise ConnectionError("down")
+
+    async def set(self, key, value, ttl):
+        raise ConnectionError("down")
+
+@pytest.mark.anyio
+async def test_tiered_cache_coalesces_concurrent_misses():
+    cache = tiered_cache()
+    loader = Loader("https://example.com")
+
+    lookups = [asyncio.create_task(cache.get_or_load("abc", loader)) for _ in range(10)]
+    await asyncio.sleep(0)
+    loader.release.set()
+
+    assert await asyncio.gather(*lookups) == ["https://example.com"] * 10
+    assert loader.calls == 1
+    assert cache.stats()["coalesced"] == 9
+    assert await cache.get_or_load("abc", loader) == "https://example.com"
+    assert loader.calls == 1
+
+@pytest.mark.anyio
+async def test_tiered_cache_shares_loader_errors():
+    cache = tiered_cache()
+
+    async def failing_loader():
+        await asyncio.sleep(0)
+        raise RuntimeError("database down")
+
+    results = await asyncio.gather(*(cache.get_or_load("abc", failing_loader) for _ in range(3)), return_exceptions=True)
+
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert cache._loading == {}
+
+@pytest.mark.anyio
+async def test_tiered_cache_survives_cancelled_loader():
+    cache = tiered_cache()
+    slow = Loader("https://old.example.com")
+    first = asyncio.create_task(cache.get_or_load("abc", slow))
+    await asyncio.sleep(0)
+
+    loader = Loader("https://example.com")
+    waiters = [asyncio.create_task(cache.get_or_load("abc", loader)) for _ in range(2)]
+    await asyncio.sleep(0)
+    first.cancel()
+    await asyncio.sleep(0)
+    loader.release.set()
+
+    assert await asyncio.gather(*waiters, return_exceptions=True) == ["https://example.com"] * 2
+    assert loader.calls == 1
+    assert cache._loading == {}
+
+@pytest.mark.anyio
+async def test_tiered_cache_does_not_cache_loads_overlapping_invalidation():
+    backend = MemoryBackend()
+    cache = tiered_cache(backend)
+    loader = Loader("https://example.com")
+
+    lookup = asyncio.create_task(cache.get_or_load("abc", loader))
+    await asyncio.sleep(0)
+    await cache.invalidate(["abc"])
+    loader.release.set()
+
+    assert await lookup == "https://example.com"
+    assert cache.local.get("abc") is None
+    assert await backend.get("redirect:abc") is None
+    await cache.stop()
+
+@pytest.mark.anyio
+async def test_tiered_cache_repeats_invalidation_after_delay():
+    backend = MemoryBackend()
+    worker1, worker2 = tiered_cache(backend), tiered_cache(backend)
+    worker1.invalidation_delay = 0.01
+    loader = Loader("https://example.com")
+
+    # worker2 read the link just before worker1 deleted it, and writes it to the shared tier afterwards
+    lookup = asyncio.create_task(worker2.get_or_load("abc", loader))
+    await asyncio.sleep(0)
+    await worker1.invalidate(["abc"])
+    loader.release.set()
+    await lookup
+
+    assert await backend.get("redirect:abc") == "https://example.com"
+    await asyncio.sleep(0.05)
+    assert await backend.get("redirect:abc") is None
+    await worker1.stop()
+
+@pytest.mark.anyio
+async def test_tiered_cache_remembers_missing_keys():
+    cache = tiered_cache()
+    loader = Loader(None)
+    loader.release.set()
+
+    assert await cache.get_or_load("nope", loader) is None
+    assert await cache.get_or_load("nope", loader) is None
+    assert loader.calls == 1
+
+    await cache.invalidate(["nope"])
+    assert await cache.get_or_load("nope", loader) is None
+    assert loader.calls == 2
+
+@pytest.mark.anyio
+async def test_tiered_cache_shared_tier_between_workers():
+    backend = MemoryBackend()
+    worker1, worker2 = tiered_cache(backend), tiered_cache(backend)
+    loader = Loader("https://example.com")
+    loader.release.set()
+
+    assert await worker1.get_or_load("abc", loader) == "https://example.com"
+    assert await worker2.get_or_load("abc", loader) == "https://example.com"
+    assert loader.calls == 1
+    assert worker2.stats()["shared_hits"] == 1
+
+    # misses are shared as well
+    missing = Loader(None)
+    missing.release.set()
+    assert await worker1.get_or_load("nope", missing) is None
+    assert await worker2.get_or_load("nope", missing) is None
+    assert missing.calls == 1
+
+@pytest.mark.anyio
+async def test_tiered_cache_invalidation_reaches_every_worker():
+    backend = MemoryBackend()
+    worker1, worker2 = tiered_cache(backend), tiered_cache(backend)
+    worker1.start()
+    worker2.start()
+    await asyncio.sleep(0)
+    loader = Loader("https://example.com")
+    loader.release.set()
+    await worker1.get_or_load("abc", loader)
+    await worker2.get_or_load("abc", loader)
+
+    await worker1.invalidate(["abc"])
+    await asyncio.sleep(0)
+
+    assert worker1.local.get("abc") is None
+    assert worker2.local.get("abc") is None
+    assert await backend.get("redirect:abc") is None
+    await worker1.stop()
+    await worker2.stop()
+
+@pytest.mark.anyio
+async def test_tiered_cache_invalidates_linked_caches():
+    backend = MemoryBackend()
+    worker1, worker2 = tiered_cache(backend), tiered_cache(backend)
+    principals1, principals2 = LRUCache(maxsize=10, ttl=60), LRUCache(maxsize=10, ttl=60)
+    worker1.link("principal", principals1)
+    worker2.link("principal", principals2)
+    worker2.start()
+    await asyncio.sleep(0)
+    principals1.set("alice smith", 1)
+    principals2.set("alice smith", 1)
+    worker2.local.set("alice", "https://example.com")
+
+    await worker1.invalidate_linked("principal", "alice smith")
+    await asyncio.sleep(0)
+
+    assert principals1.get("alice smith") is None
+    assert principals2.get("alice smith") is None
+    assert worker2.local.get("alice") == "https://example.com"
+    await worker1.stop()
+    await worker2.stop()
+
+@pytest.mark.anyio
+async def test_tiered_cache_falls_back_when_backend_fails():
+    cache = tiered_cache(BrokenBackend())
+    loader = Loader("https://example.com")
+    loader.release.set()
+
+    assert await cache.get_or_load("abc", loader) == "https://example.com"
+    assert loader.calls == 1
+    assert cache.stats()["shared_errors"] == 2
+
+@pytest.mark.anyio
+async def test_redis_backend():
+    fakeredis = pytest.importorskip("fakeredis")
+    client = fakeredis.FakeAsyncRedis(decode_responses=True)
+    backend = RedisBackend(client, "invalidations")
+    worker1, worker2 = tiered_cache(backend), tiered_cache(backend)
+    loader = Loader("https://example.com")
+    loader.release.set()
+
+    await worker1.get_or_load("abc", loader)
+    assert await client.get("redirect:abc") == "https://example.com"
+    assert 0 < await client.pttl("redirect:abc") <= 60000
+    assert await worker2.get_or_load("abc", loader) == "https://example.com"
+    assert loader.calls == 1
+
+    messages = backend.subscribe()
+    receiving = asyncio.create_task(anext(messages))
+    await asyncio.sleep(0.05)
+    await worker1.invalidate(["abc", "def"])
+
+    assert await asyncio.wait_for(receiving, 1) == "abc def"
+    assert await client.get("redirect:abc") is None
+    await messages.aclose()
+    await backend.close()
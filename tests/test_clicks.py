@@ -0,0 +1,120 @@
+import pytest
+from sqlmodel import Session, select
+
+from app import clicks
+from app.agents import user_agent_ids
+from app.clicks import ClickQueue
+from app.models import Click, Site, UserAgent
+
+
+@pytest.mark.anyio
+async def test_click_queue_drops_on_overflow():
+    queue = ClickQueue(maxsize=1, batch_size=10, flush_interval=0.1, overflow="drop")
+
+    assert await queue.put("9dke7e", "pytest") is True
+    assert await queue.put("9dke7e", "pytest") is False
+    assert queue.dropped == 1
+    assert queue.depth() == 1
+
+@pytest.mark.anyio
+async def test_click_queue_blocks_until_timeout():
+    queue = ClickQueue(maxsize=1, batch_size=10, flush_interval=0.1, overflow="block", block_timeout=0.01)
+    await queue.put("9dke7e", "pytest")
+
+    assert await queue.put("9dke7e", "pytest") is False
+    assert queue.dropped == 1
+
+@pytest.mark.anyio
+async def test_click_queue_writes_in_batches(async_engine, session: Session, sample_url: Site):
+    queue = ClickQueue(maxsize=100, batch_size=2, flush_interval=0.1)
+    for _ in range(5):
+        await queue.put(sample_url.url_key, "pytest")
+
+    await queue.flush(async_engine)
+
+    assert queue.written == 5
+    assert len(session.exec(select(Click)).all()) == 5
+
+# apply_click_rollups failing the first `failures` writes, as a database outage would
+def fail_writes(monkeypatch, failures: int):
+    apply_click_rollups = clicks.apply_click_rollups
+    calls = []
+
+    async def flaky(conn, rows):
+        calls.append(sorted(row["url_id"] for row in rows))
+        if len(calls) <= failures:
+            raise ConnectionError("database unavailable")
+        await apply_click_rollups(conn, rows)
+
+    monkeypatch.setattr(clicks, "apply_click_rollups", flaky)
+    return calls
+
+@pytest.mark.anyio
+async def test_click_queue_retries_failed_writes(async_engine, session: Session, sample_url: Site, monkeypatch):
+    calls = fail_writes(monkeypatch, failures=2)
+    queue = ClickQueue(maxsize=100, batch_size=10, flush_interval=0.1, retry_delay=0.001)
+    await queue.put(sample_url.url_key, "pytest")
+    await queue.put(sample_url.url_key, "pytest")
+
+    await queue.flush(async_engine)
+
+    assert len(calls) == 3
+    assert (queue.written, queue.dropped, queue.failed) == (2, 0, 0)
+    assert len(session.exec(select(Click)).all()) == 2
+
+@pytest.mark.anyio
+async def test_click_queue_discards_clicks_of_deleted_links(async_engine, session: Session, sample_url: Site):
+    queue = ClickQueue(maxsize=100, batch_size=10, flush_interval=0.1, retry_delay=0.001)
+    await queue.put(sample_url.url_key, "pytest")
+    await queue.put("deleted", "pytest")
+
+    # the foreign key fails the first attempt, the retry leaves the click of the deleted link out
+    await queue.flush(async_engine)
+
+    assert (queue.written, queue.discarded, queue.failed) == (1, 1, 0)
+    assert [click.url_id for click in session.exec(select(Click)).all()] == [sample_url.url_key]
+
+@pytest.mark.anyio
+async def test_click_queue_gives_up_after_attempts(async_engine, session: Session, sample_url: Site, monkeypatch):
+    fail_writes(monkeypatch, failures=10)
+    queue = ClickQueue(maxsize=100, batch_size=10, flush_interval=0.1, write_attempts=3, retry_delay=0.001)
+    await queue.put(sample_url.url_key, "pytest")
+
+    await queue.flush(async_engine)
+
+    assert (queue.written, queue.dropped, queue.failed) == (0, 0, 1)
+    assert session.exec(select(Click)).all() == []
+
+@pytest.mark.anyio
+async def test_click_queue_drains_on_stop(async_engine, session: Session, sample_url: Site):
+    queue = ClickQueue(maxsize=100, batch_size=50, flush_interval=60)
+    queue.start(async_engine)
+    for _ in range(3):
+        await queue.put(sample_url.url_key, "pytest")
+    await queue.stop()
+
+    assert queue.depth() == 0
+    assert len(session.exec(select(Click)).all()) == 3
+
+@pytest.mark.anyio
+async def test_click_queue_parses_user_agent(async_engine, session: Session, sample_url: Site):
+    queue = ClickQueue(maxsize=100, batch_size=10, flush_interval=0.1)
+    await queue.put(sample_url.url_key, "Mozilla/5.0 (X11; Linux x86_64; rv:120.0) Gecko/20100101 Firefox/120.0")
+    await queue.flush(async_engine)
+
+    click = session.exec(select(Click)).one()
+
+    assert (click.agent.browser, click.agent.os, click.agent.device) == ("Firefox", "Linux", "Other")
+
+@pytest.mark.anyio
+async def test_click_queue_interns_user_agents(async_engine, session: Session, sample_url: Site):
+    queue = ClickQueue(maxsize=100, batch_size=2, flush_interval=0.1)
+    for user_agent in ("pytest", "pytest", "curl/8.0.1", "pytest"):
+        await queue.put(sample_url.url_key, user_agent)
+    await queue.flush(async_engine)
+
+    agents = session.exec(select(UserAgent).order_by(UserAgent.user_agent)).all()
+
+    assert [agent.user_agent for agent in agents] == ["curl/8.0.1", "pytest"]
+    assert len(session.exec(select(Click)).all()) == 4
+    assert user_agent_ids.get("pytest") == agents[1].id
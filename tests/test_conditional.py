@@ -0,0 +1,43 @@
+from datetime import datetime
+
+from starlette.requests import Request
+
+from app.conditional import http_date, is_not_modified, make_etag, validator_headers
+
+
+def make_request(**headers) -> Request:
+    return Request({"type": "http", "headers": [(name.replace("_", "-").encode(), value.encode()) for name, value in headers.items()]})
+
+
+def test_make_etag_is_weak_and_stable():
+    etag = make_etag("info", 1, datetime(2025, 4, 20))
+
+    assert etag.startswith('W/"')
+    assert etag == make_etag("info", 1, datetime(2025, 4, 20))
+    assert etag != make_etag("info", 2, datetime(2025, 4, 20))
+
+def test_if_none_match_uses_weak_comparison():
+    etag = make_etag("x")
+
+    assert is_not_modified(make_request(if_none_match=etag), etag)
+    assert is_not_modified(make_request(if_none_match=etag.removeprefix("W/")), etag)
+    assert is_not_modified(make_request(if_none_match=f'"a", {etag}'), etag)
+    assert is_not_modified(make_request(if_none_match="*"), etag)
+    assert not is_not_modified(make_request(if_none_match='"a"'), etag)
+    assert not is_not_modified(make_request(), etag)
+
+def test_if_modified_since():
+    updated_at = datetime(2025, 4, 20, 10, 30, 15, 500000)
+    since = http_date(updated_at)
+
+    assert since == "Sun, 20 Apr 2025 10:30:15 GMT"
+    assert is_not_modified(make_request(if_modified_since=since), "etag", updated_at)
+    assert not is_not_modified(make_request(if_modified_since=http_date(datetime(2025, 4, 20, 10))), "etag", updated_at)
+    assert not is_not_modified(make_request(if_modified_since="yesterday"), "etag", updated_at)
+    # If-None-Match wins over If-Modified-Since
+    assert not is_not_modified(make_request(if_none_match='"a"', if_modified_since=since), "etag", updated_at)
+
+def test_validator_headers():
+    headers = validator_headers("etag", datetime(2025, 4, 20))
+
+    assert headers == {"ETag": "etag", "Cache-Control": "private, no-cache", "Last-Modified": "Sun, 20 Apr 2025 00:00:00 GMT"}
@@ -0,0 +1,101 @@
+import csv
+import gzip
+import io
+import json
+import pytest
+from datetime import datetime
+from fastapi.testclient import TestClient
+from sqlmodel import Session
+
+from app.models import Site
+from app.pagination import InvalidCursor, decode_cursor, encode_cursor
+from tests.conftest import create_click_factory
+
+
+def ndjson(response):
+    return [json.loads(line) for line in response.text.splitlines()]
+
+
+def test_export_sites_ndjson(authorized_client1: TestClient, sample_urls_list: list[Site]):
+    response = authorized_client1.get('/urls/export/', headers={"Accept-Encoding": "identity"})
+
+    rows = ndjson(response)
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    assert "content-encoding" not in response.headers
+    assert [row["url_key"] for row in rows] == [site.url_key for site in sorted(sample_urls_list, key=lambda site: (site.created_at, site.url_key))]
+    assert set(rows[0]) == {"url_key", "target_url", "created_at", "total_clicks", "cursor"}
+
+def test_export_sites_resume_from_cursor(authorized_client1: TestClient, sample_urls_list: list[Site]):
+    first = ndjson(authorized_client1.get('/urls/export/'))[0]
+
+    rows = ndjson(authorized_client1.get('/urls/export/', params={"cursor": first["cursor"]}))
+
+    assert len(rows) == len(sample_urls_list) - 1
+    assert first["url_key"] not in [row["url_key"] for row in rows]
+
+def test_export_sites_time_range(authorized_client1: TestClient, session: Session, sample_urls_list: list[Site]):
+    sample_urls_list[0].created_at = datetime(2025, 1, 10)
+    sample_urls_list[1].created_at = datetime(2025, 3, 10)
+    session.add_all(sample_urls_list)
+    session.commit()
+
+    rows = ndjson(authorized_client1.get('/urls/export/', params={"since": "2025-02-01T00:00:00Z", "until": "2025-04-01"}))
+
+    assert [row["url_key"] for row in rows] == [sample_urls_list[1].url_key]
+
+def test_export_sites_csv_gzip(authorized_client1: TestClient, sample_urls_list: list[Site]):
+    # TestClient (httpx) decodes gzip on its own, read the raw stream to check the encoding
+    with authorized_client1.stream('GET', '/urls/export/', params={"format": "csv"}, headers={"Accept-Encoding": "gzip"}) as response:
+        body = b"".join(response.iter_raw())
+
+    rows = list(csv.DictReader(io.StringIO(gzip.decompress(body).decode("utf-8"))))
+
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.headers["content-type"].startswith("text/csv")
+    assert len(rows) == len(sample_urls_list)
+    assert rows[0]["cursor"]
+
+def test_cursor_round_trip():
+    created_at = datetime(2025, 1, 10, 8, 30)
+
+    assert decode_cursor(encode_cursor(created_at, "9dke7e"), datetime, str) == (created_at, "9dke7e")
+    with pytest.raises(InvalidCursor):
+        decode_cursor(encode_cursor("9dke7e"), datetime, str)
+
+def test_export_sites_invalid_cursor(authorized_client1: TestClient):
+    response = authorized_client1.get('/urls/export/', params={"cursor": "not-a-cursor"})
+
+    assert response.status_code == 400
+
+def test_export_sites_unauthorized(client: TestClient):
+    response = client.get('/urls/export/')
+
+    assert response.status_code == 401
+
+def test_export_clicks(authorized_client1: TestClient, session: Session, sample_urls_list: list[Site]):
+    for site in sample_urls_list:
+        create_click_factory(session, site.url_key, "pytest", timestamp=datetime(2025, 1, 1))
+        create_click_factory(session, site.url_key, "Mozilla/5.0 (X11; Linux x86_64; rv:120.0) Gecko/20100101 Firefox/120.0", timestamp=datetime(2025, 2, 1))
+
+    rows = ndjson(authorized_client1.get('/urls/export/clicks/'))
+    keys = sorted(site.url_key for site in sample_urls_list)
+
+    assert [row["url_key"] for row in rows] == [keys[0], keys[0], keys[1], keys[1]]
+    assert rows[1]["browser"] == "Firefox"
+
+    resumed = ndjson(authorized_client1.get('/urls/export/clicks/', params={"cursor": rows[1]["cursor"]}))
+    assert [row["id"] for row in resumed] == [row["id"] for row in rows[2:]]
+
+    one_link = ndjson(authorized_client1.get('/urls/export/clicks/', params={"url_key": keys[1], "since": "2025-01-15"}))
+    assert [(row["url_key"], row["browser"]) for row in one_link] == [(keys[1], "Firefox")]
+
+def test_export_clicks_csv(authorized_client1: TestClient, session: Session, sample_url: Site):
+    create_click_factory(session, sample_url.url_key, "pytest")
+
+    response = authorized_client1.get('/urls/export/clicks/', params={"format": "csv"})
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+
+    assert [row["url_key"] for row in rows] == [sample_url.url_key]
+    assert rows[0]["cursor"] == encode_cursor(sample_url.url_key, int(rows[0]["id"]))
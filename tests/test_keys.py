@@ -0,0 +1,90 @@
+import pytest
+from fastapi.testclient import TestClient
+from sqlmodel import Session, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.keys import (
+    ALPHABET, CounterKeyStrategy, KeyAllocator, KeyspaceExhausted, RandomKeyStrategy, base62_encode, key_allocator, scramble,
+)
+from app.models import KeyCounter, Site
+from tests.conftest import FixedKeyStrategy
+
+
+def test_base62_encode():
+    assert base62_encode(0, 3) == "000"
+    assert base62_encode(61, 2) == "0Z"
+    assert base62_encode(62, 2) == "10"
+    assert len(set(ALPHABET)) == 62
+
+def test_scramble_is_a_bijection():
+    size = len(ALPHABET) ** 2
+    assert sorted(scramble(number, 2, offset=12345) for number in range(size)) == list(range(size))
+
+@pytest.mark.anyio
+async def test_random_keys_use_the_alphabet():
+    strategy = RandomKeyStrategy()
+    keys = {await strategy.next_key(8, None) for _ in range(20)}
+    assert all(len(k) == 8 and set(k) <= set(ALPHABET) for k in keys)
+    assert len(keys) == 20
+
+@pytest.mark.anyio
+async def test_counter_reserves_blocks(async_engine, session: Session):
+    strategy = CounterKeyStrategy(block_size=3)
+    keys = [await strategy.next_key(6, async_engine) for _ in range(7)]
+
+    assert len(set(keys)) == 7
+    assert strategy.blocks_reserved == 3
+    assert session.get(KeyCounter, 6).next_value == 9
+
+    # a second process continues after the blocks already handed out
+    other = CounterKeyStrategy(block_size=3)
+    assert await other.next_key(6, async_engine) not in keys
+    session.expire_all()
+    assert session.get(KeyCounter, 6).next_value == 12
+
+@pytest.mark.anyio
+async def test_counter_keyspace_exhausted(async_engine):
+    strategy = CounterKeyStrategy(block_size=50, scramble_keys=False)
+    keys = [await strategy.next_key(1, async_engine) for _ in range(62)]
+
+    assert sorted(keys) == sorted(ALPHABET)
+    with pytest.raises(KeyspaceExhausted):
+        await strategy.next_key(1, async_engine)
+
+def test_create_url_retries_on_key_collision(authorized_client1: TestClient, sample_url: Site, session: Session, monkeypatch):
+    monkeypatch.setattr(key_allocator, "strategy", FixedKeyStrategy([sample_url.url_key, "fresh1"]))
+    collisions = key_allocator.collisions
+
+    response = authorized_client1.post('/urls/', json={"target_url": "https://example.com", "length": 6})
+
+    assert response.status_code == 201
+    assert response.json()["url_key"] == "fresh1"
+    assert key_allocator.collisions == collisions + 1
+    assert session.get(Site, "fresh1").target_url_hash is not None
+
+def test_create_url_with_counter_keys(authorized_client1: TestClient, session: Session, monkeypatch):
+    monkeypatch.setattr(key_allocator, "strategy", CounterKeyStrategy(block_size=10))
+
+    keys = [
+        authorized_client1.post('/urls/', json={"target_url": f"https://example.com/{i}", "length": 5}).json()["url_key"]
+        for i in range(3)
+    ]
+
+    assert len(set(keys)) == 3
+    assert all(len(key) == 5 for key in keys)
+    assert session.exec(select(KeyCounter.next_value)).all() == [10]
+
+def test_create_url_length_bounds(authorized_client1: TestClient):
+    response = authorized_client1.post('/urls/', json={"target_url": "https://example.com", "length": 0})
+
+    assert response.status_code == 422
+
+@pytest.mark.anyio
+async def test_keyspace_stats(async_engine, sample_urls_list):
+    async with AsyncSession(async_engine) as session:
+        stats = await KeyAllocator(RandomKeyStrategy()).keyspace_stats(session)
+
+    lengths = {len(site.url_key) for site in sample_urls_list}
+    assert set(stats) == lengths
+    assert sum(fill["used"] for fill in stats.values()) == len(sample_urls_list)
+    assert all(fill["capacity"] == 62 ** length for length, fill in stats.items())
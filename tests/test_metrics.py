@@ -0,0 +1,102 @@
+import fcntl
+import os
+import subprocess
+import sys
+import pytest
+from fastapi.testclient import TestClient
+from prometheus_client import REGISTRY
+
+from app import metrics
+from app.metrics import KEYS_ALLOCATED, count, holds_keyspace_lock, sample_keyspace
+from app.models import Site
+
+
+def sample(name: str, **labels) -> float:
+    return REGISTRY.get_sample_value(name, labels) or 0.0
+
+
+def test_request_latency_by_route(client: TestClient, sample_url: Site):
+    labels = {"method": "GET", "route": "/urls/{url_key}/", "status": "307"}
+    before = sample("http_request_duration_seconds_count", **labels)
+
+    client.get(f'/urls/{sample_url.url_key}/', follow_redirects=False)
+    client.get(f'/urls/{sample_url.url_key}/', follow_redirects=False)
+
+    assert sample("http_request_duration_seconds_count", **labels) == before + 2
+    assert sample("http_requests_in_progress") == 0
+
+def test_unmatched_routes_share_a_label(client: TestClient):
+    before = sample("http_request_duration_seconds_count", method="GET", route="<unmatched>", status="404")
+
+    client.get('/no/such/path/at/all')
+
+    assert sample("http_request_duration_seconds_count", method="GET", route="<unmatched>", status="404") == before + 1
+
+def test_sql_queries_per_request(authorized_client1: TestClient, sample_url: Site):
+    route = "/urls/info/{url_key}/"
+    count_before = sample("http_request_db_queries_count", route=route)
+    sum_before = sample("http_request_db_queries_sum", route=route)
+
+    authorized_client1.get(f'/urls/info/{sample_url.url_key}/')
+
+    assert sample("http_request_db_queries_count", route=route) == count_before + 1
+    # user lookup, site, four breakdowns and the clicks page
+    assert sample("http_request_db_queries_sum", route=route) - sum_before >= 7
+    assert sample("http_request_db_seconds_sum", route=route) > 0
+
+def test_metrics_endpoint(client: TestClient, sample_url: Site):
+    client.get(f'/urls/{sample_url.url_key}/', follow_redirects=False)
+
+    response = client.get('/metrics')
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert 'http_request_duration_seconds_bucket{le="0.005",method="GET",route="/urls/{url_key}/",status="307"}' in response.text
+    assert 'cache_entries{cache="redirect"} 1.0' in response.text
+    assert "click_queue_depth 1.0" in response.text
+
+def test_sampled_counts_only_increase():
+    child = KEYS_ALLOCATED.labels("test")
+    before = sample("short_keys_allocated_total", result="test")
+
+    count(child, 5)
+    count(child, 7)
+    count(child, 2)
+
+    assert sample("short_keys_allocated_total", result="test") == before + 9
+
+@pytest.mark.anyio
+async def test_keyspace_fill(async_engine, sample_url: Site):
+    await sample_keyspace(async_engine)
+
+    assert sample("short_keyspace_fill", length=str(len(sample_url.url_key))) == 1 / 62 ** len(sample_url.url_key)
+
+def test_keyspace_sampled_by_one_worker(tmp_path, monkeypatch):
+    monkeypatch.setattr(metrics, "MULTIPROCESS", True)
+    monkeypatch.setattr(metrics, "_keyspace_lock", None)
+    monkeypatch.setenv("PROMETHEUS_MULTIPROC_DIR", str(tmp_path))
+
+    # another worker holds the lock
+    with open(tmp_path / "keyspace.lock", "a") as other:
+        fcntl.flock(other, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        assert not holds_keyspace_lock()
+    # and exited
+    assert holds_keyspace_lock()
+    assert holds_keyspace_lock()
+    metrics._keyspace_lock.close()
+
+def test_metrics_multiprocess_mode(tmp_path):
+    env = {**os.environ, "PROMETHEUS_MULTIPROC_DIR": str(tmp_path), "DATABASE_URL": f"sqlite:///{tmp_path / 'test.db'}"}
+    script = (
+        "from fastapi.testclient import TestClient\n"
+        "from app.main import app\n"
+        "client = TestClient(app)\n"
+        "client.get('/')\n"
+        "print(client.get('/metrics').text)\n"
+    )
+
+    result = subprocess.run([sys.executable, "-c", script], env=env, capture_output=True, text=True, timeout=60)
+
+    assert result.returncode == 0, result.stderr
+    assert 'http_request_duration_seconds_count{method="GET",route="/",status="200"} 1.0' in result.stdout
+    assert any(path.name.startswith("histogram_") for path in tmp_path.iterdir())
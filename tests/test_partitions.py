@@ -0,0 +1,20 @@
+from datetime import datetime
+
+from app.partitions import add_months, month_start, partition_month, partition_name, retention_cutoff
+
+
+def test_partition_months():
+    month = month_start(datetime(2025, 11, 18, 13, 5))
+
+    assert month == datetime(2025, 11, 1)
+    assert add_months(month, 2) == datetime(2026, 1, 1)
+    assert add_months(month, -11) == datetime(2024, 12, 1)
+
+def test_partition_names():
+    assert partition_name(datetime(2025, 4, 1)) == "click_2025_04"
+    assert partition_month("click_2025_04") == datetime(2025, 4, 1)
+    assert partition_month("click_default") is None
+
+def test_retention_cutoff():
+    # with 3 months retention in mid april, january is kept and december and older are dropped
+    assert retention_cutoff(3, datetime(2025, 4, 18)) == datetime(2025, 1, 1)
@@ -0,0 +1,83 @@
+import asyncio
+import pytest
+from fastapi.testclient import TestClient
+from prometheus_client import REGISTRY
+from sqlmodel import Session
+
+from app.models import User
+from app.passwords import PasswordHasher, PasswordHasherBusy, bcrypt_rounds, password_hasher
+from app.utils import get_hash_password
+
+
+@pytest.fixture(name="hasher")
+def hasher_fixture():
+    hasher = PasswordHasher(rounds=4, max_workers=2, queue_limit=8)
+    yield hasher
+    hasher.shutdown()
+
+
+@pytest.mark.anyio
+async def test_hash_and_verify(hasher: PasswordHasher):
+    observed = REGISTRY.get_sample_value("password_hash_run_seconds_count")
+    hashed = await hasher.hash("nanobots")
+
+    assert bcrypt_rounds(hashed) == 4
+    assert await hasher.verify("nanobots", hashed)
+    assert not await hasher.verify("wrong", hashed)
+    assert hasher.stats()["completed"] == 3
+    assert hasher.stats()["queue_depth"] == 0
+    assert REGISTRY.get_sample_value("password_hash_run_seconds_count") == observed + 3
+    assert REGISTRY.get_sample_value("password_hash_wait_seconds_count") >= 3
+
+@pytest.mark.anyio
+async def test_hashing_does_not_block_the_event_loop(hasher: PasswordHasher):
+    hasher.rounds = 10
+    ticks = 0
+
+    async def ticker():
+        nonlocal ticks
+        while True:
+            await asyncio.sleep(0.001)
+            ticks += 1
+
+    task = asyncio.create_task(ticker())
+    await hasher.hash("nanobots")
+    task.cancel()
+
+    assert ticks > 5
+
+@pytest.mark.anyio
+async def test_queue_limit_rejects(hasher: PasswordHasher):
+    hasher.queue_limit = 0
+    rejected = REGISTRY.get_sample_value("password_hash_rejected_total")
+
+    with pytest.raises(PasswordHasherBusy):
+        await hasher.hash("nanobots")
+    assert hasher.stats()["rejected"] == 1
+    assert REGISTRY.get_sample_value("password_hash_rejected_total") == rejected + 1
+
+def test_needs_rehash(hasher: PasswordHasher):
+    assert hasher.needs_rehash(get_hash_password("nanobots", rounds=4)) is False
+    hasher.rounds = 5
+    assert hasher.needs_rehash(get_hash_password("nanobots", rounds=4)) is True
+
+def test_login_upgrades_hash_cost(client: TestClient, session: Session, monkeypatch):
+    user = User(username="lowcost", email="lowcost@example.com", password=get_hash_password("nanobots", rounds=4))
+    session.add(user)
+    session.commit()
+    monkeypatch.setattr(password_hasher, "rounds", 5)
+
+    response = client.post('/login/', data={"username": "lowcost", "password": "nanobots"})
+    session.refresh(user)
+
+    assert response.status_code == 200
+    assert bcrypt_rounds(user.password) == 5
+    assert client.post('/login/', data={"username": "lowcost", "password": "nanobots"}).status_code == 200
+
+def test_login_busy(client: TestClient, dummy_user1: User, monkeypatch):
+    monkeypatch.setattr(password_hasher, "queue_limit", 0)
+
+    response = client.post('/login/', data={"username": dummy_user1.username, "password": "nanobots"})
+
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
@@ -0,0 +1,81 @@
+import logging
+import pytest
+from fastapi.testclient import TestClient
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.main import app
+from app.models import User
+from app.profiling import SQLProfile, SQLProfileMiddleware, profile_sql
+from app.utils import get_user_from_db
+from tests.conftest import grant_access_token
+
+
+def test_repeated_statements_are_flagged():
+    profile = SQLProfile()
+    profile.record("SELECT 1", 0.001, "app/a.py:1 f")
+    for _ in range(3):
+        profile.record("SELECT * FROM site WHERE url_key = ?", 0.002, "app/b.py:2 g")
+
+    assert profile.count == 4
+    assert profile.seconds == pytest.approx(0.007)
+    assert profile.repeated(3) == [("SELECT * FROM site WHERE url_key = ?", 3, ["app/b.py:2 g"])]
+    assert profile.repeated(4) == []
+    assert profile.summary(3) == "queries=4; time_ms=7.00; repeated=1"
+    assert "possible N+1, 3 times from app/b.py:2 g" in profile.report(3)
+
+@pytest.mark.anyio
+async def test_profile_records_app_call_sites(async_engine, dummy_user1: User):
+    async with AsyncSession(async_engine) as session:
+        with profile_sql() as profile:
+            for _ in range(3):
+                await get_user_from_db(dummy_user1.username, session)
+
+    assert profile.count == 3
+    statement, count, call_sites = profile.repeated(3)[0]
+    assert count == 3
+    assert call_sites[0].startswith("app/utils.py:") and call_sites[0].endswith("get_user_from_db")
+
+@pytest.mark.anyio
+async def test_statements_outside_a_profile_are_not_recorded(async_engine, dummy_user1: User):
+    async with AsyncSession(async_engine) as session:
+        with profile_sql() as profile:
+            pass
+        await get_user_from_db(dummy_user1.username, session)
+
+    assert profile.count == 0
+
+
+def test_profile_header_opt_in(client: TestClient, dummy_user1: User):
+    profiled = TestClient(SQLProfileMiddleware(app, allow_header=True))
+    headers = {"Authorization": f"Bearer {grant_access_token(dummy_user1)}"}
+
+    response = profiled.get('/users/me/', headers={**headers, "X-SQL-Profile": "1"})
+    assert response.status_code == 200
+    assert response.headers["x-sql-profile"].startswith("queries=2; time_ms=")
+
+    response = profiled.get('/users/me/', headers=headers)
+    assert "x-sql-profile" not in response.headers
+
+def test_profile_header_ignored_unless_allowed(client: TestClient):
+    response = TestClient(SQLProfileMiddleware(app)).get('/urls/no-such-key/', headers={"X-SQL-Profile": "1"})
+
+    assert response.status_code == 404
+    assert "x-sql-profile" not in response.headers
+
+def test_profile_report_logged(client: TestClient, dummy_user1: User, caplog):
+    profiled = TestClient(SQLProfileMiddleware(app, always=True))
+
+    with caplog.at_level(logging.INFO, logger="app.profiling"):
+        profiled.get('/users/me/', headers={"Authorization": f"Bearer {grant_access_token(dummy_user1)}"})
+
+    [record] = caplog.records
+    assert record.levelno == logging.INFO
+    assert "SQL profile of GET /users/me/" in record.getMessage()
+    assert "app/auth.py:" in record.getMessage()
+    assert "app/routing/users.py:" in record.getMessage()
+
+
+def test_query_budget_fails_over_budget(client: TestClient, query_budget):
+    with pytest.raises(AssertionError, match="1 statements over the budget of 0"):
+        with query_budget(0):
+            client.get('/urls/no-such-key/')
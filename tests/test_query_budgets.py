@@ -0,0 +1,99 @@
+from fastapi.testclient import TestClient
+from sqlmodel import Session
+
+from app.models import Site, User
+from tests.conftest import create_click_factory
+
+
+# Statements each endpoint may send. The first authenticated request of a test also loads the user,
+# later ones hit the principal cache. Raise a budget only together with the change that needs it.
+
+# ----------------------------------  sites.py ---------------------------
+
+def test_create_url_budget(authorized_client1: TestClient, query_budget):
+    with query_budget(2):
+        response = authorized_client1.post('/urls/', json={"target_url": "https://www.google.com", "length": 6})
+    assert response.status_code == 201
+
+def test_create_urls_bulk_budget(authorized_client1: TestClient, sample_url: Site, query_budget):
+    items = [{"target_url": f"https://example.com/{number}"} for number in range(20)] + [{"target_url": sample_url.target_url}]
+    with query_budget(3):
+        response = authorized_client1.post('/urls/bulk/', json=items)
+    assert response.status_code == 200
+
+def test_read_all_sites_budget(authorized_client1: TestClient, sample_urls_list: list[Site], query_budget):
+    with query_budget(3):
+        response = authorized_client1.get('/urls/all/', params={"limit": 1})
+    assert response.status_code == 200
+
+def test_export_budget(authorized_client1: TestClient, sample_urls_list: list[Site], query_budget):
+    with query_budget(2):
+        response = authorized_client1.get('/urls/export/')
+    assert response.status_code == 200
+
+def test_export_clicks_budget(authorized_client1: TestClient, session: Session, sample_urls_list: list[Site], query_budget):
+    for site in sample_urls_list:
+        for _ in range(3):
+            create_click_factory(session, site.url_key, "pytest")
+    with query_budget(2):
+        response = authorized_client1.get('/urls/export/clicks/')
+    assert response.status_code == 200
+
+def test_get_url_info_budget(authorized_client1: TestClient, session: Session, sample_url: Site, query_budget):
+    for _ in range(3):
+        create_click_factory(session, sample_url.url_key, "pytest")
+    with query_budget(7):
+        response = authorized_client1.get(f'/urls/info/{sample_url.url_key}/')
+    assert response.status_code == 200
+
+def test_get_url_info_not_modified_budget(authorized_client1: TestClient, sample_url: Site, query_budget):
+    etag = authorized_client1.get(f'/urls/info/{sample_url.url_key}/').headers['etag']
+    with query_budget(1):
+        response = authorized_client1.get(f'/urls/info/{sample_url.url_key}/', headers={"If-None-Match": etag})
+    assert response.status_code == 304
+
+def test_redirect_budget(client: TestClient, sample_url: Site, query_budget):
+    with query_budget(1):
+        client.get(f'/urls/{sample_url.url_key}/', follow_redirects=False)
+    with query_budget(0):
+        client.get(f'/urls/{sample_url.url_key}/', follow_redirects=False)
+
+def test_delete_url_budget(authorized_client1: TestClient, sample_url: Site, query_budget):
+    with query_budget(3):
+        response = authorized_client1.delete(f'/urls/{sample_url.url_key}/')
+    assert response.status_code == 204
+
+# ----------------------------------  users.py ---------------------------
+
+def test_signup_budget(client: TestClient, query_budget):
+    with query_budget(3):
+        response = client.post('/signup/', json={"username": "budget", "email": "budget@example.com", "password": "pw"})
+    assert response.status_code == 201
+
+def test_login_budget(client: TestClient, dummy_user1: User, query_budget):
+    with query_budget(1):
+        response = client.post('/login/', data={"username": dummy_user1.username, "password": "nanobots"})
+    assert response.status_code == 200
+
+def test_read_users_me_budget(authorized_client1: TestClient, query_budget):
+    with query_budget(2):
+        authorized_client1.get('/users/me/')
+    with query_budget(1):
+        response = authorized_client1.get('/users/me/')
+    assert response.status_code == 200
+
+def test_read_users_me_not_modified_budget(authorized_client1: TestClient, query_budget):
+    etag = authorized_client1.get('/users/me/').headers['etag']
+    with query_budget(1):
+        response = authorized_client1.get('/users/me/', headers={"If-None-Match": etag})
+    assert response.status_code == 304
+
+def test_update_users_me_budget(authorized_client1: TestClient, query_budget):
+    with query_budget(3):
+        response = authorized_client1.patch('/users/me/', json={"first_name": "Budget"})
+    assert response.status_code == 200
+
+def test_deactivate_users_me_budget(authorized_client1: TestClient, query_budget):
+    with query_budget(3):
+        response = authorized_client1.post('/users/me/deactivate/')
+    assert response.status_code == 204
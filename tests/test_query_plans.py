@@ -0,0 +1,43 @@
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+from sqlmodel import Session
+
+from app.models import Site
+from app.pagination import encode_cursor
+from tests.conftest import create_click_factory
+
+
+# Record every SELECT, UPDATE and DELETE the app sends while driving the routers
+def capture_statements(async_engine):
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith(("SELECT", "UPDATE", "DELETE")):
+            statements.append((statement, parameters))
+
+    event.listen(async_engine.sync_engine, "before_cursor_execute", before_cursor_execute)
+    return statements
+
+# Plan steps that read a whole table instead of searching an index
+def full_scans(engine, statement, parameters):
+    with engine.connect() as conn:
+        plan = conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters).all()
+    return [row[-1] for row in plan if row[-1].startswith("SCAN ")]
+
+
+def test_router_queries_use_indexes(authorized_client1: TestClient, engine, async_engine, session: Session, sample_url: Site):
+    create_click_factory(session, sample_url.url_key, "pytest")
+    statements = capture_statements(async_engine)
+
+    authorized_client1.post('/urls/', json={"target_url": "https://www.google.com", "length": 6})
+    authorized_client1.get('/urls/all/')
+    authorized_client1.get(f'/urls/info/{sample_url.url_key}/', params={"cursor": 0})
+    authorized_client1.get(f'/urls/{sample_url.url_key}/', follow_redirects=False)
+    authorized_client1.get('/users/me/')
+    authorized_client1.get('/urls/export/', params={"cursor": encode_cursor(sample_url.created_at, "a")})
+    authorized_client1.get('/urls/export/clicks/', params={"since": "2025-01-01"})
+    authorized_client1.delete(f'/urls/{sample_url.url_key}/')
+
+    assert len(statements) > 0
+    for statement, parameters in statements:
+        assert full_scans(engine, statement, parameters) == [], statement
@@ -0,0 +1,58 @@
+from datetime import datetime
+from typing import List
+
+from fastapi.responses import JSONResponse
+from fastapi.testclient import TestClient
+
+from app.models import Site, User
+from app.responses import FastJSONResponse, ModelSerializer
+from app.schemas import SiteInfo, SiteRead
+
+
+def test_fast_json_response_matches_json_response():
+    content = {"message": "Welcome", "items": [1, 2.5, None, True], "nested": {"name": "ünïcode ✓"}}
+
+    assert FastJSONResponse(content).body == JSONResponse(content).body
+
+def test_model_serializer_validates_and_dumps():
+    serializer = ModelSerializer(List[SiteRead])
+    sites = serializer.validate([{
+        "target_url": "https://example.com",
+        "url_key": "abc",
+        "created_at": datetime(2025, 4, 20, 10, 30),
+        "user": {"username": "user", "email": "user@example.com"},
+    }])
+
+    response = serializer.response(sites, headers={"X-Total-Count": "1"})
+
+    assert isinstance(sites[0], SiteRead)
+    assert response.media_type == "application/json"
+    assert response.headers["x-total-count"] == "1"
+    assert response.body == (
+        b'[{"target_url":"https://example.com","url_key":"abc","created_at":"2025-04-20T10:30:00",'
+        b'"total_clicks":0,"clicks_detail":[],"user":{"username":"user","email":"user@example.com"}}]'
+    )
+
+def test_site_info_serializes_click_rows():
+    info = SiteInfo(
+        target_url="https://example.com", url_key="abc", created_at=datetime(2025, 4, 20),
+        clicks_detail=[{"id": 1, "timestamp": datetime(2025, 4, 21, 8), "browser": "Chrome", "os": None, "device": "Other"}],
+        user={"username": "user", "email": "user@example.com"},
+    )
+
+    body = ModelSerializer(SiteInfo).dump(info)
+
+    assert b'"clicks_detail":[{"id":1,"timestamp":"2025-04-21T08:00:00","browser":"Chrome","os":null,"device":"Other"}]' in body
+
+def test_read_all_sites_response(authorized_client1: TestClient, dummy_user1: User, sample_url: Site):
+    response = authorized_client1.get('/urls/all/')
+
+    assert response.headers['content-type'] == "application/json"
+    assert response.json() == [{
+        "target_url": sample_url.target_url,
+        "url_key": sample_url.url_key,
+        "created_at": sample_url.created_at.isoformat(),
+        "total_clicks": 0,
+        "clicks_detail": [],
+        "user": {"username": dummy_user1.username, "email": dummy_user1.email},
+    }]
@@ -0,0 +1,73 @@
+import pytest
+from datetime import datetime
+from sqlmodel import Session, select
+
+from app.cli import rebuild_since
+from app.clicks import ClickQueue
+from app.models import Click, ClickDaily, ClickHourly, Site
+from app.rollups import rebuild_rollups
+from tests.conftest import create_click_factory
+
+
+CHROME = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
+
+@pytest.mark.anyio
+async def test_rollups_updated_on_ingest(async_engine, session: Session, sample_url: Site):
+    queue = ClickQueue(maxsize=100, batch_size=10, flush_interval=0.1)
+    for _ in range(3):
+        await queue.put(sample_url.url_key, CHROME)
+    await queue.flush(async_engine)
+    await queue.put(sample_url.url_key, None)
+    await queue.flush(async_engine)
+
+    session.refresh(sample_url)
+    hourly = session.exec(select(ClickHourly).order_by(ClickHourly.browser)).all()
+    daily = session.exec(select(ClickDaily).order_by(ClickDaily.browser)).all()
+
+    assert sample_url.total_clicks == 4
+    assert [(row.browser, row.os, row.clicks) for row in hourly] == [("Chrome", "Windows", 3), ("Other", "Other", 1)]
+    assert [row.clicks for row in daily] == [3, 1]
+    assert daily[0].bucket == hourly[0].bucket.replace(hour=0)
+
+@pytest.mark.anyio
+async def test_rebuild_rollups_matches_ingest(async_engine, session: Session, sample_url: Site):
+    queue = ClickQueue(maxsize=100, batch_size=2, flush_interval=0.1)
+    for _ in range(5):
+        await queue.put(sample_url.url_key, CHROME)
+    await queue.flush(async_engine)
+
+    processed = await rebuild_rollups(async_engine, chunk_size=2)
+
+    session.refresh(sample_url)
+    daily = session.exec(select(ClickDaily)).all()
+
+    assert processed == 5
+    assert sample_url.total_clicks == 5
+    assert [row.clicks for row in daily] == [5]
+
+@pytest.mark.anyio
+async def test_rebuild_rollups_since_keeps_older_aggregates(async_engine, session: Session, sample_url: Site):
+    create_click_factory(session, sample_url.url_key, CHROME, datetime(2025, 4, 20, 10))
+    create_click_factory(session, sample_url.url_key, CHROME, datetime(2025, 4, 21, 10))
+    await rebuild_rollups(async_engine)
+
+    # the raw click of the 20th expires, its aggregate must survive a partial rebuild
+    session.delete(session.exec(select(Click).where(Click.timestamp < datetime(2025, 4, 21))).one())
+    session.commit()
+    create_click_factory(session, sample_url.url_key, CHROME, datetime(2025, 4, 21, 12))
+    processed = await rebuild_rollups(async_engine, since=datetime(2025, 4, 21, 8))
+
+    session.refresh(sample_url)
+    daily = session.exec(select(ClickDaily).order_by(ClickDaily.bucket)).all()
+
+    assert processed == 2
+    assert sample_url.total_clicks == 3
+    assert [(row.bucket.day, row.clicks) for row in daily] == [(20, 1), (21, 2)]
+
+def test_rebuild_since_defaults_to_retention_cutoff():
+    now = datetime(2025, 4, 21, 10)
+
+    assert rebuild_since(None, False, 3, now) == datetime(2025, 1, 1)
+    assert rebuild_since(None, True, 3, now) is None
+    assert rebuild_since(None, False, None, now) is None
+    assert rebuild_since(datetime(2025, 4, 1), False, 3, now) == datetime(2025, 4, 1)
@@ -1,8 +1,17 @@
+import asyncio
+from datetime import datetime
 from fastapi.testclient import TestClient
 import pytest
 from typing import List
+from sqlmodel import Session, select
 
-from app.models import User, Site
+from app.cache import redirect_cache
+from app.clicks import click_queue
+from app.config import settings
+from app.keys import key_allocator
+from app.models import User, Site, Click
+from app.rollups import rebuild_rollups
+from tests.conftest import FixedKeyStrategy, create_click_factory
 
 
 # ----------------------------------  Create shorten url link tests ---------------------------
@@ -19,6 +28,15 @@ def test_create_url(authorized_client1: TestClient):
     assert data['target_url'] == "https://www.google.com"
     assert data['url_key'] is not None
 
+def test_create_url_duplicate(authorized_client1: TestClient, sample_url: Site):
+    response = authorized_client1.post(
+        '/urls/',
+        json={"target_url": sample_url.target_url, "length": 6}
+    )
+
+    assert response.status_code == 400
+    assert sample_url.target_url_hash is not None
+
 def test_create_url_unsuccessfull(authorized_client1: TestClient):
     response = authorized_client1.post(
         '/urls/',
@@ -52,6 +70,56 @@ def test_read_all_sites(authorized_client1: TestClient, dummy_user1: User, sampl
         assert link['url_key'] == site.url_key
         assert link['user']['username'] == site.user.username
 
+def test_read_all_sites_cursor_pages(authorized_client1: TestClient, session: Session, dummy_user1: User):
+    sites = [Site(target_url=f"https://example.com/{i}", url_key=f"key{i:03}", user=dummy_user1, created_at=datetime(2025, 1, 1 + i // 2)) for i in range(5)]
+    session.add_all(sites)
+    session.commit()
+
+    pages, cursor = [], None
+    while True:
+        response = authorized_client1.get('/urls/all/', params={"limit": 2, **({"cursor": cursor} if cursor else {})})
+        assert response.headers["X-Total-Count"] == "5"
+        pages.append([link["url_key"] for link in response.json()])
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            break
+
+    assert pages == [["key000", "key001"], ["key002", "key003"], ["key004"]]
+
+def test_read_all_sites_filters(authorized_client1: TestClient, session: Session, dummy_user1: User):
+    session.add_all([
+        Site(target_url="https://example.com/a", url_key="key001", user=dummy_user1, created_at=datetime(2025, 1, 1)),
+        Site(target_url="https://example.com/b", url_key="key002", user=dummy_user1, created_at=datetime(2025, 3, 1)),
+        Site(target_url="https://example.org/%", url_key="key003", user=dummy_user1, created_at=datetime(2025, 3, 2)),
+    ])
+    session.commit()
+
+    by_prefix = authorized_client1.get('/urls/all/', params={"target_prefix": "https://example.com/"})
+    by_date = authorized_client1.get('/urls/all/', params={"since": "2025-02-01", "until": "2025-03-02T00:00:00Z"})
+    escaped = authorized_client1.get('/urls/all/', params={"target_prefix": "https://example.org/%"})
+
+    assert [link["url_key"] for link in by_prefix.json()] == ["key001", "key002"]
+    assert [link["url_key"] for link in by_date.json()] == ["key002"]
+    assert [link["url_key"] for link in escaped.json()] == ["key003"]
+    assert authorized_client1.get('/urls/all/', params={"target_prefix": "https://example.com/%"}).status_code == 404
+
+def test_read_all_sites_not_modified(authorized_client1: TestClient, sample_url: Site):
+    etag = authorized_client1.get('/urls/all/').headers['etag']
+    response = authorized_client1.get('/urls/all/', headers={"If-None-Match": f'"other", {etag}'})
+
+    assert response.status_code == 304
+
+    authorized_client1.post('/urls/', json={"target_url": "https://example.com/new"})
+    response = authorized_client1.get('/urls/all/', headers={"If-None-Match": etag})
+
+    assert response.status_code == 200
+    assert len(response.json()) == 2
+
+def test_read_all_sites_invalid_cursor(authorized_client1: TestClient, sample_url: Site):
+    response = authorized_client1.get('/urls/all/', params={"cursor": "bogus"})
+
+    assert response.status_code == 400
+
 def test_read_all_sites_unsuccessfull(authorized_client1: TestClient):
     response = authorized_client1.get('/urls/all/')
 
@@ -75,6 +143,51 @@ def test_get_url_info(authorized_client1: TestClient, sample_url: Site):
     assert data['url_key'] == sample_url.url_key
     assert data['user']['username'] == sample_url.user.username
 
+def test_get_url_info_click_stats(authorized_client1: TestClient, async_engine, session: Session, sample_url: Site):
+    chrome = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
+    iphone = "Mozilla/5.0 (iPhone; CPU iPhone OS 17_0 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.0 Mobile/15E148 Safari/604.1"
+    create_click_factory(session, sample_url.url_key, chrome, datetime(2025, 4, 20, 10))
+    create_click_factory(session, sample_url.url_key, chrome, datetime(2025, 4, 21, 10))
+    create_click_factory(session, sample_url.url_key, iphone, datetime(2025, 4, 21, 11))
+    asyncio.run(rebuild_rollups(async_engine))
+
+    response = authorized_client1.get(f'/urls/info/{sample_url.url_key}/', params={"limit": 2})
+    data = response.json()
+
+    assert response.status_code == 200
+    assert data['total_clicks'] == 3
+    assert data['clicks_per_day'] == {"2025-04-20": 1, "2025-04-21": 2}
+    assert data['browsers'] == {"Chrome": 2, "Mobile Safari": 1}
+    assert data['operating_systems'] == {"Windows": 2, "iOS": 1}
+    assert data['devices'] == {"Other": 2, "iPhone": 1}
+    assert len(data['clicks_detail']) == 2
+    assert data['clicks_detail'][0]['browser'] == "Chrome"
+
+    response = authorized_client1.get(f'/urls/info/{sample_url.url_key}/', params={"limit": 2, "cursor": data['next_cursor']})
+    data = response.json()
+
+    assert [click['browser'] for click in data['clicks_detail']] == ["Mobile Safari"]
+    assert data['next_cursor'] is None
+
+def test_get_url_info_not_modified(authorized_client1: TestClient, session: Session, sample_url: Site):
+    response = authorized_client1.get(f'/urls/info/{sample_url.url_key}/')
+    etag = response.headers['etag']
+
+    assert response.headers['cache-control'] == "private, no-cache"
+
+    response = authorized_client1.get(f'/urls/info/{sample_url.url_key}/', headers={"If-None-Match": etag})
+
+    assert response.status_code == 304
+    assert response.headers['etag'] == etag
+    assert response.content == b""
+
+    create_click_factory(session, sample_url.url_key, "pytest")
+    response = authorized_client1.get(f'/urls/info/{sample_url.url_key}/', headers={"If-None-Match": etag})
+
+    assert response.status_code == 200
+    assert response.headers['etag'] != etag
+    assert len(response.json()['clicks_detail']) == 1
+
 def test_get_url_info_unsuccessfull(authorized_client1: TestClient):
     response = authorized_client1.get(f'/urls/info/{1}/')
 
@@ -88,17 +201,75 @@ def test_get_url_info_unauthorized(client: TestClient, sample_url: Site):
 
 # ----------------------------------  Get a target link tests ---------------------------
 
-# def test_get_target_url(client: TestClient, sample_url: Site):
-#     response = client.get(f'/urls/{sample_url.url_key}/')
-#     print(sample_url.url_key)
+def test_get_target_url(client: TestClient, sample_url: Site):
+    response = client.get(f'/urls/{sample_url.url_key}/', follow_redirects=False)
+
+    assert response.status_code == 307
+    assert response.headers['location'] == sample_url.target_url
+    assert redirect_cache.get(sample_url.url_key) == sample_url.target_url
+
+def test_get_target_url_cached(client: TestClient, sample_url: Site):
+    client.get(f'/urls/{sample_url.url_key}/', follow_redirects=False)
+    response = client.get(f'/urls/{sample_url.url_key}/', follow_redirects=False)
+
+    assert response.status_code == 307
+    assert redirect_cache.hits == 1
+
+def test_get_target_url_records_click(client: TestClient, async_engine, session: Session, sample_url: Site):
+    client.get(f'/urls/{sample_url.url_key}/', follow_redirects=False, headers={"User-Agent": "pytest"})
+
+    assert session.exec(select(Click)).all() == []
+    assert click_queue.depth() == 1
 
-#     assert response.status_code == 307
+    asyncio.run(click_queue.flush(async_engine))
+    clicks = session.exec(select(Click)).all()
+
+    assert click_queue.depth() == 0
+    assert len(clicks) == 1
+    assert clicks[0].url_id == sample_url.url_key
+    assert clicks[0].agent.user_agent == "pytest"
 
 def test_get_target_url_unsuccessfull(client: TestClient):
     response = client.get(f'/urls/{1}/')
 
     assert response.status_code == 404
 
+def test_get_target_url_status_and_cache_control(client: TestClient, sample_url: Site, monkeypatch):
+    monkeypatch.setattr(settings, "redirect_status_code", 301)
+    monkeypatch.setattr(settings, "redirect_cache_control", "private, max-age=60")
+
+    response = client.get(f'/urls/{sample_url.url_key}/', follow_redirects=False)
+
+    assert response.status_code == 301
+    assert response.headers['location'] == sample_url.target_url
+    assert response.headers['cache-control'] == "private, max-age=60"
+
+def test_get_target_url_quotes_location(client: TestClient, session: Session, dummy_user1: User):
+    session.add(Site(target_url="https://example.com/ünï code?q=a b", url_key="quoted", user=dummy_user1))
+    session.commit()
+
+    response = client.get('/urls/quoted/', follow_redirects=False)
+
+    assert response.status_code == 307
+    assert response.headers['location'] == "https://example.com/%C3%BCn%C3%AF%20code?q=a%20b"
+
+def test_get_target_url_remembers_missing_keys(client: TestClient, query_budget):
+    client.get('/urls/nokey1/')
+    with query_budget(0):
+        response = client.get('/urls/nokey1/')
+
+    assert response.status_code == 404
+
+def test_create_url_forgets_missing_key(authorized_client1: TestClient, monkeypatch):
+    monkeypatch.setattr(key_allocator, "strategy", FixedKeyStrategy(["probed"]))
+    assert authorized_client1.get('/urls/probed/').status_code == 404
+
+    authorized_client1.post('/urls/', json={"target_url": "https://www.google.com", "length": 6})
+    response = authorized_client1.get('/urls/probed/', follow_redirects=False)
+
+    assert response.status_code == 307
+    assert response.headers['location'] == "https://www.google.com"
+
 
 # ----------------------------------  Delete url tests ---------------------------
 
@@ -107,6 +278,22 @@ def test_delete_url(authorized_client1: TestClient, sample_url: Site):
 
     assert response.status_code == 204
 
+def test_delete_url_removes_clicks(authorized_client1: TestClient, session: Session, sample_url: Site):
+    create_click_factory(session, sample_url.url_key, "pytest")
+
+    response = authorized_client1.delete(f'/urls/{sample_url.url_key}/')
+
+    assert response.status_code == 204
+    assert session.exec(select(Click)).all() == []
+
+def test_delete_url_invalidates_cache(authorized_client1: TestClient, sample_url: Site):
+    authorized_client1.get(f'/urls/{sample_url.url_key}/', follow_redirects=False)
+    authorized_client1.delete(f'/urls/{sample_url.url_key}/')
+    response = authorized_client1.get(f'/urls/{sample_url.url_key}/', follow_redirects=False)
+
+    assert redirect_cache.get(sample_url.url_key) is None
+    assert response.status_code == 404
+
 def test_delete_url_unsuccessfull(authorized_client1: TestClient):
     response = authorized_client1.delete(f'/urls/{1}/')
 
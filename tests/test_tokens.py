@@ -0,0 +1,111 @@
+import json
+from datetime import timedelta
+import jwt
+import pytest
+from fastapi.testclient import TestClient
+
+from app.cache import LRUCache
+from app.tokens import TokenKey, TokenService, build_token_key
+
+serialization = pytest.importorskip("cryptography.hazmat.primitives.serialization")
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519
+
+
+def private_pem(private_key) -> str:
+    return private_key.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption(),
+    ).decode("ascii")
+
+def public_pem(private_key) -> str:
+    return private_key.public_key().public_bytes(
+        serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo,
+    ).decode("ascii")
+
+@pytest.fixture(scope="module")
+def ec_key():
+    return ec.generate_private_key(ec.SECP256R1())
+
+@pytest.fixture(scope="module")
+def ed_key():
+    return ed25519.Ed25519PrivateKey.generate()
+
+
+def test_hs256_round_trip_and_cache():
+    service = TokenService(build_token_key("HS256", secret="test"), cache=LRUCache(maxsize=10, ttl=60))
+    token = service.encode({"sub": "alice"}, timedelta(minutes=5))
+
+    assert service.decode(token)["sub"] == "alice"
+    assert service.decode(token)["sub"] == "alice"
+    assert service.cache.stats()["hits"] == 1
+    # tokens issued before the service existed still verify
+    assert jwt.decode(token, "test", algorithms=["HS256"])["sub"] == "alice"
+
+def test_expired_token_rejected_from_cache():
+    service = TokenService(build_token_key("HS256", secret="test"), cache=LRUCache(maxsize=10, ttl=60))
+    token = service.encode({"sub": "alice"}, timedelta(seconds=60))
+    service.decode(token)
+    service.cache.set(token, {"sub": "alice", "exp": 0})
+
+    with pytest.raises(jwt.ExpiredSignatureError):
+        service.decode(token)
+
+@pytest.mark.parametrize("algorithm, key_fixture", [("ES256", "ec_key"), ("EdDSA", "ed_key")])
+def test_asymmetric_verify_only_node(algorithm: str, key_fixture: str, request):
+    private_key = request.getfixturevalue(key_fixture)
+    issuer = TokenService(build_token_key(algorithm, kid="k1", private_key=private_pem(private_key)))
+    edge = TokenService(build_token_key(algorithm, kid="k1", public_key=public_pem(private_key)))
+
+    token = issuer.encode({"sub": "alice"}, timedelta(minutes=5))
+
+    assert jwt.get_unverified_header(token)["kid"] == "k1"
+    assert edge.decode(token)["sub"] == "alice"
+    with pytest.raises(RuntimeError):
+        edge.encode({"sub": "alice"}, timedelta(minutes=5))
+
+def test_key_rotation_with_kid(ec_key, ed_key):
+    old = build_token_key("ES256", kid="2025", private_key=private_pem(ec_key))
+    new = build_token_key("EdDSA", kid="2026", private_key=private_pem(ed_key))
+    old_token = TokenService(old).encode({"sub": "alice"}, timedelta(minutes=5))
+
+    rotated = TokenService(new, extra_keys=[old])
+    new_token = rotated.encode({"sub": "bob"}, timedelta(minutes=5))
+
+    assert rotated.decode(old_token)["sub"] == "alice"
+    assert rotated.decode(new_token)["sub"] == "bob"
+    with pytest.raises(jwt.InvalidTokenError):
+        TokenService(new).decode(old_token)
+
+def test_token_without_kid_uses_active_key(ec_key, ed_key):
+    active = build_token_key("EdDSA", kid="2026", private_key=private_pem(ed_key))
+    old = build_token_key("ES256", kid="2025", private_key=private_pem(ec_key))
+    service = TokenService(active, extra_keys=[old])
+    token = jwt.encode({"sub": "alice", "exp": 2 ** 32}, active.signer, algorithm="EdDSA")
+
+    assert "kid" not in jwt.get_unverified_header(token)
+    assert service.decode(token)["sub"] == "alice"
+    with pytest.raises(jwt.InvalidTokenError):
+        service.decode(jwt.encode({"sub": "alice"}, active.signer, algorithm="EdDSA", headers={"kid": "1999"}))
+
+def test_jwks_lets_other_nodes_verify(ed_key):
+    issuer = TokenService(build_token_key("EdDSA", kid="2026", private_key=private_pem(ed_key)))
+    jwks = issuer.jwks()
+
+    assert [key["kid"] for key in jwks["keys"]] == ["2026"]
+    assert "d" not in jwks["keys"][0]
+
+    edge_key = jwt.PyJWKSet.from_json(json.dumps(jwks)).keys[0]
+    edge = TokenService(build_token_key("HS256", secret="unused"), extra_keys=[TokenKey(edge_key.key_id, edge_key.algorithm_name, edge_key)])
+    assert edge.decode(issuer.encode({"sub": "alice"}, timedelta(minutes=5)))["sub"] == "alice"
+
+def test_algorithm_confusion_rejected(ec_key):
+    service = TokenService(build_token_key("ES256", private_key=private_pem(ec_key)))
+    forged = jwt.encode({"sub": "mallory"}, "secret", algorithm="HS256")
+
+    with pytest.raises(jwt.InvalidTokenError):
+        service.decode(forged)
+
+def test_jwks_endpoint_hides_shared_secret(client: TestClient):
+    response = client.get('/.well-known/jwks.json')
+
+    assert response.status_code == 200
+    assert response.json() == {"keys": []}
@@ -2,8 +2,12 @@ from fastapi.testclient import TestClient
 import jwt
 import pytest
 
+from sqlalchemy import event
+from sqlmodel import Session
+
+from app.auth import create_access_token, principal_cache
 from app.config import settings
-from app.models import User
+from app.models import User, get_utc_now
 
 
 # ------------------------------  Sign Up Route Tests ---------------------------------
@@ -91,8 +95,85 @@ def test_read_users_me(authorized_client1: TestClient, dummy_user1: User):
     assert data['id'] == dummy_user1.id
     assert data['active'] == dummy_user1.active
 
+def test_read_users_me_not_modified(authorized_client1: TestClient):
+    response = authorized_client1.get('/users/me/')
+    etag, last_modified = response.headers['etag'], response.headers['last-modified']
+
+    assert authorized_client1.get('/users/me/', headers={"If-None-Match": etag}).status_code == 304
+    assert authorized_client1.get('/users/me/', headers={"If-Modified-Since": last_modified}).status_code == 304
+
+    authorized_client1.patch('/users/me/', json={"first_name": "Aporva"})
+    response = authorized_client1.get('/users/me/', headers={"If-None-Match": etag})
+
+    assert response.status_code == 200
+    assert response.headers['etag'] != etag
+    assert response.json()['first_name'] == "Aporva"
+
+def test_read_users_me_not_modified_checks_the_row(authorized_client1: TestClient, session: Session, dummy_user1: User):
+    etag = authorized_client1.get('/users/me/').headers['etag']
+
+    # changed through another worker, this worker's cached principal still has the old updated_at
+    dummy_user1.last_name = "Nayar"
+    dummy_user1.updated_at = get_utc_now()
+    session.add(dummy_user1)
+    session.commit()
+    response = authorized_client1.get('/users/me/', headers={"If-None-Match": etag})
+
+    assert principal_cache.get(dummy_user1.username) is not None
+    assert response.status_code == 200
+    assert response.json()['last_name'] == "Nayar"
+
 def test_read_users_me_unauthorized(client: TestClient):
     response = client.get('/users/me/')
 
     assert response.status_code == 401
 
+
+def test_authenticated_user_is_cached(authorized_client1: TestClient, async_engine, dummy_user1: User):
+    statements = []
+    event.listen(async_engine.sync_engine, "before_cursor_execute", lambda conn, cursor, statement, *args: statements.append(statement))
+
+    authorized_client1.get('/urls/all/')
+    authorized_client1.get('/urls/all/')
+
+    user_lookups = [statement for statement in statements if "username" in statement]
+    assert len(user_lookups) == 1
+    assert principal_cache.get(dummy_user1.username).id == dummy_user1.id
+
+def test_update_users_me(authorized_client1: TestClient, session: Session, dummy_user1: User):
+    authorized_client1.get('/urls/all/')
+
+    response = authorized_client1.patch('/users/me/', json={"first_name": "Aporva"})
+
+    data = response.json()
+    session.refresh(dummy_user1)
+
+    assert response.status_code == 200
+    assert data['first_name'] == "Aporva"
+    assert data['last_name'] is None
+    assert dummy_user1.first_name == "Aporva"
+    assert principal_cache.get(dummy_user1.username) is None
+
+def test_deactivate_users_me(authorized_client1: TestClient, session: Session, dummy_user1: User):
+    authorized_client1.get('/urls/all/')
+
+    response = authorized_client1.post('/users/me/deactivate/')
+    session.refresh(dummy_user1)
+
+    assert response.status_code == 204
+    assert dummy_user1.active is False
+    assert authorized_client1.get('/urls/all/').status_code == 400
+
+def test_token_user_id_must_match(client: TestClient, dummy_user1: User):
+    token = create_access_token(data={"sub": dummy_user1.username, "uid": dummy_user1.id + 1})
+
+    response = client.get('/users/me/', headers={"Authorization": f"Bearer {token}"})
+
+    assert response.status_code == 401
+
+def test_login_token_carries_user_id(client: TestClient, dummy_user1: User):
+    response = client.post('/login/', data={"username": dummy_user1.username, "password": "nanobots"})
+
+    payload = jwt.decode(response.json()['access_token'], settings.secret_key, algorithms=[settings.algorithm])
+
+    assert payload['uid'] == dummy_user1.id